@@ -1,32 +1,97 @@
 import os
+import json
 import logging
-from typing import List, Dict, Any
-import httpx
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import List, Dict, Any, Callable, Iterator, Optional
 
-try:
-    from openai import OpenAI
+import ai_limits
+import ai_router
+import language
+import resilience
+from cache import TTLCache, make_key
+
+logger = logging.getLogger(__name__)
+
+# Provider SDKs (and httpx) are slow to import and optional, so they are
+# loaded on first use by the provider that needs them, not when the API starts.
+
+@lru_cache(maxsize=None)
+def _openai():
+    """The `openai` module, or None when it is not installed."""
+    try:
+        import openai
+    except Exception:  # pragma: no cover - optional dependency until configured
+        return None
+    return openai
+
+@lru_cache(maxsize=None)
+def _genai():
+    """The `google.generativeai` module (Gemini), or None when it is not installed."""
     try:
-        from openai import AzureOpenAI  # Available in openai>=1.0
+        import google.generativeai as genai
     except Exception:
-        AzureOpenAI = None  # type: ignore
-except Exception:  # pragma: no cover - optional dependency until configured
-    OpenAI = None  # type: ignore
+        return None
+    return genai
 
-# Gemini (Google Generative AI)
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None  # type: ignore
+def _httpx():
+    import httpx
+    return httpx
 
-logger = logging.getLogger(__name__)
+# Connection pool of each provider's HTTP client
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "20"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "10"))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "30"))
+AI_HTTP_TIMEOUT = float(os.getenv("AI_HTTP_TIMEOUT", "60"))
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "10"))
+
+def _new_http_client():
+    """Keep-alive httpx client with the AI_HTTP_* pool limits and timeouts."""
+    httpx = _httpx()
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=AI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=AI_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(AI_HTTP_TIMEOUT, connect=AI_HTTP_CONNECT_TIMEOUT),
+    )
+
+_gemini_models: Dict[tuple, Any] = {}
+_gemini_lock = threading.Lock()
+
+def _gemini_model(model_name: str, system_instruction: Optional[str] = None):
+    """Shared GenerativeModel per (model, system instruction); Gemini keeps its own transport."""
+    key = (model_name, system_instruction)
+    with _gemini_lock:
+        model = _gemini_models.get(key)
+        if model is None:
+            model = _gemini_models[key] = _genai().GenerativeModel(model_name, system_instruction=system_instruction)
+        return model
 
 class AIConfigError(Exception):
     pass
 
+def _gemini_contents(messages: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    # Gemini expects history with roles: 'user' or 'model'
+    # Map 'assistant' -> 'model'
+    contents = []
+    for m in messages:
+        role = m.get("role", "user")
+        if role == "assistant":
+            role = "model"
+        elif role not in ("user", "model"):
+            role = "user"
+        contents.append({"role": role, "parts": [m.get("content", "")]})
+    return contents
+
 class AIClient:
-    def __init__(self):
-        self.provider = os.getenv("AI_PROVIDER", "openai").lower()
-        self.model = os.getenv("AI_MODEL", "gpt-4o-mini")
+    def __init__(self, provider: Optional[str] = None):
+        self.provider = (provider or os.getenv("AI_PROVIDER", "openai")).lower()
+        # AI_MODEL_<PROVIDER> (e.g. AI_MODEL_GEMINI) overrides AI_MODEL when several providers are routed
+        self.model = os.getenv(f"AI_MODEL_{self.provider.upper()}") or os.getenv("AI_MODEL", "gpt-4o-mini")
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.organization = os.getenv("OPENAI_ORG_ID")
         self.project = os.getenv("OPENAI_PROJECT_ID")
@@ -41,8 +106,11 @@ class AIClient:
         self.or_app_name = os.getenv("OPENROUTER_APP_NAME", "BMS Health Assistant")
         # Gemini (accept both GEMINI_API_KEY and gemini_API_KEY)
         self.gemini_api_key = os.getenv("GEMINI_API_KEY") or os.getenv("gemini_API_KEY")
+        # Pooled HTTP client for the OpenAI-compatible providers
+        self.http = None
 
         if self.provider == "openai":
+            OpenAI = getattr(_openai(), "OpenAI", None)
             if not self.api_key or OpenAI is None:
                 raise AIConfigError("OpenAI not configured. Set OPENAI_API_KEY and install 'openai' package.")
             # Pass optional org/project if provided (helps with sk-proj- keys)
@@ -51,24 +119,30 @@ class AIClient:
                 kwargs["organization"] = self.organization
             if self.project:
                 kwargs["project"] = self.project
-            self.client = OpenAI(**kwargs)
+            self.http = _new_http_client()
+            self.client = OpenAI(http_client=self.http, **kwargs)
         elif self.provider == "azure":
+            AzureOpenAI = getattr(_openai(), "AzureOpenAI", None)  # Available in openai>=1.0
             if AzureOpenAI is None:
                 raise AIConfigError("AzureOpenAI client not available. Upgrade 'openai' package to >=1.0.")
             if not (self.azure_endpoint and self.api_key and self.azure_deployment):
                 raise AIConfigError("Azure OpenAI requires AZURE_OPENAI_ENDPOINT, OPENAI_API_KEY, and AZURE_OPENAI_DEPLOYMENT.")
             # AzureOpenAI uses 'api_version' and 'azure_endpoint'; API key is the same OPENAI_API_KEY env here
+            self.http = _new_http_client()
             self.client = AzureOpenAI(
                 api_key=self.api_key,
                 api_version=self.azure_api_version,
                 azure_endpoint=self.azure_endpoint,
+                http_client=self.http,
             )
         elif self.provider == "openrouter":
             if not (self.or_api_key):
                 raise AIConfigError("OpenRouter not configured. Set OPENROUTER_API_KEY.")
             # We'll use httpx client; no SDK required
+            self.http = _new_http_client()
             self.client = None
         elif self.provider == "gemini":
+            genai = _genai()
             if genai is None or not self.gemini_api_key:
                 raise AIConfigError("Gemini not configured. Install 'google-generativeai' and set GEMINI_API_KEY.")
             # Configure globally; model built on demand in chat()
@@ -77,12 +151,22 @@ class AIClient:
         else:
             raise AIConfigError(f"Unsupported AI_PROVIDER: {self.provider}")
 
-    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int = 600) -> str:
-        """Call the model with OpenAI Chat Completions, falling back to Responses API if needed."""
+    def _sdk(self, timeout: Optional[float]):
+        """The OpenAI/Azure SDK client, bounded by `timeout` and without retries when one is given."""
+        if timeout is None:
+            return self.client
+        return self.client.with_options(timeout=timeout, max_retries=0)
+
+    def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int = 600, timeout: Optional[float] = None) -> str:
+        """Call the model with OpenAI Chat Completions, falling back to Responses API if needed.
+
+        `timeout` (seconds) overrides the client's default request timeout.
+        """
         if self.provider == "openai":
+            started = time.monotonic()
             # First try Chat Completions API
             try:
-                resp = self.client.chat.completions.create(
+                resp = self._sdk(timeout).chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=temperature,
@@ -90,6 +174,11 @@ class AIClient:
                 )
                 return resp.choices[0].message.content or ""
             except Exception as e_chat:  # Try Responses API as fallback
+                if timeout is not None:
+                    # The fallback only gets what is left of the timeout
+                    timeout -= time.monotonic() - started
+                    if timeout <= 0:
+                        raise
                 logger.warning(f"Chat Completions failed, trying Responses API: {e_chat}")
                 try:
                     # Convert messages into a single input text
@@ -99,7 +188,7 @@ class AIClient:
                         content = m.get("content", "")
                         parts.append(f"{role.upper()}: {content}")
                     input_text = "\n\n".join(parts)
-                    resp = self.client.responses.create(
+                    resp = self._sdk(timeout).responses.create(
                         model=self.model,
                         input=input_text,
                         temperature=temperature,
@@ -120,7 +209,7 @@ class AIClient:
         elif self.provider == "azure":
             # Azure uses deployment name in 'model' field
             try:
-                resp = self.client.chat.completions.create(
+                resp = self._sdk(timeout).chat.completions.create(
                     model=self.azure_deployment,
                     messages=messages,
                     temperature=temperature,
@@ -133,27 +222,20 @@ class AIClient:
         elif self.provider == "openrouter":
             # OpenRouter offers OpenAI-compatible /chat/completions
             try:
-                headers = {
-                    "Authorization": f"Bearer {self.or_api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": self.or_site_url,
-                    "X-Title": self.or_app_name,
-                }
                 payload = {
                     "model": self.model,
                     "messages": messages,
                     "temperature": temperature,
                     "max_tokens": max_tokens,
                 }
-                url = f"{self.or_base_url.rstrip('/')}/chat/completions"
-                with httpx.Client(timeout=60) as client:
-                    r = client.post(url, headers=headers, json=payload)
-                    r.raise_for_status()
-                    data = r.json()
-                    # Same shape as OpenAI chat completions
-                    return (data.get("choices", [{}])[0]
-                                .get("message", {})
-                                .get("content", ""))
+                extra = {"timeout": timeout} if timeout is not None else {}
+                r = self.http.post(self._openrouter_url(), headers=self._openrouter_headers(), json=payload, **extra)
+                r.raise_for_status()
+                data = r.json()
+                # Same shape as OpenAI chat completions
+                return (data.get("choices", [{}])[0]
+                            .get("message", {})
+                            .get("content", ""))
             except Exception as e:
                 logger.error(f"OpenRouter chat error: {e}")
                 raise
@@ -162,18 +244,9 @@ class AIClient:
             try:
                 # Build model with safety system prompt
                 model_name = self.model or "gemini-1.5-flash"
-                model = genai.GenerativeModel(model_name, system_instruction=SAFETY_SYSTEM_PROMPT)
-                # Gemini expects history with roles: 'user' or 'model'
-                # Map 'assistant' -> 'model'
-                contents = []
-                for m in messages:
-                    role = m.get("role", "user")
-                    if role == "assistant":
-                        role = "model"
-                    elif role not in ("user", "model"):
-                        role = "user"
-                    contents.append({"role": role, "parts": [m.get("content", "")]})
-                resp = model.generate_content(contents)
+                model = _gemini_model(model_name, SAFETY_SYSTEM_PROMPT)
+                extra = {"request_options": {"timeout": timeout}} if timeout is not None else {}
+                resp = model.generate_content(_gemini_contents(messages), **extra)
                 # Response may have candidates; take first text
                 if hasattr(resp, "text") and resp.text:
                     return resp.text
@@ -187,32 +260,250 @@ class AIClient:
                 raise
         raise AIConfigError("AI client not properly configured")
 
+    def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int = 600) -> Iterator[str]:
+        """Like chat(), but yield text fragments as the provider generates them."""
+        if self.provider in ("openai", "azure"):
+            model = self.azure_deployment if self.provider == "azure" else self.model
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        elif self.provider == "openrouter":
+            payload = {
+                "model": self.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True,
+            }
+            with self.http.stream("POST", self._openrouter_url(), headers=self._openrouter_headers(), json=payload) as r:
+                r.raise_for_status()
+                # OpenAI-compatible SSE: "data: {chunk}" lines ending with "data: [DONE]"
+                for line in r.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = (json.loads(data).get("choices") or [{}])[0].get("delta", {})
+                    if delta.get("content"):
+                        yield delta["content"]
+        elif self.provider == "gemini":
+            model = _gemini_model(self.model or "gemini-1.5-flash", SAFETY_SYSTEM_PROMPT)
+            for chunk in model.generate_content(_gemini_contents(messages), stream=True):
+                text = getattr(chunk, "text", "")
+                if text:
+                    yield text
+        else:
+            raise AIConfigError("AI client not properly configured")
+
+    def _openrouter_url(self) -> str:
+        return f"{self.or_base_url.rstrip('/')}/chat/completions"
+
+    def _openrouter_headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.or_api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": self.or_site_url,
+            "X-Title": self.or_app_name,
+        }
+
+    def close(self) -> None:
+        """Close pooled connections."""
+        if self.http is not None:
+            self.http.close()
+
+# Process-wide clients, built on first use and reused by every request
+_clients: Dict[str, AIClient] = {}
+_clients_lock = threading.Lock()
+
+def get_ai_client(provider: Optional[str] = None) -> AIClient:
+    """Shared AIClient for `provider` (default AI_PROVIDER). Raises AIConfigError if it is not configured."""
+    provider = (provider or os.getenv("AI_PROVIDER", "openai")).lower()
+    client = _clients.get(provider)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = _clients[provider] = AIClient(provider)
+    return client
+
+# Providers routed by latency (see ai_router.py); a single provider bypasses the router
+AI_PROVIDERS = [p.strip().lower() for p in os.getenv("AI_PROVIDERS", "").split(",") if p.strip()]
+
+_router: Optional[ai_router.Router] = None
+_router_built = False
+
+# Errors that say nothing about the provider's health and so leave its breaker alone
+_NOT_PROVIDER_FAULTS = (AIConfigError, ai_limits.AIQueueTimeout, resilience.DeadlineExceeded)
+
+def _guarded(provider: str, fn: Callable[[Optional[float]], Any]) -> Any:
+    """fn(timeout) behind the provider's circuit breaker and concurrency slot.
+
+    The timeout is what is left of the request deadline once a slot is free
+    (None without a deadline). Raises resilience.CircuitOpenError while the
+    provider's breaker is open, and resilience.DeadlineExceeded for any error
+    (typically the SDK's own timeout) raised once the deadline has passed.
+    """
+    def attempt():
+        with ai_limits.limiter(provider).slot():
+            return fn(resilience.stage_timeout())
+    try:
+        return resilience.breaker(provider).call(attempt, ignore=_NOT_PROVIDER_FAULTS)
+    except resilience.FailFast:
+        raise
+    except Exception as e:
+        left = resilience.remaining()
+        if left is not None and left <= 0:
+            raise resilience.DeadlineExceeded(f"AI request deadline exceeded calling {provider}: {e}") from e
+        raise
+
+def _limited_chat(provider: str, messages: List[Dict[str, str]]) -> str:
+    return _guarded(provider, lambda timeout: get_ai_client(provider).chat(messages, timeout=timeout))
+
+def get_router() -> Optional[ai_router.Router]:
+    """Router over the configured AI_PROVIDERS, or None when fewer than two are usable."""
+    global _router, _router_built
+    if _router_built:
+        return _router
+    with _clients_lock:
+        if not _router_built:
+            usable = []
+            for provider in AI_PROVIDERS:
+                try:
+                    if provider not in _clients:
+                        _clients[provider] = AIClient(provider)
+                    usable.append(provider)
+                except AIConfigError as e:
+                    logger.warning(f"Skipping AI provider {provider}: {e}")
+            if len(usable) > 1:
+                _router = ai_router.Router(
+                    {provider: (lambda messages, provider=provider: _limited_chat(provider, messages)) for provider in usable}
+                )
+            _router_built = True
+    return _router
+
+def route_stats() -> List[Dict[str, Any]]:
+    router = _router
+    return router.route_stats() if router is not None else []
+
+def shutdown_ai_clients() -> None:
+    """Close every pooled client; called on app shutdown."""
+    global _router, _router_built
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        router, _router, _router_built = _router, None, False
+    if router is not None:
+        router.close()
+    with _gemini_lock:
+        _gemini_models.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:  # pragma: no cover
+            logger.warning(f"Error closing AI client: {e}")
+
+TRANSLATION_MODEL = "gemini-1.5-flash"
+
+# Shares of the remaining request deadline that detection and translation may use
+AI_DETECT_BUDGET = float(os.getenv("AI_DETECT_BUDGET", "0.15"))
+AI_TRANSLATE_BUDGET = float(os.getenv("AI_TRANSLATE_BUDGET", "0.25"))
+
+def _gemini_generate(key: str, model, prompt: str):
+    """generate_content, coalesced on `key` and guarded like chat calls (see _guarded)."""
+    def upstream():
+        def generate(timeout):
+            if timeout is None:
+                return model.generate_content(prompt)
+            return model.generate_content(prompt, request_options={"timeout": timeout})
+        return _guarded("gemini", generate)
+    return ai_limits.inflight.do(key, upstream)
+
+# Translations and detections of the same text never change, so they are kept
+# for long in an LRU in front of a local SQLite file (AI_TRANSLATION_CACHE_PATH)
+AI_TRANSLATION_CACHE_TTL = float(os.getenv("AI_TRANSLATION_CACHE_TTL", str(30 * 24 * 3600)))
+AI_TRANSLATION_CACHE_MAX_ENTRIES = int(os.getenv("AI_TRANSLATION_CACHE_MAX_ENTRIES", "10000"))
+AI_TRANSLATION_CACHE_PATH = os.getenv("AI_TRANSLATION_CACHE_PATH", "ai_cache.db")
+
+translation_cache = TTLCache(
+    "ai_translation", AI_TRANSLATION_CACHE_TTL, AI_TRANSLATION_CACHE_MAX_ENTRIES, AI_TRANSLATION_CACHE_PATH
+)
+
+# Local detections at or above this confidence skip the remote model
+LANG_DETECT_MIN_CONFIDENCE = float(os.getenv("LANG_DETECT_MIN_CONFIDENCE", "0.6"))
+
 def detect_language(text: str) -> str | None:
-    """Detect language of input text using Gemini if configured; return language name like 'English'."""
+    """Detect language of input text; return language name like 'English'.
+
+    Uses the offline detector in language.py and asks Gemini (if configured)
+    only when its confidence is below LANG_DETECT_MIN_CONFIDENCE.
+    """
+    local, confidence = language.detect(text)
+    if local is not None and confidence >= LANG_DETECT_MIN_CONFIDENCE:
+        return local
+    sample = text[:800]
+    key = make_key("detect", TRANSLATION_MODEL, sample)
+    cached = translation_cache.get(key)
+    if cached is not None:
+        return cached
     try:
+        genai = _genai()
         if genai is None:
-            return None
-        model = genai.GenerativeModel("gemini-1.5-flash")
+            # Best local guess, however uncertain
+            return local
+        model = _gemini_model(TRANSLATION_MODEL)
         prompt = (
             "Detect the human language of this text and answer only with the language name in English, "
-            "like: English, Arabic, French, Hindi, Spanish. Text:\n\n" + text[:800]
+            "like: English, Arabic, French, Hindi, Spanish. Text:\n\n" + sample
         )
-        resp = model.generate_content(prompt)
-        return (resp.text or "").strip()
+        with resilience.share(AI_DETECT_BUDGET):
+            resp = _gemini_generate(key, model, prompt)
+        detected = (resp.text or "").strip()
     except Exception:
-        return None
+        return local
+    if not detected:
+        return local
+    translation_cache.set(key, detected)
+    return detected
+
+def translate_text(text: str, target_language: str, budget: float = AI_TRANSLATE_BUDGET) -> str:
+    """Translate text into target_language using Gemini if available; otherwise return original text.
 
-def translate_text(text: str, target_language: str) -> str:
-    """Translate text into target_language using Gemini if available; otherwise return original text."""
+    The call may use `budget` of the time left before the request deadline.
+    """
+    key = make_key("translate", TRANSLATION_MODEL, target_language.strip().casefold(), text)
+    cached = translation_cache.get(key)
+    if cached is not None:
+        return cached
     try:
+        genai = _genai()
         if genai is None:
             return text
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = _gemini_model(TRANSLATION_MODEL)
         prompt = f"Translate the following text into {target_language}. Only return the translated text.\n\n{text[:4000]}"
-        resp = model.generate_content(prompt)
-        return (resp.text or text).strip()
+        with resilience.share(budget):
+            resp = _gemini_generate(key, model, prompt)
+        translated = (resp.text or "").strip()
     except Exception:
         return text
+    # Failed or empty translations fall back to the original and are retried next time
+    if not translated:
+        return text
+    translation_cache.set(key, translated)
+    return translated
+
+def translated_disclaimer(language: str) -> str:
+    """SAFETY_DISCLAIMER in `language`, translated once and then served from the cache."""
+    if language.lower() == "english":
+        return SAFETY_DISCLAIMER
+    return "\n\n" + translate_text(SAFETY_DISCLAIMER.strip(), language)
 
 SAFETY_DISCLAIMER = (
     "\n\nThis is not a diagnosis. Please seek professional care if symptoms persist or worsen."
@@ -242,11 +533,13 @@ CHAT_TEMPLATE = (
     "Conversation:"
 )
 
+CHAT_SUMMARY_TEMPLATE = "Earlier in this conversation (summary):\n{summary}"
+
 
 aidefault_language = os.getenv("AI_DEFAULT_LANGUAGE", "English")
 
 def build_ai_client() -> AIClient:
-    return AIClient()
+    return get_ai_client()
 
 
 def get_triage_advice_payload(symptom: str, age: int | None, sex: str | None, pregnant: bool | None, chronic_conditions: List[str] | None, location: str | None, language: str | None) -> List[Dict[str, str]]:
@@ -268,12 +561,15 @@ def get_triage_advice_payload(symptom: str, age: int | None, sex: str | None, pr
     return messages
 
 
-def get_chat_payload(history: List[Dict[str, str]], language: str | None) -> List[Dict[str, str]]:
+def get_chat_payload(history: List[Dict[str, str]], language: str | None, summary: str | None = None) -> List[Dict[str, str]]:
+    """Chat prompt; `summary` recaps turns older than `history` (see chat_sessions.py)."""
     language = language or aidefault_language
     messages: List[Dict[str, str]] = [
         {"role": "system", "content": SAFETY_SYSTEM_PROMPT},
         {"role": "system", "content": CHAT_TEMPLATE.format(language=language)},
     ]
+    if summary:
+        messages.append({"role": "system", "content": CHAT_SUMMARY_TEMPLATE.format(summary=summary)})
     # Accept only 'user' or 'assistant' roles from history
     for m in history:
         role = m.get("role", "user")
@@ -284,16 +580,111 @@ def get_chat_payload(history: List[Dict[str, str]], language: str | None) -> Lis
     return messages
 
 
-def safe_call(messages: List[Dict[str, str]]) -> str:
-    try:
-        client = build_ai_client()
-        return client.chat(messages)
-    except AIConfigError as e:
-        logger.warning(f"AI not configured: {e}")
+def call_model(messages: List[Dict[str, str]]) -> str:
+    """Send messages to the configured provider. Raises on configuration or provider errors.
+
+    Identical concurrent prompts share one upstream call, and calls wait for
+    one of the provider's AI_MAX_CONCURRENCY slots (see ai_limits.py). A
+    provider whose circuit breaker is open fails at once, and the time left
+    before the request deadline bounds the call (see resilience.py).
+    """
+    router = get_router()
+    if router is not None:
+        return ai_limits.inflight.do(make_key("call", router.order, messages), lambda: router.call(messages))
+    client = build_ai_client()
+
+    def upstream() -> str:
+        return _guarded(client.provider, lambda timeout: client.chat(messages, timeout=timeout))
+
+    return ai_limits.inflight.do(make_key("call", client.provider, client.model, messages), upstream)
+
+
+def stream_model(messages: List[Dict[str, str]]) -> Iterator[str]:
+    """Text fragments of the configured provider's answer. Raises on configuration or provider errors."""
+    router = get_router()
+    # Streams are not hedged; they go to the currently fastest healthy provider
+    client = get_ai_client(router.ranked()[0]) if router is not None else build_ai_client()
+    breaker = resilience.breaker(client.provider)
+    breaker.allow()
+    # The provider slot is held until the stream ends or the client goes away
+    with ai_limits.limiter(client.provider).slot():
+        failed = False
+        try:
+            yield from client.chat_stream(messages)
+        except Exception:
+            failed = True
+            breaker.record_failure()
+            raise
+        finally:
+            # A client that disconnects mid-stream still got an answering provider
+            if not failed:
+                breaker.record_success()
+
+
+def fallback_reply(error: Exception) -> str:
+    """User-facing text returned instead of a model answer when a call fails."""
+    if isinstance(error, AIConfigError):
+        logger.warning(f"AI not configured: {error}")
         return (
             "AI is not configured on this server. Please set OPENAI_API_KEY and AI_PROVIDER in the environment. "
             "In the meantime, use the rule-based /triage endpoint for basic guidance."
         )
-    except Exception as e:  # pragma: no cover
-        logger.error(f"AI call failed: {e}")
-        return "Sorry, I couldn't process that request right now. Please try again later."
+    logger.error(f"AI call failed: {error}")
+    return "Sorry, I couldn't process that request right now. Please try again later."
+
+
+def safe_call(messages: List[Dict[str, str]]) -> str:
+    try:
+        return call_model(messages)
+    except Exception as e:
+        return fallback_reply(e)
+
+
+# Cache of triage answers (see cache.py); AI_CACHE_PATH adds an on-disk SQLite copy
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1024"))
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", "")
+
+triage_cache = TTLCache("ai_triage", AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES, AI_CACHE_PATH)
+
+def _norm(value: str | None) -> str | None:
+    if value is None:
+        return None
+    return re.sub(r"\s+", " ", value).strip().casefold() or None
+
+def _model_identity() -> List[str]:
+    return [os.getenv("AI_PROVIDER", "openai").lower(), os.getenv("AI_MODEL", "gpt-4o-mini")]
+
+def triage_request_key(symptom: str, age: int | None, sex: str | None, pregnant: bool | None, chronic_conditions: List[str] | None, location: str | None, language: str | None) -> str:
+    """Cache key of a triage request, insensitive to case, whitespace and condition order."""
+    return make_key(
+        "request",
+        _model_identity(),
+        _norm(symptom),
+        age,
+        _norm(sex),
+        pregnant,
+        sorted({c for c in (_norm(c) for c in chronic_conditions or []) if c}),
+        _norm(location),
+        _norm(language),
+    )
+
+def cached_call(messages: List[Dict[str, str]], cache: TTLCache = triage_cache) -> tuple[str, bool]:
+    """safe_call() keyed on the resolved prompt. Returns (reply, ok); ok is False for fallback text, which is never cached.
+
+    resilience.FailFast errors (deadline spent, circuit open) are re-raised
+    so the caller can answer without the model.
+    """
+    key = make_key("prompt", _model_identity(), messages)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, True
+    try:
+        reply = call_model(messages)
+    except resilience.FailFast:
+        raise
+    except Exception as e:
+        return fallback_reply(e), False
+    if reply:
+        cache.set(key, reply)
+    return reply, bool(reply)
@@ -0,0 +1,151 @@
+"""
+ai_limits.py - Coalescing and concurrency limits for outbound AI calls
+
+SingleFlight: concurrent calls with the same key (e.g. the same prompt to
+the same model) share one upstream request; followers wait for the leader's
+result or exception.
+
+ConcurrencyLimiter: at most AI_MAX_CONCURRENCY calls per provider are in
+flight; further callers queue for up to AI_QUEUE_TIMEOUT seconds and then
+fail with AIQueueTimeout instead of piling onto a rate-limited provider.
+
+Both waits are also cut short by the request deadline (see resilience.py).
+
+Limits apply per process.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import resilience
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "10"))
+
+
+class AIQueueTimeout(Exception):
+    pass
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn() unless a call with `key` is already in flight, in which case share its outcome."""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not call.done.wait(resilience.remaining()):
+                raise resilience.DeadlineExceeded("AI request deadline exceeded waiting for a coalesced call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, limit: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.timeouts = 0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of `limit` slots for the duration of the block, waiting up to `timeout`."""
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        left = resilience.remaining()
+        timeout = self.timeout if left is None else max(0.0, min(self.timeout, left))
+        try:
+            acquired = self._slots.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            if timeout < self.timeout:
+                raise resilience.DeadlineExceeded(f"AI request deadline exceeded waiting for a {self.name} slot")
+            with self._lock:
+                self.timeouts += 1
+            raise AIQueueTimeout(f"No free {self.name} slot within {self.timeout:g}s")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "provider": self.name,
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+            }
+
+
+inflight = SingleFlight()
+_limiters: Dict[str, ConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(provider: str) -> ConcurrencyLimiter:
+    with _limiters_lock:
+        found = _limiters.get(provider)
+        if found is None:
+            found = _limiters[provider] = ConcurrencyLimiter(provider, AI_MAX_CONCURRENCY, AI_QUEUE_TIMEOUT)
+        return found
+
+
+def limiter_stats() -> List[Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [l.stats() for l in limiters]
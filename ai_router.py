@@ -0,0 +1,179 @@
+"""
+ai_router.py - Latency-aware routing across several AI providers
+
+A Router holds one call function per provider and a rolling window of
+latencies and outcomes for each. Every call goes to the healthy provider
+with the lowest median latency (configured order breaks ties and is used
+until there are measurements). If it fails, the next one is tried.
+
+With hedging on, a second request goes to the runner-up when the first has
+not answered within the leader's p95 latency; whichever succeeds first
+wins. The slower request is not cancelled (blocking HTTP calls cannot be)
+but its latency still feeds the statistics.
+
+Once the request deadline has passed (resilience.DeadlineExceeded) no
+further provider is tried.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+import resilience
+
+logger = logging.getLogger(__name__)
+
+AI_ROUTER_WINDOW = int(os.getenv("AI_ROUTER_WINDOW", "50"))
+# A provider is unhealthy above this error rate (once it has AI_ROUTER_MIN_SAMPLES results)
+AI_ROUTER_MAX_ERROR_RATE = float(os.getenv("AI_ROUTER_MAX_ERROR_RATE", "0.5"))
+AI_ROUTER_MIN_SAMPLES = int(os.getenv("AI_ROUTER_MIN_SAMPLES", "5"))
+AI_HEDGE = os.getenv("AI_HEDGE", "false").lower() == "true"
+# Hedge delay used before a provider has enough samples, and its lower bound
+AI_HEDGE_DEFAULT_DELAY_MS = float(os.getenv("AI_HEDGE_DEFAULT_DELAY_MS", "2000"))
+AI_HEDGE_MIN_DELAY_MS = float(os.getenv("AI_HEDGE_MIN_DELAY_MS", "100"))
+
+CallFn = Callable[[Any], Any]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ProviderStats:
+    """Rolling latencies (seconds) and outcomes of one provider's recent calls."""
+
+    def __init__(self, name: str, window: int = AI_ROUTER_WINDOW):
+        self.name = name
+        self._results: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._results.append((latency, ok))
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._results)
+
+    def samples(self) -> int:
+        with self._lock:
+            return len(self._results)
+
+    def error_rate(self) -> float:
+        results = self._snapshot()
+        return sum(1 for _, ok in results if not ok) / len(results) if results else 0.0
+
+    def latency(self, q: float) -> Optional[float]:
+        latencies = [latency for latency, ok in self._snapshot() if ok]
+        return _percentile(latencies, q) if latencies else None
+
+    def healthy(self) -> bool:
+        return self.samples() < AI_ROUTER_MIN_SAMPLES or self.error_rate() <= AI_ROUTER_MAX_ERROR_RATE
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.latency(0.5), self.latency(0.95)
+        return {
+            "provider": self.name,
+            "samples": self.samples(),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "healthy": self.healthy(),
+        }
+
+
+class Router:
+    def __init__(self, providers: Dict[str, CallFn], hedge: bool = AI_HEDGE, max_workers: int = 8):
+        if not providers:
+            raise ValueError("Router needs at least one provider")
+        self.providers = dict(providers)
+        self.order = list(providers)
+        self.hedge = hedge
+        self.stats = {name: ProviderStats(name) for name in providers}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-hedge") if hedge else None
+
+    def ranked(self) -> List[str]:
+        """Healthy providers by median latency (unmeasured ones first, in configured order), then unhealthy ones."""
+        def key(name: str):
+            stats = self.stats[name]
+            p50 = stats.latency(0.5)
+            if p50 is None:
+                # Unmeasured: try it early; only failures so far: try it late
+                p50 = 0.0 if stats.samples() == 0 else float("inf")
+            return (not stats.healthy(), p50, self.order.index(name))
+        return sorted(self.order, key=key)
+
+    def _attempt(self, name: str, request: Any) -> Any:
+        started = time.monotonic()
+        try:
+            result = self.providers[name](request)
+        except Exception:
+            self.stats[name].record(time.monotonic() - started, False)
+            raise
+        self.stats[name].record(time.monotonic() - started, True)
+        return result
+
+    def _hedge_delay(self, name: str) -> float:
+        stats = self.stats[name]
+        p95 = stats.latency(0.95)
+        delay_ms = p95 * 1000 if p95 is not None and stats.samples() >= AI_ROUTER_MIN_SAMPLES else AI_HEDGE_DEFAULT_DELAY_MS
+        return max(delay_ms, AI_HEDGE_MIN_DELAY_MS) / 1000
+
+    def call(self, request: Any) -> Any:
+        """Result of the first provider to answer successfully; raises the last error if all fail."""
+        ranked = self.ranked()
+        if self.hedge and len(ranked) > 1:
+            return self._hedged(ranked, request)
+        last_error: Optional[Exception] = None
+        for name in ranked:
+            try:
+                return self._attempt(name, request)
+            except resilience.DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.warning(f"AI provider {name} failed, trying next: {e}")
+                last_error = e
+        raise last_error  # type: ignore[misc]
+
+    def _hedged(self, ranked: List[str], request: Any) -> Any:
+        pending = {resilience.submit(self._pool, self._attempt, ranked[0], request): ranked[0]}
+        remaining = ranked[1:]
+        done, _ = wait(pending, timeout=self._hedge_delay(ranked[0]))
+        last_error: Optional[Exception] = None
+        while True:
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except resilience.DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"AI provider {name} failed: {e}")
+                    last_error = e
+                    continue
+                if name != ranked[0]:
+                    self.hedge_wins += 1
+                return result
+            # Leader is slow or failed: bring in the next provider
+            if remaining and (not pending or not done):
+                name = remaining.pop(0)
+                if pending:
+                    self.hedges += 1
+                pending[resilience.submit(self._pool, self._attempt, name, request)] = name
+            if not pending:
+                raise last_error  # type: ignore[misc]
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+    def route_stats(self) -> List[Dict[str, Any]]:
+        return [self.stats[name].stats() for name in self.order]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
@@ -0,0 +1,77 @@
+"""
+bench_startup.py - Cold-start benchmark for the API
+
+Starts fresh interpreters that import `main` and run its lifespan startup,
+then reports the median timings. Exits with status 1 when the median total
+exceeds the budget or when a provider SDK was imported during startup.
+
+    python bench_startup.py [--runs 5] [--budget-ms 1500]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+
+# Modules that must only load when an AI provider is actually used
+LAZY_MODULES = ("openai", "google.generativeai", "httpx")
+
+_CHILD = """
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+async def start():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+asyncio.run(start())
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "lifespan_ms": (t2 - t1) * 1000,
+    "eager": [m for m in %r if m in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def run_once() -> dict:
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+    medians = {key: statistics.median(r[key] for r in runs) for key in ("import_ms", "lifespan_ms", "process_ms")}
+    eager = sorted({m for r in runs for m in r["eager"]})
+    print(
+        f"import main: {medians['import_ms']:.0f} ms, lifespan startup: {medians['lifespan_ms']:.0f} ms, "
+        f"whole process: {medians['process_ms']:.0f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)"
+    )
+    failed = False
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+        failed = True
+    if medians["process_ms"] > args.budget_ms:
+        print("FAIL: over the startup budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+bulk.py - Streaming parsers for bulk service uploads
+
+Reads a request body as a JSON array, NDJSON or CSV and yields one
+(row_number, ServiceCreate | error message) pair per record. Every format
+is validated record by record as the body arrives, so large uploads are
+never held in memory whole.
+"""
+
+import codecs
+import csv
+import json
+from typing import Any, AsyncIterator, Dict, Tuple, Union
+
+from fastapi import Request
+from pydantic import ValidationError
+
+import schemas
+
+JSON_TYPES = {"application/json"}
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+CSV_TYPES = {"text/csv", "application/csv"}
+SUPPORTED_TYPES = JSON_TYPES | NDJSON_TYPES | CSV_TYPES
+
+ParsedRow = Tuple[int, Union[schemas.ServiceCreate, str]]
+
+
+def content_type(request: Request) -> str:
+    return request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+
+def _validate(record: Any) -> Union[schemas.ServiceCreate, str]:
+    if not isinstance(record, dict):
+        return "Row must be an object"
+    try:
+        return schemas.ServiceCreate.model_validate(record)
+    except ValidationError as e:
+        return "; ".join(
+            f"{'.'.join(str(p) for p in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+        )
+
+
+async def _lines(request: Request) -> AsyncIterator[str]:
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *complete, pending = pending.split(b"\n")
+        for line in complete:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+async def _ndjson(request: Request) -> AsyncIterator[ParsedRow]:
+    row = 0
+    async for line in _lines(request):
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row, f"Invalid JSON: {e.msg}"
+            continue
+        yield row, _validate(record)
+
+
+def _csv_record(header, values) -> Dict[str, Any]:
+    record = dict(zip(header, values))
+    # Empty cells mean "not provided" (e.g. missing coordinates)
+    return {k: v for k, v in record.items() if k and v != ""}
+
+
+async def _csv(request: Request) -> AsyncIterator[ParsedRow]:
+    header = None
+    row = 0
+    record_text = ""
+    async for line in _lines(request):
+        # A quoted field may contain newlines; wait until quotes are balanced
+        record_text = f"{record_text}\n{line}" if record_text else line
+        if record_text.count('"') % 2:
+            continue
+        text, record_text = record_text, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        row += 1
+        yield row, _validate(_csv_record(header, values))
+
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+async def _text_chunks(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    async for chunk in request.stream():
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def _json_array(request: Request) -> AsyncIterator[ParsedRow]:
+    """Decode the array one element at a time as the body arrives.
+
+    A body that is not a JSON array raises ValueError. Malformed JSON after
+    some elements is reported on the next row and ends the upload; the rows
+    before it are kept.
+    """
+    chunks = _text_chunks(request).__aiter__()
+    buffer, pos, done = "", 0, False
+    expect = "["  # then "first" / "value" / "," until "]" moves it to "end"
+    row = 0
+    error = None
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        starved = pos == len(buffer)
+        if not starved and expect in ("first", "value") and not (expect == "first" and buffer[pos] == "]"):
+            try:
+                record, end = _DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if done:
+                    error = f"Invalid JSON: {e.msg}"
+                    break
+                starved = True
+            else:
+                # A value running to the end of the buffer may be a number cut by a chunk boundary
+                starved = end == len(buffer) and not done
+        if starved and not done:
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                done = True
+            else:
+                buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        if expect == "[":
+            if starved or buffer[pos] != "[":
+                raise ValueError("Expected a JSON array of services")
+            pos += 1
+            expect = "first"
+        elif expect == "end":
+            if not starved:
+                error = "Invalid JSON: extra data after the array"
+            break
+        elif starved:
+            error = "Invalid JSON: unexpected end of body"
+            break
+        elif expect == ",":
+            if buffer[pos] not in ",]":
+                error = "Invalid JSON: expected ',' or ']'"
+                break
+            expect = "value" if buffer[pos] == "," else "end"
+            pos += 1
+        elif expect == "first" and buffer[pos] == "]":
+            pos += 1
+            expect = "end"
+        else:
+            row += 1
+            pos = end
+            expect = ","
+            yield row, _validate(record)
+    if error is not None:
+        if row == 0:
+            raise ValueError(error)
+        yield row + 1, error
+
+
+def parse(request: Request) -> AsyncIterator[ParsedRow]:
+    """Pick the parser for the request content type (see SUPPORTED_TYPES)."""
+    kind = content_type(request)
+    if kind in NDJSON_TYPES:
+        return _ndjson(request)
+    if kind in CSV_TYPES:
+        return _csv(request)
+    return _json_array(request)
@@ -0,0 +1,176 @@
+"""
+cache.py - TTL + LRU caches for expensive AI results
+
+Entries live in an in-process LRU with a time-to-live. When a cache has a
+`path`, entries are also written to a small SQLite file so they survive
+restarts and are shared by workers on the same host; a miss in memory falls
+back to the file. Values must be JSON-serializable.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Expired rows are purged from disk every this many writes
+_PRUNE_EVERY = 256
+
+
+def make_key(*parts: Any) -> str:
+    """Stable digest of JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, max_entries: int, path: Optional[str] = None, disk_max_entries: Optional[int] = None):
+        """`disk_max_entries` caps the SQLite copy (default: `max_entries`; 0 prunes by TTL only)."""
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_max_entries = max_entries if disk_max_entries is None else disk_max_entries
+        self.path = path or None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry.append(self)
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        # Opened on first use so importing the module stays free
+        if self.path and self._conn is None:
+            try:
+                conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_entries ("
+                    "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                    "PRIMARY KEY (namespace, key))"
+                )
+                self._conn = conn
+            except sqlite3.Error as e:
+                logger.warning(f"Cache '{self.name}' running without persistence: {e}")
+                self.path = None
+        return self._conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            value = self._disk_get(key, now)
+            if value is not _MISSING:
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def _disk_get(self, key: str, now: float) -> Any:
+        conn = self._db()
+        if conn is None:
+            return _MISSING
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.name, key, now),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache '{self.name}' read failed: {e}")
+            return _MISSING
+        if row is None:
+            return _MISSING
+        value = json.loads(row[0])
+        self._remember(key, row[1], value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            conn = self._db()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.name, key, json.dumps(value, ensure_ascii=False), expires_at),
+                )
+                self._writes += 1
+                if self._writes % _PRUNE_EVERY == 0:
+                    self._prune(conn)
+            except sqlite3.Error as e:
+                logger.warning(f"Cache '{self.name}' write failed: {e}")
+
+    def _remember(self, key: str, expires_at: float, value: Any) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.name, time.time()))
+        if not self.disk_max_entries:
+            return
+        # Keep the file bounded too: drop the entries closest to expiry beyond disk_max_entries
+        conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.name, self.name, self.disk_max_entries),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            conn = self._db()
+            if conn is not None:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.name,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "persistent": self.path is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_registry: List[TTLCache] = []
+
+
+def all_stats() -> List[Dict[str, Any]]:
+    return [c.stats() for c in _registry]
@@ -0,0 +1,116 @@
+"""
+chat_sessions.py - Server-side chat history for /ai/chat
+
+A session holds the recent turns of one conversation and a rolling summary
+of older ones, so clients send only the new message and a `session_id`.
+Sessions live in a TTLCache (in-memory LRU in front of SQLite, see cache.py)
+and expire CHAT_SESSION_TTL seconds after their last turn. The LRU only
+holds the busiest CHAT_SESSION_MAX_ENTRIES; the SQLite copy keeps every
+live session.
+
+Prompts are kept within CHAT_HISTORY_TOKEN_BUDGET: the newest turns that
+fit are sent verbatim and older ones are compacted into an extractive
+summary (the first sentence of each), itself capped at
+CHAT_SUMMARY_TOKEN_BUDGET by dropping its oldest lines. Token counts are
+estimated from text length; no tokenizer is needed.
+"""
+
+import os
+import re
+import secrets
+from typing import Dict, List, Optional, Tuple
+
+from cache import TTLCache
+
+CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", str(24 * 3600)))
+CHAT_SESSION_MAX_ENTRIES = int(os.getenv("CHAT_SESSION_MAX_ENTRIES", "1000"))
+CHAT_SESSION_PATH = os.getenv("CHAT_SESSION_PATH", "ai_cache.db")
+# Sessions on disk are only dropped when they expire, unless this cap (0: none) is set
+CHAT_SESSION_DISK_MAX_ENTRIES = int(os.getenv("CHAT_SESSION_DISK_MAX_ENTRIES", "0"))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "300"))
+
+# Words kept from each turn in the summary
+SUMMARY_WORDS_PER_TURN = 30
+
+sessions = TTLCache(
+    "chat_sessions", CHAT_SESSION_TTL, CHAT_SESSION_MAX_ENTRIES, CHAT_SESSION_PATH, CHAT_SESSION_DISK_MAX_ENTRIES
+)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?。؟])\s")
+
+Turn = Dict[str, str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: about four characters per token, as for English with GPT-style tokenizers."""
+    return len(text) // 4 + 1
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def load(session_id: str) -> Dict:
+    """The stored session, or an empty one when the id is unknown or expired."""
+    stored = sessions.get(session_id)
+    if stored is None:
+        return {"summary": "", "turns": []}
+    # Cached values are shared; hand out copies
+    return {"summary": stored.get("summary", ""), "turns": list(stored.get("turns", []))}
+
+
+def save(session_id: str, session: Dict) -> None:
+    """Store the session, restarting its time-to-live."""
+    sessions.set(session_id, {"summary": session["summary"], "turns": list(session["turns"])})
+
+
+def _summary_line(turn: Turn) -> str:
+    text = " ".join(turn.get("content", "").split())
+    first = _SENTENCE_END.split(text, 1)[0]
+    words = first.split()
+    if len(words) > SUMMARY_WORDS_PER_TURN:
+        first = " ".join(words[:SUMMARY_WORDS_PER_TURN]) + "..."
+    role = "Assistant" if turn.get("role") == "assistant" else "User"
+    return f"{role}: {first}"
+
+
+def summarize(summary: str, dropped: List[Turn], budget: int = CHAT_SUMMARY_TOKEN_BUDGET) -> str:
+    """`summary` extended with one line per dropped turn, oldest lines removed beyond `budget` tokens."""
+    lines = [line for line in summary.split("\n") if line] + [_summary_line(t) for t in dropped]
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def window(turns: List[Turn], summary: str = "", budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> Tuple[List[Turn], str]:
+    """(newest turns fitting in `budget` tokens, summary updated with the turns left out).
+
+    The latest turn is always kept, however long.
+    """
+    used = 0
+    start = len(turns)
+    while start > 0:
+        cost = estimate_tokens(turns[start - 1].get("content", ""))
+        if start < len(turns) and used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    if start == 0:
+        return list(turns), summary
+    return list(turns[start:]), summarize(summary, turns[:start])
+
+
+def prepare(session_id: Optional[str], message: str) -> Tuple[str, Dict]:
+    """(session id, session with `message` appended and compacted); a new id is issued when none is given."""
+    session_id = session_id or new_session_id()
+    session = load(session_id)
+    turns = session["turns"] + [{"role": "user", "content": message}]
+    session["turns"], session["summary"] = window(turns, session["summary"])
+    return session_id, session
+
+
+def record_reply(session_id: str, session: Dict, reply: str) -> None:
+    """Append the model's reply and store the session."""
+    session["turns"].append({"role": "assistant", "content": reply})
+    save(session_id, session)
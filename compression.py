@@ -0,0 +1,158 @@
+"""
+compression.py - Negotiated response compression (brotli or gzip)
+
+Like Starlette's GZipMiddleware, but picks brotli when the client accepts it
+and the optional `brotli` package is installed. Small bodies, already
+encoded responses and Server-Sent Event streams are passed through.
+When a coding is negotiated, ETags are made weak on every response that
+could be compressed, 304s included, so a revalidation returns the same
+validator as the 200 it refers to.
+"""
+
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None  # type: ignore
+
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+
+
+class _Gzip:
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Brotli:
+    encoding = "br"
+
+    def __init__(self, quality: int):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Codings the client accepts (q > 0)."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _weaken_etag(headers: MutableHeaders) -> None:
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+            if brotli is not None and "br" in accepted:
+                factory = lambda: _Brotli(self.brotli_quality)  # noqa: E731
+            elif "gzip" in accepted:
+                factory = lambda: _Gzip(self.gzip_level)  # noqa: E731
+            else:
+                factory = None
+            if factory is not None:
+                await _Responder(self.app, self.minimum_size, factory)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class _Responder:
+    def __init__(self, app: ASGIApp, minimum_size: int, factory) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.factory = factory
+        self.send: Send = None  # type: ignore
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body chunk tells us whether to compress
+            self.initial_message = message
+            headers = MutableHeaders(raw=message["headers"])
+            self.passthrough = "content-encoding" in headers or headers.get("content-type", "").startswith(UNCOMPRESSED_TYPES)
+            if not self.passthrough:
+                # The body's size is not known yet (and a 304 has none), so the
+                # tag is weakened whether or not this response ends up compressed
+                _weaken_etag(headers)
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            if self.passthrough or (len(body) < self.minimum_size and not more_body):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            self.compressor = self.factory()
+            data = self._compress(body, more_body)
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = self.compressor.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(data))
+            await self.send(self.initial_message)
+        elif self.passthrough:
+            await self.send(message)
+            return
+        else:
+            data = self._compress(body, more_body)
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.finish()
+        return data
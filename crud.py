@@ -1,14 +1,27 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional
-from sqlalchemy import or_
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert, or_, update
 import models
 import schemas
+import geoindex
+import geokernel
+import fts
+import memindex
+import trigram
+import suggest
+import dirversion
 import logging
 import math
 
 logger = logging.getLogger(__name__)
 
+def _commit_write(db: Session) -> None:
+    """Commit a change to the directory, bumping the version used for ETags"""
+    dirversion.bump(db)
+    db.commit()
+    dirversion.invalidate()
+
 def get_services(db: Session, skip: int = 0, limit: int = 100) -> List[models.Service]:
     """Get all services with pagination"""
     try:
@@ -17,6 +30,40 @@ def get_services(db: Session, skip: int = 0, limit: int = 100) -> List[models.Se
         logger.error(f"Error fetching services: {e}")
         raise
 
+def get_services_after(db: Session, after_id: int = 0, limit: int = 100) -> List[models.Service]:
+    """Keyset pagination: services with id greater than after_id, in id order"""
+    try:
+        return (
+            db.query(models.Service)
+            .filter(models.Service.id > after_id)
+            .order_by(models.Service.id)
+            .limit(limit)
+            .all()
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Error fetching services after id {after_id}: {e}")
+        raise
+
+EXPORT_FIELDS = ("id", "name", "location", "contact", "latitude", "longitude")
+
+def get_service_rows_after(db: Session, after_id: int = 0, limit: int = 1000) -> List[Tuple]:
+    """Plain (EXPORT_FIELDS) tuples for services with id greater than after_id, in id order"""
+    columns = [getattr(models.Service, f) for f in EXPORT_FIELDS]
+    try:
+        rows = (
+            db.query(*columns)
+            .filter(models.Service.id > after_id)
+            .order_by(models.Service.id)
+            .limit(limit)
+            .all()
+        )
+        # End the read transaction so exports never hold a lock between batches
+        db.commit()
+        return [tuple(row) for row in rows]
+    except SQLAlchemyError as e:
+        logger.error(f"Error exporting services after id {after_id}: {e}")
+        raise
+
 def get_service(db: Session, service_id: int) -> Optional[models.Service]:
     """Get a single service by ID"""
     try:
@@ -30,8 +77,11 @@ def create_service(db: Session, service: schemas.ServiceCreate) -> models.Servic
     try:
         db_service = models.Service(**service.model_dump())
         db.add(db_service)
-        db.commit()
+        db.flush()
+        geoindex.index_service(db, db_service)
+        _commit_write(db)
         db.refresh(db_service)
+        memindex.upsert(db_service)
         logger.info(f"Created service: {db_service.name}")
         return db_service
     except SQLAlchemyError as e:
@@ -39,6 +89,26 @@ def create_service(db: Session, service: schemas.ServiceCreate) -> models.Servic
         logger.error(f"Error creating service: {e}")
         raise
 
+def bulk_create_services(db: Session, services: List[schemas.ServiceCreate]) -> List[int]:
+    """Insert many services in one transaction using executemany; returns new ids in input order"""
+    if not services:
+        return []
+    try:
+        rows = [s.model_dump() for s in services]
+        ids = db.execute(
+            insert(models.Service).returning(models.Service.id, sort_by_parameter_order=True),
+            rows,
+        ).scalars().all()
+        geoindex.index_rows(db, [(i, r["latitude"], r["longitude"]) for i, r in zip(ids, rows)])
+        _commit_write(db)
+        memindex.upsert_many(zip(ids, rows))
+        logger.info(f"Bulk created {len(ids)} services")
+        return list(ids)
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Error bulk creating services: {e}")
+        raise
+
 def update_service(db: Session, service_id: int, service_update: schemas.ServiceUpdate) -> Optional[models.Service]:
     """Update an existing service"""
     try:
@@ -49,9 +119,12 @@ def update_service(db: Session, service_id: int, service_update: schemas.Service
         update_data = service_update.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_service, field, value)
+        if "latitude" in update_data or "longitude" in update_data:
+            geoindex.index_service(db, db_service)
         
-        db.commit()
+        _commit_write(db)
         db.refresh(db_service)
+        memindex.upsert(db_service)
         logger.info(f"Updated service {service_id}")
         return db_service
     except SQLAlchemyError as e:
@@ -59,6 +132,82 @@ def update_service(db: Session, service_id: int, service_update: schemas.Service
         logger.error(f"Error updating service {service_id}: {e}")
         raise
 
+def bulk_update_services(db: Session, items: List[schemas.ServiceBulkUpdateItem]) -> Tuple[int, List[int]]:
+    """Apply partial updates to many services in one transaction; returns (updated, missing ids)
+
+    Items changing the same set of fields share one statement: a single
+    UPDATE ... WHERE id IN (...) when their values are identical, otherwise
+    one executemany UPDATE by primary key.
+    """
+    try:
+        patches: Dict[int, dict] = {}
+        for item in items:
+            patches.setdefault(item.id, {}).update(item.model_dump(exclude_unset=True, exclude={"id"}))
+        existing = {
+            row.id: row
+            for row in db.query(models.Service.id, models.Service.latitude, models.Service.longitude)
+            .filter(models.Service.id.in_(list(patches)))
+            .all()
+        }
+        missing = sorted(set(patches) - set(existing))
+        patches = {i: p for i, p in patches.items() if i in existing and p}
+
+        groups: Dict[Tuple[str, ...], Dict[int, dict]] = {}
+        for service_id, patch in patches.items():
+            groups.setdefault(tuple(sorted(patch)), {})[service_id] = patch
+        for group in groups.values():
+            values = list(group.values())
+            if all(v == values[0] for v in values):
+                db.execute(
+                    update(models.Service).where(models.Service.id.in_(list(group))).values(**values[0]),
+                    execution_options={"synchronize_session": False},
+                )
+            else:
+                db.execute(update(models.Service), [{"id": i, **p} for i, p in group.items()])
+
+        moved = [i for i, p in patches.items() if "latitude" in p or "longitude" in p]
+        if moved:
+            geoindex.unindex_many(db, moved)
+            geoindex.index_rows(db, [
+                (i, patches[i].get("latitude", existing[i].latitude), patches[i].get("longitude", existing[i].longitude))
+                for i in moved
+            ])
+        _commit_write(db)
+
+        renamed = [i for i, p in patches.items() if set(p) & set(memindex.FIELDS)]
+        if renamed:
+            columns = [getattr(models.Service, f) for f in memindex.FIELDS]
+            memindex.upsert_many(
+                (row[0], dict(zip(memindex.FIELDS, row[1:])))
+                for row in db.query(models.Service.id, *columns).filter(models.Service.id.in_(renamed)).all()
+            )
+        logger.info(f"Bulk updated {len(patches)} services ({len(missing)} missing)")
+        return len(patches), missing
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Error bulk updating services: {e}")
+        raise
+
+def bulk_delete_services(db: Session, service_ids: List[int]) -> Tuple[int, List[int]]:
+    """Delete many services with set-based statements; returns (deleted, missing ids)"""
+    try:
+        requested = set(service_ids)
+        existing = [
+            i for (i,) in db.query(models.Service.id).filter(models.Service.id.in_(list(requested))).all()
+        ]
+        missing = sorted(requested - set(existing))
+        if existing:
+            geoindex.unindex_many(db, existing)
+            db.query(models.Service).filter(models.Service.id.in_(existing)).delete(synchronize_session=False)
+        _commit_write(db)
+        memindex.remove_many(existing)
+        logger.info(f"Bulk deleted {len(existing)} services ({len(missing)} missing)")
+        return len(existing), missing
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Error bulk deleting services: {e}")
+        raise
+
 def delete_service(db: Session, service_id: int) -> bool:
     """Delete a service"""
     try:
@@ -66,8 +215,10 @@ def delete_service(db: Session, service_id: int) -> bool:
         if not db_service:
             return False
         
+        geoindex.unindex_service(db, service_id)
         db.delete(db_service)
-        db.commit()
+        _commit_write(db)
+        memindex.remove(service_id)
         logger.info(f"Deleted service {service_id}")
         return True
     except SQLAlchemyError as e:
@@ -76,8 +227,14 @@ def delete_service(db: Session, service_id: int) -> bool:
         raise
 
 def search_services(db: Session, query: str, limit: int = 20) -> List[models.Service]:
-    """Simple text search across name, location, and contact fields."""
+    """Ranked full-text search across name, location, and contact fields.
+
+    Falls back to substring matching on backends without a full-text index.
+    """
     try:
+        ranked = fts.search(db, query)
+        if ranked is not None:
+            return ranked.limit(limit).all()
         like = f"%{query}%"
         return (
             db.query(models.Service)
@@ -95,6 +252,31 @@ def search_services(db: Session, query: str, limit: int = 20) -> List[models.Ser
         logger.error(f"Error searching services with query '{query}': {e}")
         raise
 
+def fuzzy_search_services(db: Session, query: str, limit: int = 20) -> List[models.Service]:
+    """Typo-tolerant search using the in-memory trigram index, best match first."""
+    try:
+        hits = memindex.search(db, trigram.index, query, limit=limit)
+        return _services_in_order(db, [service_id for service_id, _ in hits])
+    except SQLAlchemyError as e:
+        logger.error(f"Error fuzzy searching services with query '{query}': {e}")
+        raise
+
+def suggest_services(db: Session, prefix: str, limit: int = 10) -> List[Tuple[int, str]]:
+    """(id, label) suggestions for a name/location prefix, served from the in-memory prefix index."""
+    try:
+        return memindex.search(db, suggest.index, prefix, limit=limit)
+    except SQLAlchemyError as e:
+        logger.error(f"Error suggesting services for prefix '{prefix}': {e}")
+        raise
+
+def _services_in_order(db: Session, ids: List[int]) -> List[models.Service]:
+    """Fetch services by primary key, preserving the order of `ids` and skipping missing rows."""
+    if not ids:
+        return []
+    rows = db.query(models.Service).filter(models.Service.id.in_(ids)).all()
+    by_id = {s.id: s for s in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
 def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate Haversine distance between two points in kilometers."""
     R = 6371.0
@@ -109,22 +291,42 @@ def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
 def nearby_services(db: Session, lat: float, lon: float, radius_km: float = 10.0, limit: int = 20) -> List[models.Service]:
     """Return services within radius_km of (lat, lon), sorted by distance ascending."""
     try:
-        # Fetch candidates with non-null coordinates
-        candidates = (
-            db.query(models.Service)
-            .filter(models.Service.latitude.isnot(None), models.Service.longitude.isnot(None))
-            .all()
-        )
-        with_dist = []
-        for s in candidates:
-            try:
-                d = haversine_km(lat, lon, float(s.latitude), float(s.longitude))
-            except Exception:
-                continue
-            if d <= radius_km:
-                with_dist.append((d, s))
-        with_dist.sort(key=lambda x: x[0])
-        return [s for d, s in with_dist[:limit]]
+        # Fetch only candidates whose grid cell intersects the search radius
+        candidates = geoindex.candidates(db, lat, lon, radius_km).all()
+        coords = geokernel.CoordinateSet((s.id, s.latitude, s.longitude) for s in candidates)
+        by_id = {s.id: s for s in candidates}
+        nearest = geokernel.nearest(coords, [(lat, lon, radius_km, limit)])[0]
+        return [by_id[service_id] for service_id, _ in nearest]
     except SQLAlchemyError as e:
         logger.error(f"Error computing nearby services: {e}")
         raise
+
+def nearby_services_batch(db: Session, queries: List[Tuple[float, float, float, int]]) -> List[List[models.Service]]:
+    """Resolve many (lat, lon, radius_km, limit) queries with one candidate scan and one row fetch."""
+    try:
+        if not queries:
+            return []
+        rows = geoindex.coordinates_near(db, [(lat, lon, radius_km) for lat, lon, radius_km, _ in queries])
+        nearest = geokernel.nearest(geokernel.CoordinateSet(rows), queries)
+        wanted = {service_id for hits in nearest for service_id, _ in hits}
+        by_id = {}
+        if wanted:
+            services = db.query(models.Service).filter(models.Service.id.in_(wanted)).all()
+            by_id = {s.id: s for s in services}
+        return [[by_id[service_id] for service_id, _ in hits if service_id in by_id] for hits in nearest]
+    except SQLAlchemyError as e:
+        logger.error(f"Error computing batch nearby services: {e}")
+        raise
+
+EXAMPLE_SERVICES = [
+    {"name": "City Hospital", "location": "123 Main St", "contact": "555-1234", "latitude": 28.6139, "longitude": 77.2090},
+    {"name": "Urgent Care Clinic", "location": "456 Elm St", "contact": "555-5678", "latitude": 28.5355, "longitude": 77.3910},
+    {"name": "Emergency Room", "location": "789 Oak Ave", "contact": "911", "latitude": 28.4595, "longitude": 77.0266},
+    {"name": "Family Clinic", "location": "321 Pine St", "contact": "555-9999", "latitude": 28.7041, "longitude": 77.1025},
+]
+
+def seed_example_services(db: Session) -> int:
+    """Insert EXAMPLE_SERVICES into an empty directory. Returns the number of services created."""
+    if db.query(models.Service.id).first() is not None:
+        return 0
+    return len(bulk_create_services(db, [schemas.ServiceCreate(**s) for s in EXAMPLE_SERVICES]))
@@ -0,0 +1,83 @@
+"""
+dirversion.py - Directory version used for ETags on read endpoints
+
+Every write in crud.py bumps a counter stored in `directory_state` in the
+same transaction as the change. Readers get it from a process-local copy
+that is refreshed at most every DIRECTORY_VERSION_TTL seconds, so a
+conditional GET can be answered with 304 without querying the database.
+Writes made by this process drop the copy and are visible immediately;
+writes made by other workers within at most the TTL, during which their
+clients may still get 304 for the old data. A longer TTL means fewer
+database reads per poll and a longer window of such staleness.
+"""
+
+import hashlib
+import os
+import secrets
+import threading
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+import models
+from database import Base
+
+DIRECTORY_VERSION_TTL = float(os.getenv("DIRECTORY_VERSION_TTL", "30"))
+
+_lock = threading.Lock()
+_cached: Optional[Tuple[str, int]] = None
+_cached_at = 0.0
+
+
+def bump(db: Session) -> None:
+    """Increment the directory version inside the caller's transaction. Caller commits."""
+    updated = db.execute(
+        update(models.DirectoryState).where(models.DirectoryState.id == 1).values(version=models.DirectoryState.version + 1),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if not updated:
+        db.add(models.DirectoryState(id=1, version=1, epoch=secrets.token_hex(4)))
+
+
+def invalidate(*args, **kwargs) -> None:
+    """Forget the cached version; call after committing a bump."""
+    global _cached
+    with _lock:
+        _cached = None
+
+
+def current(db: Session) -> Tuple[str, int]:
+    """(epoch, version) of the directory, from the local cache when fresh."""
+    global _cached, _cached_at
+    with _lock:
+        if _cached is not None and time.monotonic() - _cached_at < DIRECTORY_VERSION_TTL:
+            return _cached
+    row = db.query(models.DirectoryState.epoch, models.DirectoryState.version).filter(models.DirectoryState.id == 1).first()
+    value = (row.epoch, row.version) if row else ("new", 0)
+    with _lock:
+        _cached, _cached_at = value, time.monotonic()
+    return value
+
+
+def _format_etag(epoch: str, version: int, resource: str) -> str:
+    digest = hashlib.sha1(resource.encode()).hexdigest()[:16]
+    return f'"{epoch}-{version}-{digest}"'
+
+
+def etag(db: Session, resource: str) -> str:
+    """Strong ETag for a representation identified by `resource` (path and query) at the current version."""
+    return _format_etag(*current(db), resource)
+
+
+def cached_etag(resource: str) -> Optional[str]:
+    """Like etag(), but only from a fresh cached version; None when the database must be consulted."""
+    with _lock:
+        if _cached is None or time.monotonic() - _cached_at >= DIRECTORY_VERSION_TTL:
+            return None
+        return _format_etag(*_cached, resource)
+
+
+event.listen(Base.metadata, "after_create", invalidate)
+event.listen(Base.metadata, "after_drop", invalidate)
@@ -0,0 +1,111 @@
+"""
+fts.py - Full-text search index over service name, location and contact
+
+SQLite: an external-content FTS5 table (`services_fts`) kept in sync with
+`services` by triggers, ranked with bm25.
+PostgreSQL: a GIN expression index on a `simple` tsvector of the same
+fields, ranked with ts_rank. Postgres maintains it on every write.
+
+Both structures are created alongside the `services` table (including from
+`Base.metadata.create_all`) and dropped with it.
+"""
+
+import logging
+import re
+from typing import Optional
+
+from sqlalchemy import column, event, inspect, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "services_fts"
+
+# Column weights for bm25: name matches rank above location, then contact
+_BM25 = f"bm25({FTS_TABLE}, 10.0, 4.0, 1.0)"
+
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, location, contact, content='services', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS services_fts_ai AFTER INSERT ON services BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, location, contact) VALUES (new.id, new.name, new.location, new.contact); END",
+    f"CREATE TRIGGER IF NOT EXISTS services_fts_ad AFTER DELETE ON services BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, location, contact) VALUES ('delete', old.id, old.name, old.location, old.contact); END",
+    f"CREATE TRIGGER IF NOT EXISTS services_fts_au AFTER UPDATE ON services BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, location, contact) VALUES ('delete', old.id, old.name, old.location, old.contact); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, location, contact) VALUES (new.id, new.name, new.location, new.contact); END",
+]
+
+_fts = table(FTS_TABLE, column("rowid"))
+
+_PG_DOCUMENT = "to_tsvector('simple', name || ' ' || location || ' ' || contact)"
+_PG_DDL = [f"CREATE INDEX IF NOT EXISTS ix_services_fts ON services USING GIN ({_PG_DOCUMENT})"]
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _create(target, connection: Connection, **kw) -> None:
+    dialect = connection.dialect.name
+    statements = _SQLITE_DDL if dialect == "sqlite" else _PG_DDL if dialect == "postgresql" else []
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+def _drop(target, connection: Connection, **kw) -> None:
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+event.listen(models.Service.__table__, "after_create", _create)
+event.listen(models.Service.__table__, "before_drop", _drop)
+
+
+def ensure(conn: Connection) -> None:
+    """Create the index on an existing database and backfill it if it was missing. Caller commits."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        missing = not inspect(conn).has_table(FTS_TABLE)
+        _create(None, conn)
+        if missing:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            logger.info("Built full-text index for services")
+    elif dialect == "postgresql":
+        _create(None, conn)
+
+
+def _tokens(query: str):
+    return [t.lower() for t in _TOKEN.findall(query)]
+
+
+def search(db: Session, query: str) -> Optional[Query]:
+    """Ranked query of services matching every term of `query` as a prefix.
+
+    Returns None when the backend has no full-text index or the query has no
+    searchable terms, so callers can fall back to substring matching.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return None
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        match = " ".join(f'"{t}"*' for t in tokens)
+        return (
+            db.query(models.Service)
+            .join(_fts, _fts.c.rowid == models.Service.id)
+            .filter(text(f"{FTS_TABLE} MATCH :fts_query"))
+            .order_by(text(_BM25))
+            .params(fts_query=match)
+        )
+    if dialect == "postgresql":
+        tsquery = " & ".join(f"{t}:*" for t in tokens)
+        return (
+            db.query(models.Service)
+            .filter(text(f"{_PG_DOCUMENT} @@ to_tsquery('simple', :fts_query)"))
+            .order_by(text(f"ts_rank({_PG_DOCUMENT}, to_tsquery('simple', :fts_query)) DESC"))
+            .params(fts_query=tsquery)
+        )
+    return None
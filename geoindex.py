@@ -0,0 +1,197 @@
+"""
+geoindex.py - Grid-based spatial index for the services directory
+
+Every service with coordinates gets a row in `service_geocells` holding the
+integer (cell_lat, cell_lon) of a fixed-size lat/lon grid. Nearby lookups
+only load services whose cell intersects the bounding box of the search
+circle; exact distances are computed afterwards on that reduced set.
+
+The table lives in the same database as `services`, so it is shared by all
+workers and updated in the same transaction as the row it indexes.
+"""
+
+import math
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Query, Session
+
+import models
+
+# Cell edge in degrees (~11 km of latitude). Changing it requires rebuild().
+CELL_DEG = 0.1
+EARTH_RADIUS_KM = 6371.0
+
+_LAT_CELLS = int(round(180 / CELL_DEG))
+_LON_CELLS = int(round(360 / CELL_DEG))
+
+
+def cell_for(lat: float, lon: float) -> Tuple[int, int]:
+    """Return the (cell_lat, cell_lon) grid cell containing a coordinate."""
+    cell_lat = min(int(math.floor((lat + 90.0) / CELL_DEG)), _LAT_CELLS - 1)
+    cell_lon = min(int(math.floor((lon + 180.0) / CELL_DEG)), _LON_CELLS - 1)
+    return cell_lat, cell_lon
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, List[Tuple[float, float]]]:
+    """Return (lat_min, lat_max, lon_ranges) enclosing the circle of radius_km around (lat, lon).
+
+    Longitude ranges are split in two when the box crosses the antimeridian and
+    cover the whole globe when the circle contains a pole.
+    """
+    ang = radius_km / EARTH_RADIUS_KM
+    lat_r = math.radians(lat)
+    lat_min = lat_r - ang
+    lat_max = lat_r + ang
+    if lat_min <= -math.pi / 2 or lat_max >= math.pi / 2 or ang >= math.pi / 2:
+        return max(math.degrees(lat_min), -90.0), min(math.degrees(lat_max), 90.0), [(-180.0, 180.0)]
+
+    dlon = math.degrees(math.asin(min(1.0, math.sin(ang) / math.cos(lat_r))))
+    lon_min = lon - dlon
+    lon_max = lon + dlon
+    if lon_min < -180.0:
+        ranges = [(lon_min + 360.0, 180.0), (-180.0, lon_max)]
+    elif lon_max > 180.0:
+        ranges = [(lon_min, 180.0), (-180.0, lon_max - 360.0)]
+    else:
+        ranges = [(lon_min, lon_max)]
+    return math.degrees(lat_min), math.degrees(lat_max), ranges
+
+
+def cell_ranges(lat: float, lon: float, radius_km: float) -> Tuple[Tuple[int, int], List[Tuple[int, int]]]:
+    """Return the cell_lat range and cell_lon ranges intersecting the search circle."""
+    lat_min, lat_max, lon_ranges = bounding_box(lat, lon, radius_km)
+    row_lo, _ = cell_for(lat_min, 0.0)
+    row_hi, _ = cell_for(lat_max, 0.0)
+    cols = []
+    for lo, hi in lon_ranges:
+        if hi - lo >= 360.0:
+            cols.append((0, _LON_CELLS - 1))
+            continue
+        col_lo = int(math.floor((lo + 180.0) / CELL_DEG))
+        col_hi = min(int(math.floor((hi + 180.0) / CELL_DEG)), _LON_CELLS - 1)
+        cols.append((col_lo, col_hi))
+    return (row_lo, row_hi), cols
+
+
+def candidates(db: Session, lat: float, lon: float, radius_km: float) -> Query:
+    """Query of services whose grid cell intersects the search radius."""
+    (row_lo, row_hi), cols = cell_ranges(lat, lon, radius_km)
+    cell = models.ServiceGeoCell
+    return (
+        db.query(models.Service)
+        .join(cell, cell.service_id == models.Service.id)
+        .filter(
+            cell.cell_lat.between(row_lo, row_hi),
+            or_(*[and_(cell.cell_lon >= lo, cell.cell_lon <= hi) for lo, hi in cols]),
+        )
+    )
+
+
+# Cell rectangles OR-ed together in one statement (keeps SQL expression depth bounded)
+MAX_BOXES_PER_QUERY = 100
+
+
+def cell_boxes(points: List[Tuple[float, float, float]]) -> List[Tuple[int, int, int, int]]:
+    """Distinct (row_lo, row_hi, col_lo, col_hi) cell rectangles covering every (lat, lon, radius_km) point.
+
+    Points sharing or nested inside another point's rectangle (e.g. several
+    queries around the same camp) are covered once.
+    """
+    boxes = set()
+    for lat, lon, radius_km in points:
+        (row_lo, row_hi), cols = cell_ranges(lat, lon, radius_km)
+        boxes.update((row_lo, row_hi, col_lo, col_hi) for col_lo, col_hi in cols)
+    # Largest first, so nested rectangles are dropped in one pass
+    ordered = sorted(boxes, key=lambda b: (b[1] - b[0]) * (b[3] - b[2]), reverse=True)
+    kept: List[Tuple[int, int, int, int]] = []
+    for box in ordered:
+        if not any(k[0] <= box[0] and box[1] <= k[1] and k[2] <= box[2] and box[3] <= k[3] for k in kept):
+            kept.append(box)
+    return kept
+
+
+def coordinates_near(db: Session, points: List[Tuple[float, float, float]]) -> List[Tuple[int, float, float]]:
+    """(id, latitude, longitude) of services in the union of the grid cells around every (lat, lon, radius_km) point."""
+    boxes = cell_boxes(points)
+    cell = models.ServiceGeoCell
+    found = {}
+    for i in range(0, len(boxes), MAX_BOXES_PER_QUERY):
+        chunk = boxes[i:i + MAX_BOXES_PER_QUERY]
+        rows = (
+            db.query(models.Service.id, models.Service.latitude, models.Service.longitude)
+            .join(cell, cell.service_id == models.Service.id)
+            .filter(or_(*[
+                and_(cell.cell_lat.between(row_lo, row_hi), cell.cell_lon.between(col_lo, col_hi))
+                for row_lo, row_hi, col_lo, col_hi in chunk
+            ]))
+            .all()
+        )
+        # Rectangles from different chunks may overlap
+        for row in rows:
+            found[row[0]] = row
+    return list(found.values())
+
+
+def _coords(service: models.Service) -> Optional[Tuple[float, float]]:
+    if service.latitude is None or service.longitude is None:
+        return None
+    return float(service.latitude), float(service.longitude)
+
+
+def index_service(db: Session, service: models.Service) -> None:
+    """Insert or refresh the grid cell of a service. Caller commits."""
+    existing = db.get(models.ServiceGeoCell, service.id)
+    coords = _coords(service)
+    if coords is None:
+        if existing is not None:
+            db.delete(existing)
+        return
+    cell_lat, cell_lon = cell_for(*coords)
+    if existing is None:
+        db.add(models.ServiceGeoCell(service_id=service.id, cell_lat=cell_lat, cell_lon=cell_lon))
+    else:
+        existing.cell_lat = cell_lat
+        existing.cell_lon = cell_lon
+
+
+def index_rows(db: Session, rows: List[Tuple[int, Optional[float], Optional[float]]]) -> None:
+    """Insert grid cells for newly created (id, latitude, longitude) rows in one statement. Caller commits."""
+    cells = []
+    for service_id, lat, lon in rows:
+        if lat is None or lon is None:
+            continue
+        cell_lat, cell_lon = cell_for(float(lat), float(lon))
+        cells.append({"service_id": service_id, "cell_lat": cell_lat, "cell_lon": cell_lon})
+    if cells:
+        db.execute(insert(models.ServiceGeoCell), cells)
+
+
+def unindex_service(db: Session, service_id: int) -> None:
+    """Remove the grid cell of a service. Caller commits."""
+    unindex_many(db, [service_id])
+
+
+def unindex_many(db: Session, service_ids: List[int]) -> None:
+    """Remove the grid cells of several services in one statement. Caller commits."""
+    db.query(models.ServiceGeoCell).filter(models.ServiceGeoCell.service_id.in_(service_ids)).delete(
+        synchronize_session=False
+    )
+
+
+def rebuild(db: Session) -> int:
+    """Recompute every grid cell from the services table. Returns indexed row count."""
+    db.query(models.ServiceGeoCell).delete(synchronize_session=False)
+    rows = (
+        db.query(models.Service.id, models.Service.latitude, models.Service.longitude)
+        .filter(models.Service.latitude.isnot(None), models.Service.longitude.isnot(None))
+        .all()
+    )
+    cells = []
+    for service_id, lat, lon in rows:
+        cell_lat, cell_lon = cell_for(float(lat), float(lon))
+        cells.append({"service_id": service_id, "cell_lat": cell_lat, "cell_lon": cell_lon})
+    if cells:
+        db.bulk_insert_mappings(models.ServiceGeoCell, cells)
+    db.commit()
+    return len(cells)
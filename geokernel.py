@@ -0,0 +1,70 @@
+"""
+geokernel.py - Vectorized great-circle distance kernel
+
+Coordinates are held in contiguous float64 arrays (radians) so that the
+haversine distance from many query points to many services is computed in
+a handful of NumPy operations, followed by a top-k partial sort per query.
+"""
+
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+# Upper bound on distance matrix elements computed at once (~32 MB of float64)
+MAX_CHUNK_ELEMENTS = 4_000_000
+
+
+class CoordinateSet:
+    """Service ids with their coordinates stored as contiguous float64 radians."""
+
+    def __init__(self, rows: Iterable[Tuple[int, float, float]]):
+        rows = list(rows)
+        self.ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        self.lat = np.radians(np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows)))
+        self.lon = np.radians(np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows)))
+        self.cos_lat = np.cos(self.lat)
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+
+def haversine_matrix(q_lat: np.ndarray, q_lon: np.ndarray, coords: CoordinateSet) -> np.ndarray:
+    """Distances in km from each query point (degrees) to every coordinate, shape (Q, N)."""
+    q_lat = np.radians(np.asarray(q_lat, dtype=np.float64))[:, None]
+    q_lon = np.radians(np.asarray(q_lon, dtype=np.float64))[:, None]
+    a = (
+        np.sin((coords.lat[None, :] - q_lat) / 2.0) ** 2
+        + np.cos(q_lat) * coords.cos_lat[None, :] * np.sin((coords.lon[None, :] - q_lon) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def top_k_within(distances: np.ndarray, radius_km: float, k: int) -> np.ndarray:
+    """Indices of the k nearest entries within radius_km, nearest first."""
+    within = np.flatnonzero(distances <= radius_km)
+    if within.size > k:
+        part = np.argpartition(distances[within], k - 1)[:k]
+        within = within[part]
+    return within[np.argsort(distances[within], kind="stable")]
+
+
+def nearest(
+    coords: CoordinateSet,
+    queries: Sequence[Tuple[float, float, float, int]],
+) -> List[List[Tuple[int, float]]]:
+    """For each (lat, lon, radius_km, limit) query return [(service_id, distance_km), ...]."""
+    results: List[List[Tuple[int, float]]] = []
+    if len(coords) == 0:
+        return [[] for _ in queries]
+    chunk = max(1, MAX_CHUNK_ELEMENTS // len(coords))
+    for start in range(0, len(queries), chunk):
+        block = queries[start:start + chunk]
+        dist = haversine_matrix(
+            np.array([q[0] for q in block]), np.array([q[1] for q in block]), coords
+        )
+        for row, (_, _, radius_km, limit) in zip(dist, block):
+            idx = top_k_within(row, radius_km, limit)
+            results.append([(int(coords.ids[i]), float(row[i])) for i in idx])
+    return results
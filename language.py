@@ -0,0 +1,185 @@
+"""
+language.py - Offline language detection for AI requests
+
+Classifies text by Unicode script first (Arabic, Cyrillic, Devanagari, ...)
+and refines with letters specific to one language of that script (e.g.
+Persian, Urdu and Pashto letters in Arabic script). Latin-script text is
+scored against short stopword profiles. Returns English language names, as
+the remote detector does, together with a confidence in [0, 1] so callers
+can fall back to the remote model for ambiguous input.
+"""
+
+import re
+from bisect import bisect_right
+from typing import Dict, Optional, Sequence, Tuple
+
+# Only the beginning of the text is inspected
+MAX_CHARS = 800
+
+# (first code point, last code point, script)
+_SCRIPT_RANGES = sorted([
+    (0x0041, 0x005A, "Latin"), (0x0061, 0x007A, "Latin"), (0x00C0, 0x024F, "Latin"), (0x1E00, 0x1EFF, "Latin"),
+    (0x0370, 0x03FF, "Greek"),
+    (0x0400, 0x04FF, "Cyrillic"),
+    (0x0530, 0x058F, "Armenian"),
+    (0x0590, 0x05FF, "Hebrew"),
+    (0x0600, 0x06FF, "Arabic"), (0x0750, 0x077F, "Arabic"), (0xFB50, 0xFDFF, "Arabic"), (0xFE70, 0xFEFF, "Arabic"),
+    (0x0900, 0x097F, "Devanagari"),
+    (0x0980, 0x09FF, "Bengali"),
+    (0x0A00, 0x0A7F, "Gurmukhi"),
+    (0x0B80, 0x0BFF, "Tamil"),
+    (0x0E00, 0x0E7F, "Thai"),
+    (0x1000, 0x109F, "Myanmar"),
+    (0x10A0, 0x10FF, "Georgian"),
+    (0x1200, 0x139F, "Ethiopic"),
+    (0x1780, 0x17FF, "Khmer"),
+    (0x3040, 0x30FF, "Kana"),
+    (0x4E00, 0x9FFF, "Han"), (0x3400, 0x4DBF, "Han"),
+    (0xAC00, 0xD7AF, "Hangul"), (0x1100, 0x11FF, "Hangul"),
+])
+_RANGE_STARTS = [r[0] for r in _SCRIPT_RANGES]
+
+# Scripts used by essentially one language we serve
+_SCRIPT_LANGUAGE = {
+    "Greek": "Greek",
+    "Armenian": "Armenian",
+    "Hebrew": "Hebrew",
+    "Devanagari": "Hindi",
+    "Bengali": "Bengali",
+    "Gurmukhi": "Punjabi",
+    "Tamil": "Tamil",
+    "Thai": "Thai",
+    "Myanmar": "Burmese",
+    "Georgian": "Georgian",
+    "Khmer": "Khmer",
+    "Hangul": "Korean",
+    "Han": "Chinese",
+    "Cyrillic": "Russian",
+    "Arabic": "Arabic",
+    # Shared by Amharic and Tigrinya; the remote model can tell them apart
+    "Ethiopic": "Amharic",
+}
+
+# Letters that single out one language of a shared script, checked in order:
+# letters shared by several languages are listed under the last of them, e.g.
+# Persian letters also appear in Pashto, Urdu and Kurdish, so Persian comes
+# after those, and Arabic (ة ي ى, rare elsewhere) last. An entry with a third
+# element only counts when one of those letters appears as well.
+_MARKERS: Dict[str, Sequence[Tuple[str, Sequence[str], str]]] = {
+    "Arabic": (
+        ("Uyghur", "ۇۈۋ", ""),
+        ("Sindhi", "ٻڀڄڃڇڦڻ", ""),
+        ("Pashto", "ټډړږښځڅېۍ", ""),
+        ("Kurdish", "ەێۆڵڕ", ""),
+        ("Urdu", "ٹڈڑںے", ""),
+        ("Persian", "پچژگکی", ""),
+        ("Arabic", "ةيى", ""),
+    ),
+    "Cyrillic": (
+        ("Macedonian", "ѓќѕ", ""),
+        ("Serbian", "ђћјљњџ", ""),
+        ("Tajik", "ӣӯҳҷ", ""),
+        ("Kazakh", "әғқұһ", ""),
+        ("Kyrgyz", "ңөү", ""),
+        ("Belarusian", "ў", ""),
+        ("Ukrainian", "їєґ", ""),
+        # Belarusian and Ukrainian share і; Ukrainian lacks ы э ё and Belarusian lacks и
+        ("Belarusian", "і", "ыэё"),
+        ("Ukrainian", "і", "и"),
+        ("Russian", "ыэё", ""),
+    ),
+    "Devanagari": (
+        ("Marathi", "ळ", ""),
+        # Hindi has no letter of its own; these common words stand in for one
+        ("Hindi", ("है", "में", "नहीं"), ""),
+    ),
+}
+
+# Confidence for a script's default language when no marker letter is
+# present. For scripts shared by several languages it must stay below
+# LANG_DETECT_MIN_CONFIDENCE (0.6) so such text goes to the remote model
+# (e.g. Bulgarian has no letter Russian lacks).
+_SCRIPT_DEFAULT_CONFIDENCE = {"Arabic": 0.5, "Cyrillic": 0.5, "Ethiopic": 0.5, "Devanagari": 0.5}
+
+_STOPWORDS = {
+    "English": "the a and is are was am i me my have has had been with for not you it of to in on this that pain since feel".split(),
+    "French": "le la les et est je j ai mal une un des du pas avec pour dans que depuis mon ma très".split(),
+    "Spanish": "el la los las y es yo tengo dolor una un con por para que no mi desde muy del se".split(),
+    "Portuguese": "o a os as e é eu tenho dor uma um com por para que não meu minha desde muito do da".split(),
+    "German": "der die das und ist ich habe schmerzen eine ein mit für nicht mein meine seit sehr in zu".split(),
+    "Italian": "il la le e è io ho dolore una un con per che non mio mia da molto di del".split(),
+    "Turkish": "ve bir bu ben çok var ağrı ile için değil benim da de mi gibi ama".split(),
+    "Somali": "waa iyo ka ku aan waxaan qabaa xanuun leeyahay ayaa ma la oo si".split(),
+    "Swahili": "na ni ya kwa wa mimi nina maumivu sana hii la za katika tangu".split(),
+    "Dutch": "de het een en is ik heb pijn met voor niet mijn sinds zeer van".split(),
+}
+_STOPWORD_LANGUAGES: Dict[str, list] = {}
+for _language, _words in _STOPWORDS.items():
+    for _word in _words:
+        _STOPWORD_LANGUAGES.setdefault(_word, []).append(_language)
+
+_LATIN_WORD = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def _script(ch: str) -> Optional[str]:
+    cp = ord(ch)
+    i = bisect_right(_RANGE_STARTS, cp) - 1
+    if i >= 0 and cp <= _SCRIPT_RANGES[i][1]:
+        return _SCRIPT_RANGES[i][2]
+    return None
+
+
+def _latin(text: str) -> Tuple[Optional[str], float]:
+    scores: Dict[str, float] = {}
+    words = _LATIN_WORD.findall(text.casefold())
+    for word in words:
+        languages = _STOPWORD_LANGUAGES.get(word)
+        if languages:
+            for language in languages:
+                # Words shared by several languages count for less
+                scores[language] = scores.get(language, 0.0) + 1.0 / len(languages)
+    if not scores:
+        return None, 0.0
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    margin = (best_score - runner_up) / best_score
+    # A couple of matching words is weak evidence on its own
+    support = min(1.0, best_score / 3.0)
+    return best, round(margin * support, 3)
+
+
+def detect(text: str) -> Tuple[Optional[str], float]:
+    """(language name, confidence) for `text`; (None, 0.0) when nothing can be inferred."""
+    sample = text[:MAX_CHARS]
+    counts: Dict[str, int] = {}
+    letters = 0
+    for ch in sample:
+        if ch.isalpha():
+            letters += 1
+            script = _script(ch)
+            if script is not None:
+                counts[script] = counts.get(script, 0) + 1
+    if not counts:
+        return None, 0.0
+
+    script, count = max(counts.items(), key=lambda item: item[1])
+    share = count / letters
+    if script == "Latin":
+        language, confidence = _latin(sample)
+        return language, round(confidence * share, 3)
+    if script in ("Han", "Kana"):
+        # Any kana means Japanese; Han alone is Chinese
+        if "Kana" in counts:
+            return "Japanese", round(min(1.0, (counts.get("Kana", 0) + counts.get("Han", 0)) / letters), 3)
+        return "Chinese", round(share, 3)
+
+    markers = _MARKERS.get(script)
+    if markers:
+        lowered = sample.lower()
+        for language, chars, alongside in markers:
+            hits = sum(lowered.count(ch) for ch in chars)
+            if hits and (not alongside or any(ch in lowered for ch in alongside)):
+                return language, round(share * min(1.0, 0.7 + 0.1 * hits), 3)
+    cap = _SCRIPT_DEFAULT_CONFIDENCE.get(script, 1.0)
+    return _SCRIPT_LANGUAGE.get(script), round(share * cap, 3)
@@ -8,26 +8,42 @@ Requirements:
     pip install fastapi uvicorn sqlalchemy pydantic
 """
 
+import base64
+import binascii
+import csv
+import io
+import json
 import logging
 import os
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, Query, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 
-import models
 import schemas
 import crud
+import bulk
+import serialize
+from compression import CompressionMiddleware
+import migrations
+import dirversion
 
 # Load environment variables from .env if present (before loading DB/AI modules)
 load_dotenv()
 
-from database import SessionLocal, engine, Base
+from database import SessionLocal, AsyncSessionLocal, ReplicaSessionLocal, AsyncReplicaSessionLocal, engine, run_db
 import ai
+import ai_limits
+import cache
+import chat_sessions
+import resilience
+import triage_pipeline
 
 # Configure logging
 logging.basicConfig(
@@ -36,44 +52,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Schema changes are applied by `python manage.py migrate`, not at import.
+# DB_AUTO_MIGRATE=true applies them at startup instead (convenient for local dev).
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true"
+
+# Confidence reported when /ai/triage-advice falls back to the keyword rules
+RULE_BASED_CONFIDENCE = 0.5
 
 def init_db():
-    """Initialize database with sample data"""
-    db = SessionLocal()
+    """Check (or with DB_AUTO_MIGRATE, apply) schema migrations. Seeding is `python manage.py seed`."""
     try:
-        # Ensure geolocation columns exist (SQLite simple migration)
-        try:
-            with engine.connect() as conn:
-                cols = conn.exec_driver_sql("PRAGMA table_info(services);").fetchall()
-                col_names = {row[1] for row in cols}
-                if "latitude" not in col_names:
-                    conn.exec_driver_sql("ALTER TABLE services ADD COLUMN latitude REAL;")
-                if "longitude" not in col_names:
-                    conn.exec_driver_sql("ALTER TABLE services ADD COLUMN longitude REAL;")
-        except Exception as e:
-            logger.warning(f"Skipping geo column migration: {e}")
-
-        if db.query(models.Service).count() == 0:
-            example_services = [
-                models.Service(name="City Hospital", location="123 Main St", contact="555-1234", latitude=28.6139, longitude=77.2090),
-                models.Service(name="Urgent Care Clinic", location="456 Elm St", contact="555-5678", latitude=28.5355, longitude=77.3910),
-                models.Service(name="Emergency Room", location="789 Oak Ave", contact="911", latitude=28.4595, longitude=77.0266),
-                models.Service(name="Family Clinic", location="321 Pine St", contact="555-9999", latitude=28.7041, longitude=77.1025),
-            ]
-            db.add_all(example_services)
-            db.commit()
-            logger.info("Database initialized with sample services")
-    except Exception as e:
-        logger.error(f"Error initializing database: {e}")
-        db.rollback()
-    finally:
-        db.close()
-
-init_db()
-
-def get_db():
+        if DB_AUTO_MIGRATE:
+            migrations.upgrade(engine)
+        elif not migrations.is_up_to_date(engine):
+            logger.warning("Database schema is out of date; run `python manage.py migrate`")
+    except SQLAlchemyError as e:
+        logger.error(f"Error checking database schema: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup work runs once the server starts, not when `main` is imported."""
+    await run_in_threadpool(init_db)
+    yield
+    triage_pipeline.shutdown()
+    ai.shutdown_ai_clients()
+
+def _get_sync_db():
     """Database dependency"""
     db = SessionLocal()
     try:
@@ -81,13 +85,62 @@ def get_db():
     finally:
         db.close()
 
+async def _get_async_db():
+    """Database dependency (DATABASE_ASYNC=true): an AsyncSession on the async engine"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Endpoints call crud through run_db, which accepts either session type
+get_db = _get_async_db if AsyncSessionLocal is not None else _get_sync_db
+
+async def get_read_db(db: Session = Depends(get_db)):
+    """Session for read-only endpoints: the replica when DATABASE_REPLICA_URL is set, else the primary"""
+    if AsyncReplicaSessionLocal is not None:
+        async with AsyncReplicaSessionLocal() as replica:
+            yield replica
+    elif ReplicaSessionLocal is not None:
+        replica = ReplicaSessionLocal()
+        try:
+            yield replica
+        finally:
+            replica.close()
+    else:
+        yield db
+
+# Conditional GET for cacheable read endpoints
+SERVICES_CACHE_MAX_AGE = int(os.getenv("SERVICES_CACHE_MAX_AGE", "0"))
+CACHE_CONTROL = f"public, max-age={SERVICES_CACHE_MAX_AGE}, must-revalidate"
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in candidates or etag in [c[2:] if c.startswith("W/") else c for c in candidates]
+
+async def conditional_get(request: Request, response: Response, db: Session = Depends(get_read_db)):
+    """Tag responses with the directory version; answer a matching If-None-Match with 304.
+
+    The version comes from an in-process cache (see dirversion.py),
+    so a 304 normally costs no database query.
+    """
+    resource = request.url.path + ("?" + request.url.query if request.url.query else "")
+    etag = dirversion.cached_etag(resource) or await run_db(db, dirversion.etag, resource)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        raise HTTPException(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+        )
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
 # FastAPI app configuration
 app = FastAPI(
     title="Business Management System API",
     description="A comprehensive API for triage and health services management",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # (Mock frontend removed) No static files mounted; root path returns 404 by default
@@ -99,8 +152,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor"],
 )
 
+# Compress larger responses (brotli when installed, else gzip)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
 # Global exception handler
 @app.exception_handler(SQLAlchemyError)
 async def sqlalchemy_exception_handler(request, exc):
@@ -124,84 +182,204 @@ def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "BMS API is running"}
 
+def rule_based_triage(symptom: str) -> schemas.TriageResponse:
+    """Keyword triage; also the answer of /ai/triage-advice when the model cannot be reached in time."""
+    symptom = symptom.lower().strip()
+
+    # Emergency conditions
+    emergency_keywords = ["breathing", "chest pain", "heart attack", "stroke", "severe bleeding", "unconscious"]
+    if any(keyword in symptom for keyword in emergency_keywords):
+        return schemas.TriageResponse(
+            status="EMERGENCY",
+            recommendation="Seek immediate emergency medical attention. Call 911."
+        )
+
+    # Urgent conditions
+    urgent_keywords = ["fever", "diarrhea", "vomiting", "severe pain", "infection"]
+    if any(keyword in symptom for keyword in urgent_keywords):
+        return schemas.TriageResponse(
+            status="URGENT",
+            recommendation="Seek medical attention within 24 hours."
+        )
+
+    # Self-care conditions
+    return schemas.TriageResponse(
+        status="SELF-CARE",
+        recommendation="Monitor symptoms. Consider over-the-counter remedies or consult a healthcare provider if symptoms persist."
+    )
+
 # Triage endpoint
 @app.post("/triage", response_model=schemas.TriageResponse)
 def triage(request: schemas.TriageRequest):
     """Perform medical triage based on symptoms"""
     try:
-        symptom = request.symptom.lower().strip()
-        
-        # Emergency conditions
-        emergency_keywords = ["breathing", "chest pain", "heart attack", "stroke", "severe bleeding", "unconscious"]
-        if any(keyword in symptom for keyword in emergency_keywords):
-            return schemas.TriageResponse(
-                status="EMERGENCY",
-                recommendation="Seek immediate emergency medical attention. Call 911."
-            )
-        
-        # Urgent conditions
-        urgent_keywords = ["fever", "diarrhea", "vomiting", "severe pain", "infection"]
-        if any(keyword in symptom for keyword in urgent_keywords):
-            return schemas.TriageResponse(
-                status="URGENT",
-                recommendation="Seek medical attention within 24 hours."
-            )
-        
-        # Self-care conditions
-        return schemas.TriageResponse(
-            status="SELF-CARE",
-            recommendation="Monitor symptoms. Consider over-the-counter remedies or consult a healthcare provider if symptoms persist."
-        )
+        return rule_based_triage(request.symptom)
     except Exception as e:
         logger.error(f"Error in triage: {e}")
         raise HTTPException(status_code=500, detail="Error processing triage request")
 
 # Service endpoints
-@app.get("/services", response_model=List[schemas.ServiceOut])
-def get_services(
+def _encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    """Return the last id seen for a cursor; an empty cursor starts from the beginning."""
+    if not cursor:
+        return 0
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, _, value = raw.partition(":")
+        if prefix != "id":
+            raise ValueError(raw)
+        return int(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/services", response_model=List[schemas.ServiceOut], dependencies=[Depends(conditional_get)])
+async def get_services(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of records to return"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(
+        None,
+        description="Keyset pagination cursor from a previous X-Next-Cursor/Link header; pass it empty to start",
+    ),
+    db: Session = Depends(get_read_db)
 ):
-    """Get all services with pagination"""
+    """Get all services with offset pagination, or keyset pagination when `cursor` is given"""
     try:
-        services = crud.get_services(db, skip=skip, limit=limit)
-        return services
+        if cursor is None:
+            return serialize.services_response(await run_db(db, crud.get_services, skip=skip, limit=limit), response)
+        if skip:
+            raise HTTPException(status_code=400, detail="skip cannot be combined with cursor")
+        # Fetch one extra row to learn whether another page exists
+        services = await run_db(db, crud.get_services_after, after_id=_decode_cursor(cursor), limit=limit + 1)
+        if len(services) > limit:
+            services = services[:limit]
+            next_cursor = _encode_cursor(services[-1].id)
+            next_url = request.url.include_query_params(cursor=next_cursor)
+            response.headers["X-Next-Cursor"] = next_cursor
+            response.headers["Link"] = f'<{next_url}>; rel="next"'
+        return serialize.services_response(services, response)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching services: {e}")
         raise HTTPException(status_code=500, detail="Error fetching services")
 
 # Define static service routes BEFORE the dynamic '/services/{service_id}'
+# Directory export endpoint
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+async def _export_batches(db):
+    after_id = 0
+    while True:
+        rows = await run_db(db, crud.get_service_rows_after, after_id, EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+async def _export_ndjson(batches):
+    async for rows in batches:
+        yield "".join(json.dumps(dict(zip(crud.EXPORT_FIELDS, row)), ensure_ascii=False) + "\n" for row in rows)
+
+async def _export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(crud.EXPORT_FIELDS)
+    async for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.get("/services/export")
+async def export_services(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="ndjson or csv"),
+    db: Session = Depends(get_read_db),
+):
+    """Stream the whole service directory as NDJSON or CSV with bounded memory."""
+    batches = _export_batches(db)
+    if fmt == "csv":
+        body, media_type = _export_csv(batches), "text/csv"
+    else:
+        body, media_type = _export_ndjson(batches), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="services.{fmt}"'},
+    )
+
 # Service search endpoint
 @app.get("/services/search", response_model=List[schemas.ServiceOut])
-def search_services(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)):
-    """Search services by text query across name, location, contact."""
+async def search_services(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    fuzzy: bool = Query(False, description="Typo-tolerant trigram matching"),
+    db: Session = Depends(get_read_db),
+):
+    """Search services by text query across name, location, contact (ranked, prefix matching)."""
     try:
-        return crud.search_services(db, query=q, limit=limit)
+        if fuzzy:
+            return serialize.services_response(await run_db(db, crud.fuzzy_search_services, query=q, limit=limit))
+        return serialize.services_response(await run_db(db, crud.search_services, query=q, limit=limit))
     except Exception as e:
         logger.error(f"Error searching services: {e}")
         raise HTTPException(status_code=500, detail="Error searching services")
 
+# Autocomplete endpoint (served from memory; no per-keystroke table scan)
+@app.get("/services/suggest", response_model=List[schemas.ServiceSuggestion])
+async def suggest_services(
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_read_db),
+):
+    """Suggest services whose name or location has a word starting with prefix."""
+    try:
+        return [
+            schemas.ServiceSuggestion(id=service_id, label=label)
+            for service_id, label in await run_db(db, crud.suggest_services, prefix=prefix, limit=limit)
+        ]
+    except Exception as e:
+        logger.error(f"Error suggesting services: {e}")
+        raise HTTPException(status_code=500, detail="Error suggesting services")
+
 # Nearby services endpoint
-@app.get("/services/nearby", response_model=List[schemas.ServiceOut])
-def services_nearby(
+@app.get("/services/nearby", response_model=List[schemas.ServiceOut], dependencies=[Depends(conditional_get)])
+async def services_nearby(
+    response: Response,
     lat: float = Query(..., ge=-90, le=90, description="Latitude"),
     lon: float = Query(..., ge=-180, le=180, description="Longitude"),
     radius_km: float = Query(10.0, gt=0, le=2000, description="Search radius in kilometers"),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     try:
-        return crud.nearby_services(db, lat=lat, lon=lon, radius_km=radius_km, limit=limit)
+        return serialize.services_response(await run_db(db, crud.nearby_services, lat=lat, lon=lon, radius_km=radius_km, limit=limit), response)
     except Exception as e:
         logger.error(f"Error fetching nearby services: {e}")
         raise HTTPException(status_code=500, detail="Error fetching nearby services")
 
-@app.get("/services/{service_id}", response_model=schemas.ServiceOut)
-def get_service(service_id: int, db: Session = Depends(get_db)):
+@app.post("/services/nearby/batch", response_model=List[List[schemas.ServiceOut]])
+async def services_nearby_batch(req: schemas.NearbyBatchRequest, db: Session = Depends(get_read_db)):
+    """Resolve many nearby queries at once; results are returned in query order."""
+    try:
+        queries = [(q.lat, q.lon, q.radius_km, q.limit) for q in req.queries]
+        results = await run_db(db, crud.nearby_services_batch, queries)
+        return serialize.json_response([serialize.service_dicts(r) for r in results])
+    except Exception as e:
+        logger.error(f"Error fetching batch nearby services: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching nearby services")
+
+@app.get("/services/{service_id}", response_model=schemas.ServiceOut, dependencies=[Depends(conditional_get)])
+async def get_service(service_id: int, db: Session = Depends(get_read_db)):
     """Get a specific service by ID"""
     try:
-        service = crud.get_service(db, service_id=service_id)
+        service = await run_db(db, crud.get_service, service_id=service_id)
         if service is None:
             raise HTTPException(status_code=404, detail="Service not found")
         return service
@@ -212,19 +390,94 @@ def get_service(service_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error fetching service")
 
 @app.post("/services", response_model=schemas.ServiceOut, status_code=status.HTTP_201_CREATED)
-def create_service(service: schemas.ServiceCreate, db: Session = Depends(get_db)):
+async def create_service(service: schemas.ServiceCreate, db: Session = Depends(get_db)):
     """Create a new service"""
     try:
-        return crud.create_service(db=db, service=service)
+        return await run_db(db, crud.create_service, service=service)
     except Exception as e:
         logger.error(f"Error creating service: {e}")
         raise HTTPException(status_code=500, detail="Error creating service")
 
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+_BULK_BODY = {"$ref": "#/components/schemas/ServiceCreate"}
+
+@app.post(
+    "/services/bulk",
+    response_model=schemas.BulkImportResult,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": _BULK_BODY}},
+                "application/x-ndjson": {"schema": _BULK_BODY},
+                "text/csv": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def bulk_create_services(request: Request, db: Session = Depends(get_db)):
+    """Import many services from a JSON array, NDJSON or CSV body.
+
+    Records are validated as they stream in and inserted in batches of
+    BULK_BATCH_SIZE; invalid records are reported per row without aborting the rest.
+    """
+    if bulk.content_type(request) not in bulk.SUPPORTED_TYPES:
+        raise HTTPException(status_code=415, detail="Use application/json, application/x-ndjson or text/csv")
+
+    result = schemas.BulkImportResult(created=0)
+    batch: List[tuple] = []
+
+    async def insert_batch(rows):
+        try:
+            ids = await run_db(db, crud.bulk_create_services, [service for _, service in rows])
+        except SQLAlchemyError as e:
+            logger.error(f"Bulk insert of rows {rows[0][0]}-{rows[-1][0]} failed: {e}")
+            result.errors.extend(schemas.BulkRowError(row=row, error="Database error; batch not inserted") for row, _ in rows)
+            return
+        result.ids.extend(ids)
+        result.created += len(ids)
+
+    try:
+        async for row, parsed in bulk.parse(request):
+            if isinstance(parsed, str):
+                result.errors.append(schemas.BulkRowError(row=row, error=parsed))
+                continue
+            batch.append((row, parsed))
+            if len(batch) >= BULK_BATCH_SIZE:
+                await insert_batch(batch)
+                batch = []
+        if batch:
+            await insert_batch(batch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result
+
+@app.patch("/services/bulk", response_model=schemas.BulkOperationResult)
+async def bulk_update_services(req: schemas.ServiceBulkUpdateRequest, db: Session = Depends(get_db)):
+    """Apply partial updates to many services at once; unknown ids are reported as missing."""
+    try:
+        affected, missing = await run_db(db, crud.bulk_update_services, req.items)
+        return schemas.BulkOperationResult(affected=affected, missing=missing)
+    except Exception as e:
+        logger.error(f"Error bulk updating services: {e}")
+        raise HTTPException(status_code=500, detail="Error updating services")
+
+@app.delete("/services/bulk", response_model=schemas.BulkOperationResult)
+async def bulk_delete_services(req: schemas.ServiceBulkDeleteRequest, db: Session = Depends(get_db)):
+    """Delete many services at once; unknown ids are reported as missing."""
+    try:
+        affected, missing = await run_db(db, crud.bulk_delete_services, req.ids)
+        return schemas.BulkOperationResult(affected=affected, missing=missing)
+    except Exception as e:
+        logger.error(f"Error bulk deleting services: {e}")
+        raise HTTPException(status_code=500, detail="Error deleting services")
+
 @app.put("/services/{service_id}", response_model=schemas.ServiceOut)
-def update_service(service_id: int, service_update: schemas.ServiceUpdate, db: Session = Depends(get_db)):
+async def update_service(service_id: int, service_update: schemas.ServiceUpdate, db: Session = Depends(get_db)):
     """Update an existing service"""
     try:
-        service = crud.update_service(db=db, service_id=service_id, service_update=service_update)
+        service = await run_db(db, crud.update_service, service_id=service_id, service_update=service_update)
         if service is None:
             raise HTTPException(status_code=404, detail="Service not found")
         return service
@@ -235,10 +488,10 @@ def update_service(service_id: int, service_update: schemas.ServiceUpdate, db: S
         raise HTTPException(status_code=500, detail="Error updating service")
 
 @app.delete("/services/{service_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_service(service_id: int, db: Session = Depends(get_db)):
+async def delete_service(service_id: int, db: Session = Depends(get_db)):
     """Delete a service"""
     try:
-        success = crud.delete_service(db=db, service_id=service_id)
+        success = await run_db(db, crud.delete_service, service_id=service_id)
         if not success:
             raise HTTPException(status_code=404, detail="Service not found")
         return None
@@ -254,41 +507,81 @@ def delete_service(service_id: int, db: Session = Depends(get_db)):
 def ai_triage_advice(req: schemas.AITriageAdviceRequest):
     """AI-generated triage advice with safety prompts and multilingual response."""
     try:
-        # Detect input language if not provided, and translate to English for model processing
-        original_lang = req.language or ai.detect_language(req.symptom) or "English"
-        symptom_en = ai.translate_text(req.symptom, "English") if original_lang.lower() != "english" else req.symptom
-
-        messages = ai.get_triage_advice_payload(
-            symptom=symptom_en,
-            age=req.age,
-            sex=req.sex,
-            pregnant=req.pregnant,
-            chronic_conditions=req.chronic_conditions,
-            location=req.location,
-            language="English",
+        # Identical requests (up to case/whitespace) are answered from the cache
+        request_key = ai.triage_request_key(
+            req.symptom, req.age, req.sex, req.pregnant, req.chronic_conditions, req.location, req.language
         )
-        advice_en = ai.safe_call(messages)
-        # Translate advice back to original_lang if needed
-        advice_out = ai.translate_text(advice_en + ai.SAFETY_DISCLAIMER, original_lang) if original_lang.lower() != "english" else advice_en + ai.SAFETY_DISCLAIMER
+        cached = ai.triage_cache.get(request_key)
+        if cached is not None:
+            return schemas.AITriageAdviceResponse(**cached)
+
+        # Detection, reasoning and translation (see triage_pipeline.py), within
+        # AI_REQUEST_DEADLINE; when it runs out or every provider's breaker is
+        # open, answer with the rule-based triage instead of waiting
+        try:
+            with resilience.deadline(resilience.AI_REQUEST_DEADLINE):
+                advice_out, from_model = triage_pipeline.run(req)
+        except resilience.FailFast as e:
+            logger.warning(f"AI triage advice unavailable, using rule-based triage: {e}")
+            rules = rule_based_triage(req.symptom)
+            return schemas.AITriageAdviceResponse(
+                advice=f"{rules.status}: {rules.recommendation}" + ai.SAFETY_DISCLAIMER,
+                confidence=RULE_BASED_CONFIDENCE,
+            )
         # Heuristic confidence (could be improved with provider-specific metadata)
         confidence = 0.8
-        return schemas.AITriageAdviceResponse(advice=advice_out, confidence=confidence)
+        result = schemas.AITriageAdviceResponse(advice=advice_out, confidence=confidence)
+        # Only cache answers that came from the model, not fallback messages
+        if from_model:
+            ai.triage_cache.set(request_key, result.model_dump())
+        return result
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"AI triage advice error: {e}")
         raise HTTPException(status_code=500, detail="AI triage advice error")
 
+def _chat_messages(req: schemas.AIChatRequest):
+    """(prompt messages, (session_id, session) or None) for a chat request.
+
+    With `message`, history comes from the server-side session; otherwise
+    from `history`. Either way older turns are compacted to keep the prompt
+    within CHAT_HISTORY_TOKEN_BUDGET (see chat_sessions.py).
+    """
+    if req.message is not None:
+        session_id, session = chat_sessions.prepare(req.session_id, req.message)
+        messages = ai.get_chat_payload(history=session["turns"], language=req.language, summary=session["summary"])
+        return messages, (session_id, session)
+    # Convert schema messages into plain dicts
+    history = [{"role": m.role, "content": m.content} for m in req.history]
+    turns, summary = chat_sessions.window(history)
+    return ai.get_chat_payload(history=turns, language=req.language, summary=summary), None
+
 @app.post("/ai/chat", response_model=schemas.AIChatResponse)
 def ai_chat(req: schemas.AIChatRequest):
-    """General health information chat with safety constraints."""
+    """General health information chat with safety constraints.
+
+    Send `message` (and the returned `session_id` on later turns) to keep the
+    conversation on the server, or the whole `history` each time. The model
+    call is bounded by AI_REQUEST_DEADLINE; past it the fallback reply is sent.
+    """
     try:
-        # Convert schema messages into plain dicts
-        history = [{"role": m.role, "content": m.content} for m in req.history]
-        messages = ai.get_chat_payload(history=history, language=req.language)
-        reply = ai.safe_call(messages)
+        messages, session = _chat_messages(req)
+        if session is None:
+            with resilience.deadline(resilience.AI_REQUEST_DEADLINE):
+                reply = ai.safe_call(messages)
+            return schemas.AIChatResponse(reply=reply + ai.SAFETY_DISCLAIMER)
+        session_id, state = session
+        try:
+            with resilience.deadline(resilience.AI_REQUEST_DEADLINE):
+                reply = ai.call_model(messages)
+        except Exception as e:
+            # Nothing is stored, so the client can resend the same message
+            reply = ai.fallback_reply(e)
+        else:
+            chat_sessions.record_reply(session_id, state, reply)
         # Append safety disclaimer always
-        return schemas.AIChatResponse(reply=reply + ai.SAFETY_DISCLAIMER)
+        return schemas.AIChatResponse(reply=reply + ai.SAFETY_DISCLAIMER, session_id=session_id)
     except Exception as e:
         logger.error(f"AI chat error: {e}")
         raise HTTPException(status_code=500, detail="AI chat error")
@@ -298,30 +591,96 @@ def ai_chat(req: schemas.AIChatRequest):
 def chat_alias(req: schemas.AIChatRequest):
     return ai_chat(req)
 
+# Streaming (Server-Sent Events) variants of the AI endpoints
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _stream_events(messages, language: str, session=None):
+    """`token` events as the model generates, an `error` event if it fails, then the disclaimer.
+
+    With a chat `session` ((session_id, state) from _chat_messages) a
+    `session` event comes first and the complete reply is stored at the end.
+    """
+    if session is not None:
+        yield _sse("session", {"session_id": session[0]})
+    parts = []
+    try:
+        for text in ai.stream_model(messages):
+            parts.append(text)
+            yield _sse("token", {"text": text})
+    except Exception as e:
+        yield _sse("error", {"detail": ai.fallback_reply(e)})
+    else:
+        if session is not None:
+            chat_sessions.record_reply(session[0], session[1], "".join(parts))
+    yield _sse("disclaimer", {"text": ai.translated_disclaimer(language)})
+
+@app.post("/ai/chat/stream")
+def ai_chat_stream(req: schemas.AIChatRequest):
+    """Like /ai/chat, streamed as Server-Sent Events (`session`, `token`..., `disclaimer`)."""
+    messages, session = _chat_messages(req)
+    # The model already answers in req.language; the disclaimer stays English as in /ai/chat
+    return StreamingResponse(_stream_events(messages, "English", session), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/ai/triage-advice/stream")
+def ai_triage_advice_stream(req: schemas.AITriageAdviceRequest):
+    """Like /ai/triage-advice, streamed as Server-Sent Events (`token`..., `disclaimer`).
+
+    The model is asked to answer directly in the user's language, since a
+    stream cannot be translated after the fact.
+    """
+    language = req.language or ai.detect_language(req.symptom) or "English"
+    messages = ai.get_triage_advice_payload(
+        symptom=req.symptom,
+        age=req.age,
+        sex=req.sex,
+        pregnant=req.pregnant,
+        chronic_conditions=req.chronic_conditions,
+        location=req.location,
+        language=language,
+    )
+    return StreamingResponse(_stream_events(messages, language), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/ai/metrics", response_model=schemas.AIMetricsResponse)
+def ai_metrics():
+    """Hit/miss counters of the AI caches, provider queue depths, coalesced calls and circuit breaker states."""
+    return schemas.AIMetricsResponse(
+        caches=cache.all_stats(),
+        providers=ai_limits.limiter_stats(),
+        singleflight=ai_limits.inflight.stats(),
+        routes=ai.route_stats(),
+        breakers=resilience.breaker_stats(),
+    )
+
 # --- Integration helper endpoints ---
 
 @app.post("/translate")
 def translate(text: str, target_language: str):
     """Translate arbitrary text to target_language using configured AI provider (Gemini)."""
     try:
-        # Best-effort: will return original text if translation not configured
-        translated = ai.translate_text(text, target_language)
+        # Best-effort: returns the original text if translation is not configured
+        # or does not finish within AI_REQUEST_DEADLINE
+        with resilience.deadline(resilience.AI_REQUEST_DEADLINE):
+            translated = ai.translate_text(text, target_language, budget=1.0)
         return {"text": translated}
     except Exception as e:
         logger.error(f"Translate error: {e}")
         raise HTTPException(status_code=500, detail="Translate error")
 
-@app.get("/facilities", response_model=List[schemas.ServiceOut])
-def facilities(
+@app.get("/facilities", response_model=List[schemas.ServiceOut], dependencies=[Depends(conditional_get)])
+async def facilities(
+    response: Response,
     lat: float = Query(..., ge=-90, le=90, description="Latitude"),
     lon: float = Query(..., ge=-180, le=180, description="Longitude"),
     radius_km: float = Query(10.0, gt=0, le=2000, description="Search radius in kilometers"),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """Alias for services/nearby to match mobile integration name."""
     try:
-        return crud.nearby_services(db, lat=lat, lon=lon, radius_km=radius_km, limit=limit)
+        return serialize.services_response(await run_db(db, crud.nearby_services, lat=lat, lon=lon, radius_km=radius_km, limit=limit), response)
     except Exception as e:
         logger.error(f"Facilities error: {e}")
         raise HTTPException(status_code=500, detail="Facilities error")
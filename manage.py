@@ -0,0 +1,71 @@
+"""
+manage.py - Administrative commands
+
+    python manage.py migrate [--to VERSION]   apply pending schema migrations
+    python manage.py current                  show the applied and latest versions
+    python manage.py seed                     add example services to an empty directory
+"""
+
+import argparse
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+# Same configuration as the API (DATABASE_URL etc.)
+load_dotenv()
+
+from database import SessionLocal, engine  # noqa: E402
+import crud  # noqa: E402
+import migrations  # noqa: E402
+
+
+def migrate(args) -> int:
+    applied = migrations.upgrade(engine, target=args.to)
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print("Database is up to date")
+    return 0
+
+
+def current(args) -> int:
+    with engine.connect() as conn:
+        version = migrations.current_version(conn)
+    print(f"Current version: {version} (latest: {migrations.latest_version()})")
+    for pending_version, name in migrations.pending(engine):
+        print(f"  pending {pending_version}: {name}")
+    return 0
+
+
+def seed(args) -> int:
+    if not migrations.is_up_to_date(engine):
+        print("Database schema is out of date; run `python manage.py migrate` first")
+        return 1
+    with SessionLocal() as db:
+        created = crud.seed_example_services(db)
+    print(f"Created {created} example services" if created else "Directory is not empty; nothing seeded")
+    return 0
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="BMS API administration")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="Apply pending schema migrations")
+    migrate_parser.add_argument("--to", type=int, default=None, help="Stop at this version")
+    migrate_parser.set_defaults(func=migrate)
+
+    current_parser = commands.add_parser("current", help="Show the schema version")
+    current_parser.set_defaults(func=current)
+
+    seed_parser = commands.add_parser("seed", help="Add example services to an empty directory")
+    seed_parser.set_defaults(func=seed)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+memindex.py - Lifecycle of in-process indexes over the services table
+
+Indexes register themselves here. They are built lazily from the database on
+first use, updated incrementally by the CRUD helpers after each commit, and
+rebuilt from scratch when the tables are recreated, or after MEMINDEX_TTL
+seconds if the directory version shows writes since the last build (which
+picks up writes made by other worker processes). Rebuilds bulk-load new
+indexes without holding the lock that lookups and writes need, and swap
+them in when done.
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import dirversion
+import models
+from database import Base
+
+MEMINDEX_TTL = float(os.getenv("MEMINDEX_TTL", "300"))
+
+# Service fields covered by the text indexes
+FIELDS = ("name", "location", "contact")
+
+
+class ServiceIndex(Protocol):
+    def clear(self) -> None: ...
+    def add(self, service_id: int, fields: Dict[str, str]) -> None: ...
+    def load(self, items: Iterable[Tuple[int, Dict[str, str]]]) -> None: ...
+    def remove(self, service_id: int) -> None: ...
+    def remove_many(self, service_ids: Iterable[int]) -> None: ...
+    def replace(self, other) -> None: ...
+
+
+_indexes: List[ServiceIndex] = []
+# Guards index contents; held only for lookups, incremental updates and swaps
+_lock = threading.RLock()
+# One full (re)build at a time, done without holding _lock
+_build_lock = threading.Lock()
+_built_at: float | None = None
+# Directory version (see dirversion.py) the indexes were built at
+_built_version = None
+# Writes seen while a build is reading the table, replayed before its swap
+# (service_id, fields), fields None for a removal
+_pending: Optional[List[Tuple[int, Optional[Dict[str, str]]]]] = None
+
+_NON_ALNUM = re.compile(r"[^\w]+|_", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """Casefold, strip accents and collapse punctuation to single spaces."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", stripped.casefold()).strip()
+
+
+def register(index: ServiceIndex) -> ServiceIndex:
+    with _lock:
+        _indexes.append(index)
+    return index
+
+
+def _fields(service) -> Dict[str, str]:
+    return {f: getattr(service, f) or "" for f in FIELDS}
+
+
+def _is_fresh() -> bool:
+    return _built_at is not None and time.monotonic() - _built_at < MEMINDEX_TTL
+
+
+def _rebuild(db: Session) -> None:
+    """Load fresh indexes from the table outside _lock, then swap them in."""
+    global _built_at, _built_version, _pending
+    with _lock:
+        _pending = []
+    try:
+        # Read before the rows, so a write racing the snapshot triggers another rebuild
+        version = dirversion.current(db)
+        rows = db.query(models.Service.id, *[getattr(models.Service, f) for f in FIELDS]).all()
+        items = [(row[0], dict(zip(FIELDS, row[1:]))) for row in rows]
+        fresh = []
+        for index in _indexes:
+            replacement = type(index)()
+            replacement.load(items)
+            fresh.append(replacement)
+        with _lock:
+            latest = dict(_pending)
+            for replacement in fresh:
+                replacement.remove_many(latest)
+                replacement.load([(service_id, fields) for service_id, fields in latest.items() if fields is not None])
+            for index, replacement in zip(_indexes, fresh):
+                index.replace(replacement)
+            _built_at, _built_version = time.monotonic(), version
+    finally:
+        with _lock:
+            _pending = None
+
+
+def ensure_built(db: Session) -> None:
+    """Build every registered index from the database if missing or expired.
+
+    The first build is waited for. Once expired, the directory version is
+    checked: if no worker has written since the build the index is kept,
+    otherwise one caller rebuilds it while the others keep using the current
+    contents.
+    """
+    global _built_at
+    if _is_fresh():
+        return
+    if _built_at is None:
+        with _build_lock:
+            if _built_at is None:
+                _rebuild(db)
+        return
+    if _build_lock.acquire(blocking=False):
+        try:
+            if _is_fresh():
+                return
+            if dirversion.current(db) == _built_version:
+                with _lock:
+                    _built_at = time.monotonic()
+                return
+            _rebuild(db)
+        finally:
+            _build_lock.release()
+
+
+def search(db: Session, index, *args, **kwargs):
+    """Run index.search(*args, **kwargs) on a built index, consistent with concurrent writes."""
+    ensure_built(db)
+    with _lock:
+        return index.search(*args, **kwargs)
+
+
+def upsert(service) -> None:
+    """Reflect a created or updated service in every built index."""
+    upsert_fields(service.id, _fields(service))
+
+
+def upsert_fields(service_id: int, fields: Dict[str, str]) -> None:
+    """Like upsert() for callers holding plain column values instead of an ORM object."""
+    upsert_many([(service_id, fields)])
+
+
+def upsert_many(items: Iterable[Tuple[int, Dict[str, str]]]) -> None:
+    """Reflect many created or updated services at once (one sort per index, not one insert per key)."""
+    items = [(service_id, {f: fields.get(f) or "" for f in FIELDS}) for service_id, fields in items]
+    with _lock:
+        if _pending is not None:
+            _pending.extend(items)
+        if _built_at is None:
+            return
+        ids = [service_id for service_id, _ in items]
+        for index in _indexes:
+            index.remove_many(ids)
+            if len(items) == 1:
+                index.add(*items[0])
+            else:
+                index.load(items)
+
+
+def remove(service_id: int) -> None:
+    """Drop a deleted service from every built index."""
+    remove_many([service_id])
+
+
+def remove_many(service_ids: Iterable[int]) -> None:
+    """Drop many deleted services from every built index."""
+    service_ids = list(service_ids)
+    with _lock:
+        if _pending is not None:
+            _pending.extend((service_id, None) for service_id in service_ids)
+        if _built_at is None:
+            return
+        for index in _indexes:
+            index.remove_many(service_ids)
+
+
+def invalidate(*args, **kwargs) -> None:
+    """Force a rebuild on next use."""
+    global _built_at
+    with _lock:
+        _built_at = None
+
+
+# Tables recreated (e.g. a fresh test database): drop whatever we had cached
+event.listen(Base.metadata, "after_create", invalidate)
+event.listen(Base.metadata, "after_drop", invalidate)
@@ -0,0 +1,121 @@
+"""
+migrations.py - Versioned schema migrations
+
+Each migration is a numbered function applied once, in order, inside its own
+transaction; applied versions are recorded in `schema_migrations`. Run them
+explicitly before starting the API:
+
+    python manage.py migrate
+
+The API only checks that the database is up to date (a single query) and
+never alters the schema while serving. Migrations must be idempotent so they
+can be applied to databases created by older `create_all` startups.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, insert, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+import fts
+import geoindex
+import models
+from database import Base
+
+logger = logging.getLogger(__name__)
+
+# Kept out of Base.metadata so create_all / drop_all never touch it
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: int, name: str):
+    def register(fn: Callable[[Connection], None]):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+@migration(1, "baseline tables")
+def _baseline(conn: Connection) -> None:
+    # Creates only missing tables; existing ones are upgraded below
+    Base.metadata.create_all(bind=conn)
+
+
+@migration(2, "services latitude/longitude columns")
+def _geo_columns(conn: Connection) -> None:
+    existing = {c["name"] for c in inspect(conn).get_columns("services")}
+    for name in ("latitude", "longitude"):
+        if name not in existing:
+            column_type = models.Service.__table__.c[name].type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE services ADD COLUMN {name} {column_type}")
+
+
+@migration(3, "services lat/lon and name indexes")
+def _service_indexes(conn: Connection) -> None:
+    for index in models.Service.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+@migration(4, "spatial grid backfill")
+def _geocells(conn: Connection) -> None:
+    with Session(bind=conn) as db:
+        indexed = geoindex.rebuild(db)
+    logger.info(f"Indexed {indexed} services in the spatial grid")
+
+
+@migration(5, "full-text index")
+def _fts(conn: Connection) -> None:
+    fts.ensure(conn)
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def current_version(conn: Connection) -> int:
+    """Highest applied version, 0 for a database that was never migrated."""
+    if not inspect(conn).has_table(schema_migrations.name):
+        return 0
+    return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def pending(engine: Engine) -> List[Tuple[int, str]]:
+    with engine.connect() as conn:
+        current = current_version(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version > current]
+
+
+def is_up_to_date(engine: Engine) -> bool:
+    return not pending(engine)
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to `target` (default: latest). Returns the applied versions."""
+    _metadata.create_all(bind=engine)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            if version <= current_version(conn):
+                continue
+            logger.info(f"Applying migration {version}: {name}")
+            fn(conn)
+            conn.execute(
+                insert(schema_migrations).values(version=version, name=name, applied_at=datetime.now(timezone.utc))
+            )
+        applied.append(version)
+    return applied
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
 from database import Base
 
 class Service(Base):
@@ -12,3 +12,28 @@ class Service(Base):
     # Using String or Float? Use String simplifies SQLite ALTER in some cases, but Float is appropriate.
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+
+    # Created on existing databases by migrations.py
+    __table_args__ = (
+        Index("ix_services_lat_lon", "latitude", "longitude"),
+        Index("ix_services_name", "name"),
+    )
+
+class ServiceGeoCell(Base):
+    """Grid cell of a geolocated service, maintained by geoindex.py for nearby lookups."""
+    __tablename__ = "service_geocells"
+    service_id = Column(Integer, ForeignKey("services.id", ondelete="CASCADE"), primary_key=True)
+    cell_lat = Column(Integer, nullable=False)
+    cell_lon = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_service_geocells_cell", "cell_lat", "cell_lon"),
+    )
+
+class DirectoryState(Base):
+    """Single-row version counter of the services directory, bumped on every write (see dirversion.py)."""
+    __tablename__ = "directory_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    # Random per-database token so versions never repeat after the table is recreated
+    epoch = Column(String, nullable=False)
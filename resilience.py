@@ -0,0 +1,179 @@
+"""
+resilience.py - Circuit breakers and request deadlines for AI calls
+
+CircuitBreaker: after AI_BREAKER_FAILURES consecutive failures a provider's
+breaker opens and calls fail immediately with CircuitOpenError. After
+AI_BREAKER_RESET_SECONDS one trial call is let through (half-open); its
+outcome closes the breaker again or re-opens it.
+
+Deadlines: `with deadline(seconds):` sets an end-to-end budget for the
+current request in a context variable, and `with share(0.25):` narrows it
+for one stage so later stages keep the rest. Remote calls use the time left
+(stage_timeout) as their network timeout; once it is spent they raise
+DeadlineExceeded without calling out. Worker threads see the deadline only
+when submitted through `submit()`.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "30"))
+# End-to-end budget of one AI triage request, in seconds
+AI_REQUEST_DEADLINE = float(os.getenv("AI_REQUEST_DEADLINE", "15"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class FailFast(Exception):
+    """Base of errors raised instead of waiting on a provider."""
+
+
+class CircuitOpenError(FailFast):
+    pass
+
+
+class DeadlineExceeded(FailFast):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = AI_BREAKER_FAILURES, reset_timeout: float = AI_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probing = False
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and not self._probing:
+                # Let exactly one trial call through
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def call(self, fn: Callable[[], Any], ignore: tuple = ()) -> Any:
+        """Run fn() through the breaker; exceptions in `ignore` do not count as provider failures."""
+        self.allow()
+        try:
+            result = fn()
+        except ignore:
+            with self._lock:
+                self._probing = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            return {"provider": self.name, "state": state, "consecutive_failures": self._failures, "rejected": self.rejected}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        found = _breakers.get(provider)
+        if found is None:
+            found = _breakers[provider] = CircuitBreaker(provider)
+        return found
+
+
+def breaker_stats() -> List[Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [b.stats() for b in breakers]
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("ai_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Bound everything called inside the block to `seconds` from now (nested deadlines only shrink it)."""
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current deadline, or None without one."""
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+@contextmanager
+def share(fraction: float) -> Iterator[None]:
+    """Give the block `fraction` of the time left, keeping the rest for later stages (no-op without a deadline)."""
+    left = remaining()
+    if left is None:
+        yield
+        return
+    with deadline(left * fraction):
+        yield
+
+
+def stage_timeout() -> Optional[float]:
+    """Network timeout for a call made now: the time left, or None without a deadline.
+
+    Raises DeadlineExceeded when the budget is already spent.
+    """
+    left = remaining()
+    if left is None:
+        return None
+    if left <= 0:
+        raise DeadlineExceeded("AI request deadline exceeded")
+    return left
+
+
+def submit(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+    """executor.submit() that carries the caller's deadline into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 from typing import Optional, List
 
 class TriageRequest(BaseModel):
@@ -25,11 +25,46 @@ class ServiceUpdate(BaseModel):
     latitude: Optional[float] = Field(None, ge=-90, le=90)
     longitude: Optional[float] = Field(None, ge=-180, le=180)
 
+class ServiceBulkUpdateItem(ServiceUpdate):
+    id: int = Field(..., description="Service to update; other fields are a partial update")
+
+class ServiceBulkUpdateRequest(BaseModel):
+    items: List[ServiceBulkUpdateItem] = Field(..., min_length=1, max_length=10000)
+
+class ServiceBulkDeleteRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=10000)
+
+class BulkOperationResult(BaseModel):
+    affected: int = Field(..., description="Number of services updated or deleted")
+    missing: List[int] = Field(default_factory=list, description="Requested ids that do not exist")
+
 class ServiceOut(ServiceBase):
     id: int
     
     model_config = ConfigDict(from_attributes=True)
 
+class BulkRowError(BaseModel):
+    row: int = Field(..., description="1-based position of the record in the upload")
+    error: str
+
+class BulkImportResult(BaseModel):
+    created: int
+    ids: List[int] = Field(default_factory=list, description="Ids of created services, in upload order")
+    errors: List[BulkRowError] = Field(default_factory=list)
+
+class ServiceSuggestion(BaseModel):
+    id: int
+    label: str = Field(..., description="Display string: service name, plus location when the location matched")
+
+class NearbyQuery(BaseModel):
+    lat: float = Field(..., ge=-90, le=90, description="Latitude")
+    lon: float = Field(..., ge=-180, le=180, description="Longitude")
+    radius_km: float = Field(10.0, gt=0, le=2000, description="Search radius in kilometers")
+    limit: int = Field(20, ge=1, le=100)
+
+class NearbyBatchRequest(BaseModel):
+    queries: List[NearbyQuery] = Field(..., min_length=1, max_length=1000, description="Nearby queries resolved in one call")
+
 # ---- AI Schemas ----
 
 class AITriageAdviceRequest(BaseModel):
@@ -50,8 +85,64 @@ class AIChatMessage(BaseModel):
     content: str = Field(..., min_length=1)
 
 class AIChatRequest(BaseModel):
-    history: List[AIChatMessage] = Field(..., description="Ordered list of messages")
+    history: Optional[List[AIChatMessage]] = Field(None, description="Ordered list of messages (stateless mode)")
+    message: Optional[str] = Field(None, min_length=1, max_length=4000, description="New user message (session mode)")
+    session_id: Optional[str] = Field(None, max_length=64, description="Session from a previous reply; omit to start one")
     language: Optional[str] = Field(None, description="Target response language")
 
+    @model_validator(mode="after")
+    def check_history_or_message(self):
+        if self.message is None and self.history is None:
+            raise ValueError("Provide 'message' (with 'session_id' after the first turn) or the full 'history'")
+        return self
+
 class AIChatResponse(BaseModel):
     reply: str
+    session_id: Optional[str] = Field(None, description="Send back with the next message")
+
+class CacheStats(BaseModel):
+    name: str
+    size: int
+    max_entries: int
+    ttl_seconds: float
+    persistent: bool
+    hits: int
+    disk_hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+class ProviderQueueStats(BaseModel):
+    provider: str
+    limit: int
+    in_flight: int
+    queue_depth: int
+    max_queue_depth: int
+    completed: int
+    timeouts: int
+
+class SingleFlightStats(BaseModel):
+    calls: int
+    coalesced: int
+    in_flight: int
+
+class ProviderRouteStats(BaseModel):
+    provider: str
+    samples: int
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    error_rate: float
+    healthy: bool
+
+class CircuitBreakerStats(BaseModel):
+    provider: str
+    state: str = Field(..., description="closed|open|half_open")
+    consecutive_failures: int
+    rejected: int
+
+class AIMetricsResponse(BaseModel):
+    caches: List[CacheStats]
+    providers: List[ProviderQueueStats] = []
+    singleflight: Optional[SingleFlightStats] = None
+    routes: List[ProviderRouteStats] = []
+    breakers: List[CircuitBreakerStats] = []
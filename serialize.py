@@ -0,0 +1,46 @@
+"""
+serialize.py - Fast JSON responses for service list endpoints
+
+Rows coming out of crud.py already satisfy ServiceOut (they were validated
+on the way in), so list endpoints encode them straight to bytes instead of
+re-validating every field through pydantic. Routes keep their
+response_model, so the OpenAPI schema is unchanged.
+"""
+
+import json
+from typing import Iterable, List
+
+from fastapi import Response
+
+import schemas
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None  # type: ignore
+
+# Same field order as pydantic's serialization of ServiceOut
+SERVICE_FIELDS = tuple(schemas.ServiceOut.model_fields)
+
+
+def service_dicts(services: Iterable) -> List[dict]:
+    return [{f: getattr(s, f) for f in SERVICE_FIELDS} for s in services]
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(content, response: Response | None = None) -> Response:
+    """Encoded JSON response carrying over headers set on the injected `response`."""
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return Response(content=dumps(content), media_type="application/json", headers=headers)
+
+
+def services_response(services: Iterable, response: Response | None = None) -> Response:
+    """List of ServiceOut as JSON, without per-row validation."""
+    return json_response(service_dicts(services), response)
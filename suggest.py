@@ -0,0 +1,107 @@
+"""
+suggest.py - In-memory prefix index for search-as-you-type suggestions
+
+A compact, array-backed equivalent of a trie: one sorted list of
+(key, service_id, label) tuples where each key is the normalized text of a
+name or location starting at one of its words. A prefix lookup is a binary
+search followed by a short forward scan, so latency depends on the number of
+suggestions returned rather than on the size of the directory.
+"""
+
+import bisect
+from typing import Dict, Iterable, List, Tuple
+
+import memindex
+
+# Words per field that start a suggestion key ("city hospital", "hospital")
+MAX_WORD_STARTS = 8
+# Entries scanned per returned suggestion before giving up on duplicates
+SCAN_FACTOR = 8
+# Removing more services than this at once filters the whole list instead
+BULK_REMOVE_THRESHOLD = 32
+
+
+def _keys(text: str) -> List[str]:
+    words = memindex.normalize(text).split()
+    return [" ".join(words[i:]) for i in range(min(len(words), MAX_WORD_STARTS))]
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._entries: List[Tuple[str, int, str]] = []
+        self._by_id: Dict[int, List[Tuple[str, int, str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_id.clear()
+
+    @staticmethod
+    def _entries_for(service_id: int, fields: Dict[str, str]) -> List[Tuple[str, int, str]]:
+        name = fields.get("name") or ""
+        location = fields.get("location") or ""
+        entries = [(key, service_id, name) for key in _keys(name)]
+        if location:
+            entries += [(key, service_id, f"{name}, {location}") for key in _keys(location)]
+        return entries
+
+    def add(self, service_id: int, fields: Dict[str, str]) -> None:
+        entries = self._entries_for(service_id, fields)
+        for entry in entries:
+            bisect.insort(self._entries, entry)
+        self._by_id[service_id] = entries
+
+    def load(self, items: Iterable[Tuple[int, Dict[str, str]]]) -> None:
+        """Add many services not yet indexed, sorting once instead of inserting key by key."""
+        added: List[Tuple[str, int, str]] = []
+        for service_id, fields in items:
+            entries = self._entries_for(service_id, fields)
+            self._by_id[service_id] = entries
+            added.extend(entries)
+        # Timsort merges the sorted existing run with the new entries in O(n + k log k)
+        self._entries.extend(added)
+        self._entries.sort()
+
+    def remove(self, service_id: int) -> None:
+        for entry in self._by_id.pop(service_id, ()):
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def remove_many(self, service_ids: Iterable[int]) -> None:
+        dropped = {i for i in service_ids if i in self._by_id}
+        if len(dropped) <= BULK_REMOVE_THRESHOLD:
+            for service_id in dropped:
+                self.remove(service_id)
+            return
+        for service_id in dropped:
+            del self._by_id[service_id]
+        self._entries = [entry for entry in self._entries if entry[1] not in dropped]
+
+    def replace(self, other: "PrefixIndex") -> None:
+        """Take over the contents of `other` (a freshly loaded index)."""
+        self._entries, self._by_id = other._entries, other._by_id
+
+    def search(self, prefix: str, limit: int = 10) -> List[Tuple[int, str]]:
+        """Return up to `limit` (service_id, label) pairs whose name or location has a word starting with prefix."""
+        needle = memindex.normalize(prefix)
+        if not needle:
+            return []
+        results: List[Tuple[int, str]] = []
+        seen = set()
+        i = bisect.bisect_left(self._entries, (needle,))
+        end = min(len(self._entries), i + limit * SCAN_FACTOR)
+        while i < end and len(results) < limit:
+            key, service_id, label = self._entries[i]
+            if not key.startswith(needle):
+                break
+            if service_id not in seen:
+                seen.add(service_id)
+                results.append((service_id, label))
+            i += 1
+        return results
+
+
+index = memindex.register(PrefixIndex())
@@ -2,14 +2,19 @@
 Comprehensive test suite for the BMS API
 """
 
+import csv
+import io
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool, StaticPool
 
 from main import app, get_db
 from database import Base
+import crud
 import models
 
 # Test database setup
@@ -265,3 +270,1357 @@ class TestNearby:
         assert r2.status_code == 422
         r3 = client.get("/services/nearby?lat=28.61")  # missing lon
         assert r3.status_code == 422
+
+    def test_nearby_excludes_far_services(self, test_db):
+        """Services outside the radius are pruned and results are sorted by distance"""
+        near = {"name": "Near", "location": "A", "contact": "1", "latitude": 28.62, "longitude": 77.21}
+        mid = {"name": "Mid", "location": "B", "contact": "2", "latitude": 28.70, "longitude": 77.10}
+        far = {"name": "Far", "location": "C", "contact": "3", "latitude": 19.07, "longitude": 72.87}
+        for s in (mid, far, near):
+            assert client.post("/services", json=s).status_code == 201
+
+        data = client.get("/services/nearby?lat=28.61&lon=77.20&radius_km=50").json()
+        assert [d["name"] for d in data] == ["Near", "Mid"]
+
+    def test_nearby_follows_update_and_delete(self, test_db):
+        """The spatial index stays consistent with updates and deletes"""
+        created = client.post("/services", json={"name": "Mobile", "location": "A", "contact": "1", "latitude": 28.61, "longitude": 77.20}).json()
+        url = "/services/nearby?lat=19.07&lon=72.87&radius_km=20"
+        assert client.get(url).json() == []
+
+        client.put(f"/services/{created['id']}", json={"latitude": 19.08, "longitude": 72.88})
+        assert [d["id"] for d in client.get(url).json()] == [created["id"]]
+
+        client.delete(f"/services/{created['id']}")
+        assert client.get(url).json() == []
+
+    def test_nearby_across_antimeridian(self, test_db):
+        """Search boxes crossing longitude 180 still find services on the other side"""
+        client.post("/services", json={"name": "Fiji", "location": "A", "contact": "1", "latitude": -17.0, "longitude": -179.95})
+        data = client.get("/services/nearby?lat=-17.0&lon=179.95&radius_km=30").json()
+        assert [d["name"] for d in data] == ["Fiji"]
+
+class TestNearbyBatch:
+    def test_batch_returns_results_per_query(self, test_db):
+        """Batch nearby search resolves each query independently, nearest first"""
+        services = [
+            {"name": "Delhi A", "location": "A", "contact": "1", "latitude": 28.62, "longitude": 77.21},
+            {"name": "Delhi B", "location": "B", "contact": "2", "latitude": 28.70, "longitude": 77.10},
+            {"name": "Mumbai", "location": "C", "contact": "3", "latitude": 19.07, "longitude": 72.87},
+        ]
+        for s in services:
+            client.post("/services", json=s)
+
+        body = {"queries": [
+            {"lat": 28.61, "lon": 77.20, "radius_km": 50, "limit": 5},
+            {"lat": 19.08, "lon": 72.88, "radius_km": 10},
+            {"lat": 28.61, "lon": 77.20, "radius_km": 50, "limit": 1},
+            {"lat": 0.0, "lon": 0.0, "radius_km": 5},
+        ]}
+        response = client.post("/services/nearby/batch", json=body)
+        assert response.status_code == 200
+        names = [[d["name"] for d in result] for result in response.json()]
+        assert names == [["Delhi A", "Delhi B"], ["Mumbai"], ["Delhi A"], []]
+
+    def test_batch_loads_only_cells_near_each_query(self, test_db):
+        """Distant queries scan their own cells, not the envelope between them or every longitude"""
+        import geoindex
+        for name, lat, lon in [("Amman", 31.95, 35.93), ("Dhaka", 23.81, 90.41), ("Delhi", 28.61, 77.21), ("Fiji", -17.7, 179.9)]:
+            client.post("/services", json={"name": name, "location": "x", "contact": "1", "latitude": lat, "longitude": lon})
+        db = TestingSessionLocal()
+        rows = geoindex.coordinates_near(db, [(31.95, 35.93, 20), (23.81, 90.41, 20), (23.81, 90.41, 5), (-17.7, -179.99, 50)])
+        db.close()
+        assert sorted(lat for _, lat, _ in rows) == [-17.7, 23.81, 31.95]
+        # The second Dhaka query is nested in the first; the Fiji query crosses the antimeridian
+        assert len(geoindex.cell_boxes([(23.81, 90.41, 20), (23.81, 90.41, 5)])) == 1
+        assert len(geoindex.cell_boxes([(-17.7, -179.99, 50)])) == 2
+
+    def test_batch_matches_scalar_haversine(self):
+        """The vectorized kernel agrees with the scalar haversine helper"""
+        import crud
+        import geokernel
+
+        coords = geokernel.CoordinateSet([(1, 28.62, 77.21), (2, 19.07, 72.87), (3, -33.86, 151.21)])
+        hits = geokernel.nearest(coords, [(28.61, 77.20, 20000.0, 3)])[0]
+        assert [sid for sid, _ in hits] == [1, 2, 3]
+        expected = crud.haversine_km(28.61, 77.20, -33.86, 151.21)
+        assert abs(hits[2][1] - expected) < 1e-6
+
+    def test_batch_validation(self, test_db):
+        """Batch requests need at least one valid query"""
+        assert client.post("/services/nearby/batch", json={"queries": []}).status_code == 422
+        bad = {"queries": [{"lat": 91, "lon": 0}]}
+        assert client.post("/services/nearby/batch", json=bad).status_code == 422
+
+class TestSearch:
+    def test_search_prefix_and_ranking(self, test_db):
+        """Full-text search matches word prefixes and ranks name matches first"""
+        client.post("/services", json={"name": "Family Clinic", "location": "Hospital Road", "contact": "555-1000"})
+        client.post("/services", json={"name": "City Hospital", "location": "Main St", "contact": "555-2000"})
+        client.post("/services", json={"name": "Pharmacy", "location": "Main St", "contact": "555-3000"})
+
+        response = client.get("/services/search?q=hosp")
+        assert response.status_code == 200
+        assert [d["name"] for d in response.json()] == ["City Hospital", "Family Clinic"]
+
+        data = client.get("/services/search?q=main%20pharm").json()
+        assert [d["name"] for d in data] == ["Pharmacy"]
+
+        data = client.get("/services/search?q=555-2000").json()
+        assert [d["name"] for d in data] == ["City Hospital"]
+
+    def test_search_index_follows_writes(self, test_db):
+        """The full-text index is kept in sync on update and delete"""
+        sid = client.post("/services", json={"name": "Old Name", "location": "X", "contact": "1"}).json()["id"]
+        client.put(f"/services/{sid}", json={"name": "Renamed Clinic"})
+        assert client.get("/services/search?q=old").json() == []
+        assert [d["id"] for d in client.get("/services/search?q=renamed").json()] == [sid]
+
+        client.delete(f"/services/{sid}")
+        assert client.get("/services/search?q=renamed").json() == []
+
+    def test_search_without_terms_falls_back(self, test_db):
+        """Queries with no word characters use substring matching"""
+        client.post("/services", json={"name": "A+ Clinic", "location": "X", "contact": "1"})
+        assert [d["name"] for d in client.get("/services/search?q=%2B").json()] == ["A+ Clinic"]
+
+    def test_fuzzy_search_tolerates_typos(self, test_db):
+        """Fuzzy mode matches misspelled queries, best match first"""
+        client.post("/services", json={"name": "City Hospital", "location": "Main St", "contact": "555-2000"})
+        client.post("/services", json={"name": "Family Clinic", "location": "Pine St", "contact": "555-1000"})
+
+        assert client.get("/services/search?q=cty%20hospitl").json() == []
+        data = client.get("/services/search?q=cty%20hospitl&fuzzy=true").json()
+        assert [d["name"] for d in data] == ["City Hospital"]
+
+        data = client.get("/services/search?q=famly%20clinik&fuzzy=true").json()
+        assert [d["name"] for d in data] == ["Family Clinic"]
+
+    def test_fuzzy_index_follows_writes(self, test_db):
+        """The trigram index is updated incrementally on create, update and delete"""
+        client.get("/services/search?q=anything&fuzzy=true")  # build the index
+        sid = client.post("/services", json={"name": "Riverside Clinic", "location": "X", "contact": "1"}).json()["id"]
+        assert [d["id"] for d in client.get("/services/search?q=riversde&fuzzy=true").json()] == [sid]
+
+        client.put(f"/services/{sid}", json={"name": "Lakeside Clinic"})
+        assert client.get("/services/search?q=riversde&fuzzy=true").json() == []
+        assert [d["id"] for d in client.get("/services/search?q=lakesde&fuzzy=true").json()] == [sid]
+
+        client.delete(f"/services/{sid}")
+        assert client.get("/services/search?q=lakesde&fuzzy=true").json() == []
+
+class TestSuggest:
+    def test_suggest_matches_word_prefixes(self, test_db):
+        """Suggestions match the start of any word in the name or location"""
+        a = client.post("/services", json={"name": "City Hospital", "location": "Main St", "contact": "1"}).json()["id"]
+        b = client.post("/services", json={"name": "Family Clinic", "location": "Hospital Road", "contact": "2"}).json()["id"]
+
+        response = client.get("/services/suggest?prefix=Hosp")
+        assert response.status_code == 200
+        assert response.json() == [
+            {"id": a, "label": "City Hospital"},
+            {"id": b, "label": "Family Clinic, Hospital Road"},
+        ]
+        assert client.get("/services/suggest?prefix=city%20h").json() == [{"id": a, "label": "City Hospital"}]
+        assert len(client.get("/services/suggest?prefix=hosp&limit=1").json()) == 1
+
+    def test_suggest_follows_writes(self, test_db):
+        """The prefix index reflects creates, updates and deletes"""
+        client.get("/services/suggest?prefix=x")  # build the index
+        sid = client.post("/services", json={"name": "Zaatari Clinic", "location": "Camp", "contact": "1"}).json()["id"]
+        assert [d["id"] for d in client.get("/services/suggest?prefix=zaa").json()] == [sid]
+
+        client.put(f"/services/{sid}", json={"name": "Azraq Clinic"})
+        assert client.get("/services/suggest?prefix=zaa").json() == []
+        client.delete(f"/services/{sid}")
+        assert client.get("/services/suggest?prefix=azr").json() == []
+
+    def test_bulk_load_matches_incremental_adds(self):
+        """load() sorts once but yields the same index as adding services one by one"""
+        from suggest import BULK_REMOVE_THRESHOLD, PrefixIndex
+        items = [(i, {"name": f"Clinic {i % 7} North", "location": f"Camp {i}"}) for i in range(200)]
+        bulk, incremental = PrefixIndex(), PrefixIndex()
+        bulk.load(items)
+        for service_id, fields in items:
+            incremental.add(service_id, fields)
+        assert bulk._entries == incremental._entries
+        bulk.remove_many(range(BULK_REMOVE_THRESHOLD + 1))
+        for service_id in range(BULK_REMOVE_THRESHOLD + 1):
+            incremental.remove(service_id)
+        assert bulk._entries == incremental._entries and len(bulk) == 200 - BULK_REMOVE_THRESHOLD - 1
+
+    def test_rebuild_does_not_block_lookups_and_keeps_concurrent_writes(self, test_db, monkeypatch):
+        """Writes made while a rebuild reads the table are replayed into the swapped-in index"""
+        import threading
+        import memindex
+        import suggest
+        client.get("/services/suggest?prefix=x")  # build the index
+        loading, resume = threading.Event(), threading.Event()
+        original_load = suggest.PrefixIndex.load
+
+        def slow_load(self, items):
+            loading.set()
+            resume.wait(5)
+            original_load(self, items)
+
+        monkeypatch.setattr(suggest.PrefixIndex, "load", slow_load)
+        db = TestingSessionLocal()
+        rebuild = threading.Thread(target=memindex._rebuild, args=(db,))
+        rebuild.start()
+        assert loading.wait(5)
+        # The index lock is free while the rebuild loads
+        sid = client.post("/services", json={"name": "Zaatari Clinic", "location": "Camp", "contact": "1"}).json()["id"]
+        assert [d["id"] for d in client.get("/services/suggest?prefix=zaa").json()] == [sid]
+        resume.set()
+        rebuild.join()
+        db.close()
+        assert [d["id"] for d in client.get("/services/suggest?prefix=zaa").json()] == [sid]
+
+    def test_expired_index_rebuilds_only_after_writes(self, test_db, monkeypatch):
+        """Past MEMINDEX_TTL the index is kept unless the directory version moved"""
+        import memindex
+        client.get("/services/suggest?prefix=x")  # build the index
+        rebuilds = []
+        original = memindex._rebuild
+        monkeypatch.setattr(memindex, "_rebuild", lambda db: (rebuilds.append(1), original(db)))
+        monkeypatch.setattr(memindex, "MEMINDEX_TTL", 0)
+        client.get("/services/suggest?prefix=x")
+        assert rebuilds == []
+        client.post("/services", json={"name": "Zaatari Clinic", "location": "Camp", "contact": "1"})
+        client.get("/services/suggest?prefix=x")
+        assert rebuilds == [1]
+
+class TestCursorPagination:
+    def test_cursor_pages_through_all_services(self, test_db):
+        """Following X-Next-Cursor visits every service exactly once, in id order"""
+        ids = [client.post("/services", json={"name": f"S{i}", "location": "L", "contact": "1"}).json()["id"] for i in range(5)]
+
+        seen, cursor = [], ""
+        while cursor is not None:
+            response = client.get("/services", params={"cursor": cursor, "limit": 2})
+            assert response.status_code == 200
+            seen += [d["id"] for d in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor:
+                assert 'rel="next"' in response.headers["Link"]
+        assert seen == ids
+
+    def test_last_page_has_no_cursor(self, test_db):
+        """An exactly full final page does not advertise another page"""
+        for i in range(2):
+            client.post("/services", json={"name": f"S{i}", "location": "L", "contact": "1"})
+        response = client.get("/services?cursor=&limit=2")
+        assert len(response.json()) == 2
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_invalid_cursor(self, test_db):
+        """Malformed cursors and skip+cursor are rejected"""
+        assert client.get("/services?cursor=not-a-cursor").status_code == 400
+        assert client.get("/services?cursor=&skip=5").status_code == 400
+
+class TestExport:
+    def test_export_ndjson(self, test_db, monkeypatch):
+        """NDJSON export streams every row across several batches"""
+        import main
+        monkeypatch.setattr(main, "EXPORT_BATCH_SIZE", 2)
+        for i in range(5):
+            client.post("/services", json={"name": f"S{i}", "location": "L", "contact": "1", "latitude": 1.5})
+
+        response = client.get("/services/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["name"] for r in rows] == [f"S{i}" for i in range(5)]
+        assert rows[0]["latitude"] == 1.5 and rows[0]["longitude"] is None
+
+    def test_export_csv(self, test_db):
+        """CSV export has a header row followed by one line per service"""
+        client.post("/services", json={"name": "Clinic, North", "location": "L", "contact": "1"})
+        response = client.get("/services/export?format=csv")
+        assert response.status_code == 200
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert rows[0] == ["id", "name", "location", "contact", "latitude", "longitude"]
+        assert rows[1][1] == "Clinic, North"
+        assert client.get("/services/export?format=xml").status_code == 422
+
+class TestBulkImport:
+    def test_bulk_json_reports_row_errors(self, test_db, monkeypatch):
+        """Valid rows are inserted in batches; invalid rows are reported by position"""
+        import main
+        monkeypatch.setattr(main, "BULK_BATCH_SIZE", 2)
+        rows = [
+            {"name": "A", "location": "L", "contact": "1", "latitude": 28.6, "longitude": 77.2},
+            {"name": "", "location": "L", "contact": "1"},
+            {"name": "B", "location": "L", "contact": "2"},
+            {"name": "C", "location": "L", "contact": "3"},
+            "not an object",
+        ]
+        response = client.post("/services/bulk", json=rows)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["created"] == 3 and len(data["ids"]) == 3
+        assert [e["row"] for e in data["errors"]] == [2, 5]
+        assert [s["name"] for s in client.get("/services").json()] == ["A", "B", "C"]
+        # New rows are visible to the spatial and text indexes
+        assert [s["name"] for s in client.get("/services/nearby?lat=28.6&lon=77.2&radius_km=1").json()] == ["A"]
+        assert [s["name"] for s in client.get("/services/search?q=b").json()] == ["B"]
+
+    def test_bulk_ndjson(self, test_db):
+        """NDJSON uploads are parsed line by line"""
+        body = '{"name": "A", "location": "L", "contact": "1"}\n\n{bad json}\n{"name": "B", "location": "L", "contact": "2"}\n'
+        response = client.post("/services/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        data = response.json()
+        assert data["created"] == 2
+        assert [e["row"] for e in data["errors"]] == [2]
+
+    def test_bulk_csv(self, test_db):
+        """CSV uploads use the header row; empty cells are treated as missing"""
+        body = 'name,location,contact,latitude,longitude\r\n"Clinic, North","Line 1\nLine 2",555,,\r\nX,L,1,95,0\r\n'
+        response = client.post("/services/bulk", content=body, headers={"Content-Type": "text/csv"})
+        data = response.json()
+        assert data["created"] == 1
+        assert [e["row"] for e in data["errors"]] == [2]
+        service = client.get(f"/services/{data['ids'][0]}").json()
+        assert service["name"] == "Clinic, North" and service["location"] == "Line 1\nLine 2"
+        assert service["latitude"] is None
+
+    def test_bulk_rejects_bad_bodies(self, test_db):
+        """Unsupported content types and non-array JSON are rejected"""
+        assert client.post("/services/bulk", content="x", headers={"Content-Type": "text/plain"}).status_code == 415
+        assert client.post("/services/bulk", json={"name": "A"}).status_code == 400
+
+    def test_bulk_json_array_is_parsed_across_chunks(self, test_db):
+        """Records, numbers and multi-byte characters split between chunks still parse"""
+        body = json.dumps([
+            {"name": "Clinique Évry", "location": "L", "contact": "1", "latitude": 28.123456},
+            {"name": "", "location": "L", "contact": "1"},
+            {"name": "B", "location": "L", "contact": "2"},
+        ], ensure_ascii=False).encode("utf-8")
+        chunks = [body[i:i + 7] for i in range(0, len(body), 7)]
+        response = client.post("/services/bulk", content=iter(chunks), headers={"Content-Type": "application/json"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["created"] == 2 and [e["row"] for e in data["errors"]] == [2]
+        assert client.get(f"/services/{data['ids'][0]}").json()["latitude"] == 28.123456
+
+    def test_bulk_json_array_truncated_after_rows(self, test_db):
+        """Malformed JSON after valid records is reported on the next row; earlier rows are kept"""
+        body = b'[{"name": "A", "location": "L", "contact": "1"}, {"name": "B", "loc'
+        response = client.post("/services/bulk", content=body, headers={"Content-Type": "application/json"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["created"] == 1 and data["errors"][0]["row"] == 2
+        assert client.post("/services/bulk", content=b"[", headers={"Content-Type": "application/json"}).status_code == 400
+        assert client.post("/services/bulk", content=b"[] x", headers={"Content-Type": "application/json"}).status_code == 400
+        assert client.post("/services/bulk", content=b" [ ] ", headers={"Content-Type": "application/json"}).json()["created"] == 0
+
+class TestBulkUpdateDelete:
+    def _create(self, n):
+        return [client.post("/services", json={"name": f"S{i}", "location": "L", "contact": "1"}).json()["id"] for i in range(n)]
+
+    def test_bulk_update(self, test_db):
+        """Partial updates apply per id and unknown ids are reported"""
+        a, b, c = self._create(3)
+        body = {"items": [
+            {"id": a, "contact": "999"},
+            {"id": b, "contact": "999"},
+            {"id": c, "name": "Renamed", "latitude": 28.6, "longitude": 77.2},
+            {"id": 12345, "name": "Ghost"},
+        ]}
+        response = client.patch("/services/bulk", json=body)
+        assert response.status_code == 200
+        assert response.json() == {"affected": 3, "missing": [12345]}
+
+        services = {s["id"]: s for s in client.get("/services").json()}
+        assert services[a]["contact"] == "999" and services[a]["name"] == "S0"
+        assert services[c]["name"] == "Renamed"
+        assert [s["id"] for s in client.get("/services/nearby?lat=28.6&lon=77.2&radius_km=1").json()] == [c]
+        assert [s["id"] for s in client.get("/services/suggest?prefix=renam").json()] == [c]
+
+    def test_bulk_update_distinct_values(self, test_db):
+        """Items changing the same fields to different values are all applied"""
+        a, b = self._create(2)
+        body = {"items": [{"id": a, "name": "First"}, {"id": b, "name": "Second"}]}
+        assert client.patch("/services/bulk", json=body).json() == {"affected": 2, "missing": []}
+        assert [s["name"] for s in client.get("/services").json()] == ["First", "Second"]
+
+    def test_bulk_delete(self, test_db):
+        """Bulk delete removes existing ids and reports the rest"""
+        a, b, c = self._create(3)
+        response = client.request("DELETE", "/services/bulk", json={"ids": [a, c, 777]})
+        assert response.status_code == 200
+        assert response.json() == {"affected": 2, "missing": [777]}
+        assert [s["id"] for s in client.get("/services").json()] == [b]
+        assert client.request("DELETE", "/services/bulk", json={"ids": []}).status_code == 422
+
+class TestConditionalGet:
+    def test_etag_and_not_modified(self, test_db):
+        """Read endpoints carry an ETag and answer a matching If-None-Match with 304"""
+        sid = client.post("/services", json={"name": "A", "location": "L", "contact": "1"}).json()["id"]
+        for url in ["/services", f"/services/{sid}", "/services/nearby?lat=0&lon=0", "/facilities?lat=0&lon=0"]:
+            first = client.get(url)
+            assert first.status_code == 200
+            etag = first.headers["ETag"]
+            assert "max-age" in first.headers["Cache-Control"]
+
+            second = client.get(url, headers={"If-None-Match": etag})
+            assert second.status_code == 304
+            assert second.content == b""
+            assert second.headers["ETag"] == etag
+
+    def test_etag_changes_on_write(self, test_db):
+        """Any write bumps the directory version and invalidates earlier ETags"""
+        client.post("/services", json={"name": "A", "location": "L", "contact": "1"})
+        etag = client.get("/services").headers["ETag"]
+        client.post("/services", json={"name": "B", "location": "L", "contact": "2"})
+
+        response = client.get("/services", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        assert response.headers["ETag"] != etag
+
+    def test_etag_differs_per_query(self, test_db):
+        """Different queries on the same version get different ETags"""
+        client.post("/services", json={"name": "A", "location": "L", "contact": "1"})
+        assert client.get("/services?limit=1").headers["ETag"] != client.get("/services?limit=2").headers["ETag"]
+
+    def test_not_modified_polls_skip_the_database(self, test_db, monkeypatch):
+        """Conditional GETs a few seconds apart are answered without running SQL"""
+        import types
+        from sqlalchemy import event
+        import database
+        import dirversion
+        now = [1000.0]
+        monkeypatch.setattr(dirversion, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+        client.post("/services", json={"name": "A", "location": "L", "contact": "1"})
+        etag = client.get("/services").headers["ETag"]
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        for eng in (engine, database.engine):
+            event.listen(eng, "before_cursor_execute", record)
+        try:
+            for _ in range(3):
+                now[0] += 5
+                assert client.get("/services", headers={"If-None-Match": etag}).status_code == 304
+        finally:
+            for eng in (engine, database.engine):
+                event.remove(eng, "before_cursor_execute", record)
+        assert statements == []
+
+class TestFastSerialization:
+    def test_list_body_matches_response_model(self, test_db):
+        """The fast path emits the same JSON as ServiceOut validation would"""
+        import schemas
+        client.post("/services", json={"name": "Clínica", "location": "L", "contact": "1", "latitude": 28.6139, "longitude": 77.209})
+        response = client.get("/services")
+        expected = [schemas.ServiceOut(**response.json()[0]).model_dump()]
+        assert response.json() == expected
+        assert list(response.json()[0]) == list(schemas.ServiceOut.model_fields)
+
+    def test_large_responses_are_gzipped(self, test_db):
+        """Large list responses are compressed when the client accepts gzip"""
+        for i in range(40):
+            client.post("/services", json={"name": f"Clinic {i}", "location": "Some long street name", "contact": "555"})
+        response = client.get("/services", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert len(response.json()) == 40
+        # The compressed representation carries a weak ETag that still revalidates
+        etag = response.headers["ETag"]
+        assert etag.startswith("W/")
+        assert client.get("/services", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+
+        plain = client.get("/services", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in plain.headers
+        small = client.get("/services?limit=1", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in small.headers
+
+    def test_not_modified_repeats_the_compressed_validator(self, test_db):
+        """A 304 carries the same weak ETag as the compressed 200 it revalidates"""
+        for i in range(40):
+            client.post("/services", json={"name": f"Clinic {i}", "location": "Some long street name", "contact": "555"})
+        etag = client.get("/services", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+        revalidated = client.get("/services", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["ETag"] == etag
+        strong = client.get("/services", headers={"Accept-Encoding": "identity"}).headers["ETag"]
+        assert etag == f"W/{strong}"
+        assert client.get("/services", headers={"Accept-Encoding": "identity", "If-None-Match": strong}).headers["ETag"] == strong
+
+    def test_accepted_encodings(self):
+        """Accept-Encoding parsing honours q=0"""
+        from compression import accepted_encodings
+        assert accepted_encodings("gzip;q=0, br") == {"br"}
+        assert accepted_encodings("GZIP, deflate;q=0.5") == {"gzip", "deflate"}
+
+class TestAsyncDatabase:
+    @pytest.fixture
+    def async_db(self, test_db):
+        """Serve requests through an aiosqlite AsyncSession on the test database"""
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from database import async_url
+
+        # No pooling: each request runs on the TestClient's own event loop
+        async_engine = create_async_engine(async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+        AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+        async def override_get_async_db():
+            async with AsyncTestingSessionLocal() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_async_db
+        yield
+        app.dependency_overrides[get_db] = override_get_db
+
+    def test_async_url(self):
+        """Sync URLs map to their async drivers"""
+        from database import async_url
+        assert async_url("sqlite:///./services.db") == "sqlite+aiosqlite:///./services.db"
+        assert async_url("postgresql+psycopg2://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+        with pytest.raises(ValueError):
+            async_url("mysql://u:p@h/db")
+
+    def test_crud_through_async_session(self, async_db):
+        """Create, read, update, list, nearby, export and delete work on an AsyncSession"""
+        created = client.post("/services", json={"name": "Async Clinic", "location": "Delhi", "contact": "1", "latitude": 28.6139, "longitude": 77.209})
+        assert created.status_code == 201
+        service_id = created.json()["id"]
+        assert client.get(f"/services/{service_id}").json()["name"] == "Async Clinic"
+        assert client.put(f"/services/{service_id}", json={"name": "Async Hospital"}).json()["name"] == "Async Hospital"
+        assert [s["id"] for s in client.get("/services").json()] == [service_id]
+        assert [s["id"] for s in client.get("/services/nearby?lat=28.61&lon=77.2&radius_km=5").json()] == [service_id]
+        assert json.loads(client.get("/services/export").text)["name"] == "Async Hospital"
+        assert client.delete(f"/services/{service_id}").status_code == 204
+        assert client.get(f"/services/{service_id}").status_code == 404
+
+class TestDatabaseTuning:
+    def test_sqlite_pragmas_applied_per_connection(self, tmp_path):
+        """SQLite engines get WAL, synchronous=NORMAL, a larger cache and mmap on every connection"""
+        from sqlalchemy import text
+        from database import make_engine, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE
+
+        tuned = make_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+        with tuned.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar().lower() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA cache_size")).scalar() == -SQLITE_CACHE_SIZE_KB
+            assert conn.execute(text("PRAGMA mmap_size")).scalar() == SQLITE_MMAP_SIZE
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+        tuned.dispose()
+
+    def test_reads_use_replica_writes_use_primary(self, test_db, tmp_path, monkeypatch):
+        """With a replica configured, GET endpoints read from it while writes hit the primary"""
+        import main
+        from database import make_engine
+
+        replica_engine = make_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        Base.metadata.create_all(bind=replica_engine)
+        ReplicaSession = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+        with ReplicaSession() as db:
+            db.add(models.Service(name="Replica Clinic", location="L", contact="1"))
+            db.commit()
+        monkeypatch.setattr(main, "ReplicaSessionLocal", ReplicaSession)
+
+        created = client.post("/services", json={"name": "Primary Clinic", "location": "L", "contact": "1"})
+        assert created.status_code == 201
+        assert [s["name"] for s in client.get("/services").json()] == ["Replica Clinic"]
+        with TestingSessionLocal() as db:
+            assert [s.name for s in db.query(models.Service).all()] == ["Primary Clinic"]
+        replica_engine.dispose()
+
+class TestMigrations:
+    def test_upgrade_legacy_database(self, tmp_path):
+        """A pre-migration database gets geo columns, indexes, the spatial grid and FTS, once"""
+        from sqlalchemy import inspect, text
+        import migrations
+        from database import make_engine
+
+        legacy = make_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        with legacy.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE services (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, location VARCHAR NOT NULL, contact VARCHAR NOT NULL)")
+            conn.exec_driver_sql("INSERT INTO services (name, location, contact) VALUES ('Old Clinic', 'Old Road', '1')")
+        assert not migrations.is_up_to_date(legacy)
+
+        applied = migrations.upgrade(legacy)
+        assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+        assert migrations.is_up_to_date(legacy)
+        assert migrations.upgrade(legacy) == []
+
+        inspector = inspect(legacy)
+        assert {"latitude", "longitude"} <= {c["name"] for c in inspector.get_columns("services")}
+        assert {"ix_services_lat_lon", "ix_services_name"} <= {i["name"] for i in inspector.get_indexes("services")}
+        with legacy.connect() as conn:
+            assert migrations.current_version(conn) == migrations.latest_version()
+            matched = conn.execute(text("SELECT rowid FROM services_fts WHERE services_fts MATCH 'clinic'")).fetchall()
+            assert len(matched) == 1
+            plan = conn.execute(text("EXPLAIN QUERY PLAN SELECT id FROM services WHERE latitude BETWEEN 1 AND 2 AND longitude BETWEEN 1 AND 2")).fetchall()
+            assert "ix_services_lat_lon" in " ".join(str(row) for row in plan)
+        legacy.dispose()
+
+class TestStartup:
+    def test_import_does_not_load_provider_sdks(self):
+        """Importing the app leaves AI SDKs (and httpx) to be loaded on first use"""
+        import subprocess
+        import sys
+        from bench_startup import LAZY_MODULES
+
+        code = f"import sys, main; print([m for m in {LAZY_MODULES!r} if m in sys.modules])"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert out.strip().splitlines()[-1] == "[]"
+
+    def test_seed_fills_only_an_empty_directory(self, test_db):
+        """Seeding is explicit and idempotent"""
+        with TestingSessionLocal() as db:
+            assert crud.seed_example_services(db) == len(crud.EXAMPLE_SERVICES)
+            assert crud.seed_example_services(db) == 0
+        assert len(client.get("/services").json()) == len(crud.EXAMPLE_SERVICES)
+        assert len(client.get("/services/nearby?lat=28.6139&lon=77.209&radius_km=1").json()) == 1
+
+class TestAIClientPool:
+    @pytest.fixture
+    def openrouter(self, monkeypatch):
+        import ai
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        ai.shutdown_ai_clients()
+        yield ai
+        ai.shutdown_ai_clients()
+
+    def test_client_is_shared_across_threads(self, openrouter):
+        """One lazily built client per provider, even under concurrent first use"""
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(8) as pool:
+            clients = list(pool.map(lambda _: openrouter.get_ai_client("openrouter"), range(32)))
+        assert all(c is clients[0] for c in clients)
+
+    def test_requests_reuse_pooled_http_client(self, openrouter):
+        """Calls go through the provider's persistent HTTP client; shutdown closes it"""
+        import httpx
+        seen = []
+
+        def handler(request):
+            seen.append(request.headers["Authorization"])
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+        client = openrouter.get_ai_client("openrouter")
+        client.http = httpx.Client(transport=httpx.MockTransport(handler))
+        assert client.chat([{"role": "user", "content": "hi"}]) == "ok"
+        assert openrouter.get_ai_client("openrouter").chat([{"role": "user", "content": "hi"}]) == "ok"
+        assert seen == ["Bearer test-key", "Bearer test-key"]
+
+        openrouter.shutdown_ai_clients()
+        assert client.http.is_closed
+        assert openrouter.get_ai_client("openrouter") is not client
+
+class TestAITriageCache:
+    @pytest.fixture
+    def model_calls(self, monkeypatch):
+        """Stub the model call and count invocations"""
+        import ai
+        calls = []
+
+        def fake_call_model(messages):
+            calls.append(messages)
+            return "Rest and drink fluids."
+
+        monkeypatch.setattr(ai, "call_model", fake_call_model)
+        ai.triage_cache.clear()
+        yield calls
+        ai.triage_cache.clear()
+
+    def test_equivalent_requests_hit_cache(self, model_calls):
+        """Requests differing only in case, whitespace and condition order share one model call"""
+        first = client.post("/ai/triage-advice", json={"symptom": "Fever and cough", "age": 30, "language": "English", "chronic_conditions": ["asthma", "diabetes"]})
+        second = client.post("/ai/triage-advice", json={"symptom": "  fever   AND cough ", "age": 30, "language": "english", "chronic_conditions": ["Diabetes", "asthma"]})
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        assert len(model_calls) == 1
+
+        stats = {c["name"]: c for c in client.get("/ai/metrics").json()["caches"]}["ai_triage"]
+        assert stats["hits"] >= 1 and stats["misses"] >= 1
+
+        client.post("/ai/triage-advice", json={"symptom": "Fever and cough", "age": 31, "language": "English"})
+        assert len(model_calls) == 2
+
+    def test_failures_are_not_cached(self, model_calls, monkeypatch):
+        """Fallback text from a failed call is returned but not cached"""
+        import ai
+
+        def failing_call_model(messages):
+            model_calls.append(messages)
+            raise RuntimeError("provider down")
+
+        monkeypatch.setattr(ai, "call_model", failing_call_model)
+        for _ in range(2):
+            assert "try again later" in client.post("/ai/triage-advice", json={"symptom": "headache", "language": "English"}).json()["advice"]
+        assert len(model_calls) == 2
+
+    def test_ttl_lru_and_persistence(self, tmp_path):
+        """Entries expire, the least recently used is evicted, and a file-backed cache survives restarts"""
+        from cache import TTLCache
+        lru = TTLCache("test_lru", ttl=60, max_entries=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        assert lru.get("b") is None and lru.get("a") == 1 and lru.evictions == 1
+
+        expired = TTLCache("test_ttl", ttl=-1, max_entries=10)
+        expired.set("a", 1)
+        assert expired.get("a") is None
+
+        path = str(tmp_path / "cache.db")
+        TTLCache("test_disk", ttl=60, max_entries=10, path=path).set("k", {"advice": "x"})
+        restarted = TTLCache("test_disk", ttl=60, max_entries=10, path=path)
+        assert restarted.get("k") == {"advice": "x"}
+        assert restarted.stats()["disk_hits"] == 1
+        restarted.close()
+
+class TestTranslationCache:
+    @pytest.fixture
+    def gemini(self, monkeypatch, tmp_path):
+        """A fake Gemini SDK recording prompts, with a fresh file-backed translation cache"""
+        import types
+        import ai
+        from cache import TTLCache
+        prompts = []
+
+        class FakeModel:
+            def __init__(self, name, system_instruction=None):
+                pass
+
+            def generate_content(self, prompt, request_options=None):
+                prompts.append(prompt)
+                text = prompt.rsplit("\n\n", 1)[-1]
+                return types.SimpleNamespace(text="Arabic" if prompt.startswith("Detect") else f"[ar] {text}")
+
+        monkeypatch.setattr(ai, "_genai", lambda: types.SimpleNamespace(GenerativeModel=FakeModel))
+        monkeypatch.setattr(ai, "translation_cache", TTLCache("test_translation", 60, 100, str(tmp_path / "ai_cache.db")))
+        ai.shutdown_ai_clients()
+        yield prompts
+        ai.translation_cache.close()
+        ai.shutdown_ai_clients()
+
+    def test_translate_endpoint_is_memoized(self, gemini):
+        """Repeated /translate calls reach the model once"""
+        for _ in range(3):
+            response = client.post("/translate", params={"text": "Drink water", "target_language": "Arabic"})
+            assert response.status_code == 200
+            assert "[ar] Drink water" in response.text
+        assert len(gemini) == 1
+
+    def test_disclaimer_translated_once(self, gemini, monkeypatch):
+        """The safety disclaimer is translated once, not on every triage request"""
+        import ai
+        monkeypatch.setattr(ai, "call_model", lambda messages: "Rest.")
+        ai.triage_cache.clear()
+        for symptom in ("حمى", "سعال شديد", "صداع في الرأس"):
+            advice = client.post("/ai/triage-advice", json={"symptom": symptom}).json()["advice"]
+            assert advice.endswith("[ar] " + ai.SAFETY_DISCLAIMER.strip())
+        disclaimer_prompts = [p for p in gemini if p.endswith(ai.SAFETY_DISCLAIMER.strip())]
+        assert len(disclaimer_prompts) == 1
+        ai.triage_cache.clear()
+
+    def test_detection_is_memoized(self, gemini):
+        """Detecting the same ambiguous text twice makes one model call"""
+        import ai
+        assert ai.detect_language("fever 39") == ai.detect_language("fever 39") == "Arabic"
+        assert len(gemini) == 1
+
+class TestLocalLanguageDetection:
+    @pytest.mark.parametrize("text,expected", [
+        ("أعاني من حمى وسعال منذ ثلاثة أيام", "Arabic"),
+        ("من سه روز است که تب و سرفه دارم", "Persian"),
+        ("مجھے تین دن سے بخار اور کھانسی ہے", "Urdu"),
+        ("زه درې ورځې تبه او ټوخی لرم", "Pashto"),
+        ("У мене три дні температура і кашель", "Ukrainian"),
+        ("I have had a fever and a cough for three days", "English"),
+        ("J'ai de la fièvre et je tousse depuis trois jours", "French"),
+        ("Waxaan qabaa qandho iyo qufac saddex maalmood", "Somali"),
+        ("मुझे तीन दिन से बुखार है", "Hindi"),
+        ("Имам температура и кашаљ већ три дана", "Serbian"),
+        ("Менің үш күннен бері қызуым бар", "Kazakh"),
+        ("Ќе одам на лекар утре", "Macedonian"),
+        ("У меня высокая температура и кашель", "Russian"),
+        ("У мяне высокая тэмпература і кашаль", "Belarusian"),
+    ])
+    def test_detects_common_languages(self, text, expected):
+        """Script ranges and stopword profiles identify the languages we serve"""
+        import language
+        detected, confidence = language.detect(text)
+        assert detected == expected
+        assert confidence >= 0.6
+
+    def test_confident_detection_skips_remote(self, monkeypatch):
+        """Confident local results never reach the remote model; ambiguous text does"""
+        import ai
+        remote = []
+        monkeypatch.setattr(ai, "_genai", lambda: remote.append(1))
+        assert ai.detect_language("أعاني من حمى") == "Arabic"
+        assert remote == []
+        assert ai.detect_language("ok") is None
+        assert remote == [1]
+
+    def test_ambiguous_text_has_low_confidence(self):
+        """Numbers, single unknown words and empty text are not guessed confidently"""
+        import language
+        for text in ("", "12345", "fever", "ok"):
+            assert language.detect(text)[1] < 0.6
+
+    def test_shared_script_without_markers_is_not_confident(self):
+        """Text in a shared script with no distinguishing letters is left to the remote model"""
+        import language
+        # Bulgarian, Arabic-script text without Arabic-only letters, Nepali
+        for text in ("Имам температура и кашлица от три дни", "ممنون", "मलाई ज्वरो आएको छ"):
+            assert language.detect(text)[1] < 0.6
+
+    def test_belarusian_without_u_short_is_not_ukrainian(self):
+        """і is shared by Belarusian and Ukrainian, so on its own it is not confident evidence"""
+        import language
+        detected, confidence = language.detect("У мяне баліць галава")
+        assert detected != "Ukrainian" and confidence < 0.6
+
+class TestAIStreaming:
+    @staticmethod
+    def events(response):
+        parsed = []
+        for block in response.text.strip().split("\n\n"):
+            event, data = block.split("\n", 1)
+            parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return parsed
+
+    def test_chat_stream_forwards_tokens_then_disclaimer(self, monkeypatch):
+        """Tokens arrive as separate events and the disclaimer is the final event"""
+        import ai
+        monkeypatch.setattr(ai, "stream_model", lambda messages: iter(["Drink ", "water."]))
+        response = client.post("/ai/chat/stream", json={"history": [{"role": "user", "content": "hi"}]})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert self.events(response) == [
+            ("token", {"text": "Drink "}),
+            ("token", {"text": "water."}),
+            ("disclaimer", {"text": ai.SAFETY_DISCLAIMER}),
+        ]
+
+    def test_triage_stream_reports_errors(self, monkeypatch):
+        """A provider failure becomes an error event, still followed by the disclaimer"""
+        import ai
+
+        def failing(messages):
+            yield "Partial"
+            raise RuntimeError("provider down")
+
+        monkeypatch.setattr(ai, "stream_model", failing)
+        events = self.events(client.post("/ai/triage-advice/stream", json={"symptom": "headache", "language": "English"}))
+        assert [e for e, _ in events] == ["token", "error", "disclaimer"]
+
+    def test_openrouter_stream_parses_sse(self, monkeypatch):
+        """OpenRouter chunks are parsed from its OpenAI-compatible SSE stream"""
+        import httpx
+        import ai
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        ai.shutdown_ai_clients()
+        body = (
+            'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+            'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n'
+            ': keep-alive\n\n'
+            'data: {"choices": [{"delta": {"content": "lo"}}]}\n\n'
+            'data: [DONE]\n\n'
+        )
+        client_ = ai.get_ai_client("openrouter")
+        client_.http = httpx.Client(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+        ))
+        assert list(client_.chat_stream([{"role": "user", "content": "hi"}])) == ["Hel", "lo"]
+        ai.shutdown_ai_clients()
+
+class TestTriagePipeline:
+    @pytest.fixture(autouse=True)
+    def fresh_caches(self):
+        import ai
+        ai.triage_cache.clear()
+        yield
+        ai.triage_cache.clear()
+
+    def test_single_call_answers_in_user_language(self, monkeypatch):
+        """One structured call yields the localized advice and disclaimer, with no translation calls"""
+        import ai
+        calls = []
+
+        def fake_call_model(messages):
+            calls.append(messages)
+            return '```json\n{"language": "Arabic", "severity": "SELF-CARE", "advice": "اشرب الماء", "disclaimer": "هذا ليس تشخيصا"}\n```'
+
+        translations = []
+        monkeypatch.setattr(ai, "call_model", fake_call_model)
+        monkeypatch.setattr(ai, "translate_text", lambda *a, **kw: translations.append(a) or a[0])
+        monkeypatch.setattr(ai, "_genai", lambda: pytest.fail("unexpected remote detection"))
+        advice = client.post("/ai/triage-advice", json={"symptom": "أعاني من صداع"}).json()["advice"]
+        assert advice == "اشرب الماء\n\nهذا ليس تشخيصا"
+        assert len(calls) == 1
+        assert "Arabic" in calls[0][-1]["content"]
+        assert translations == []
+
+    def test_missing_disclaimer_is_translated_as_fallback(self, monkeypatch):
+        """Only a structured reply without the disclaimer costs a translation call"""
+        import ai
+        translations = []
+
+        def translate(text, target, budget=None):
+            translations.append(target)
+            return f"<{target}> {text}"
+
+        monkeypatch.setattr(ai, "call_model", lambda messages: '{"language": "Arabic", "advice": "اشرب الماء"}')
+        monkeypatch.setattr(ai, "translate_text", translate)
+        advice = client.post("/ai/triage-advice", json={"symptom": "أعاني من صداع"}).json()["advice"]
+        assert advice == "اشرب الماء\n\n<Arabic> " + ai.SAFETY_DISCLAIMER.strip()
+        assert translations == ["Arabic"]
+
+    def test_unstructured_reply_is_used_verbatim(self, monkeypatch):
+        """A plain-text reply still counts as the answer"""
+        import ai
+        monkeypatch.setattr(ai, "call_model", lambda messages: "Rest and drink fluids.")
+        advice = client.post("/ai/triage-advice", json={"symptom": "I have a headache", "language": "English"}).json()["advice"]
+        assert advice == "Rest and drink fluids." + ai.SAFETY_DISCLAIMER
+
+    def test_classic_mode_runs_independent_calls_concurrently(self, monkeypatch):
+        """Remote detection and symptom translation overlap instead of running back to back"""
+        import threading
+        import ai
+        import triage_pipeline
+        both_started = threading.Barrier(2, timeout=5)
+
+        def detect(text):
+            both_started.wait()
+            return "Somali"
+
+        def translate(text, target, budget=None):
+            if target == "English" and text == "xyz":
+                both_started.wait()
+            return f"<{target}> {text}"
+
+        monkeypatch.setattr(triage_pipeline, "AI_TRIAGE_PIPELINE", "classic")
+        monkeypatch.setattr(ai, "detect_language", detect)
+        monkeypatch.setattr(ai, "translate_text", translate)
+        monkeypatch.setattr(ai, "call_model", lambda messages: "advice")
+        advice = client.post("/ai/triage-advice", json={"symptom": "xyz"}).json()["advice"]
+        assert advice == "<Somali> advice\n\n<Somali> " + ai.SAFETY_DISCLAIMER.strip()
+
+class TestAICallLimits:
+    def test_identical_inflight_prompts_share_one_upstream_call(self, monkeypatch):
+        """Concurrent identical prompts are coalesced into one provider request"""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import httpx
+        import ai
+        upstream = []
+
+        def handler(request):
+            upstream.append(request)
+            time.sleep(0.2)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "shared"}}]})
+
+        monkeypatch.setenv("AI_PROVIDER", "openrouter")
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        ai.shutdown_ai_clients()
+        ai.get_ai_client().http = httpx.Client(transport=httpx.MockTransport(handler))
+        messages = [{"role": "user", "content": "same question"}]
+        with ThreadPoolExecutor(5) as pool:
+            replies = list(pool.map(lambda _: ai.call_model(messages), range(5)))
+        ai.shutdown_ai_clients()
+        assert replies == ["shared"] * 5
+        assert len(upstream) == 1
+        assert client.get("/ai/metrics").json()["singleflight"]["coalesced"] >= 1
+
+    def test_limiter_queues_then_times_out(self):
+        """Callers beyond the limit wait in the queue and fail after the timeout"""
+        import threading
+        from ai_limits import AIQueueTimeout, ConcurrencyLimiter
+        limiter = ConcurrencyLimiter("stub", limit=1, timeout=0.05)
+        holding, release = threading.Event(), threading.Event()
+
+        def hold():
+            with limiter.slot():
+                holding.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        holding.wait(5)
+        with pytest.raises(AIQueueTimeout):
+            with limiter.slot():
+                pass
+        release.set()
+        holder.join()
+        with limiter.slot():
+            pass
+        stats = limiter.stats()
+        assert stats["timeouts"] == 1 and stats["max_queue_depth"] >= 1
+        assert stats["completed"] == 2 and stats["in_flight"] == 0
+
+class TestAIRouter:
+    @staticmethod
+    def stub(latency, fail=False, calls=None):
+        import time
+
+        def call(messages):
+            if calls is not None:
+                calls.append(messages)
+            time.sleep(latency)
+            if fail:
+                raise RuntimeError("stub failure")
+            return f"answer after {latency}"
+        return call
+
+    def test_routes_to_fastest_provider(self):
+        """After measuring both, calls go to the provider with the lower median latency"""
+        from ai_router import Router
+        slow_calls, fast_calls = [], []
+        router = Router({"slow": self.stub(0.05, calls=slow_calls), "fast": self.stub(0.001, calls=fast_calls)})
+        router._attempt("slow", "warmup")
+        router._attempt("fast", "warmup")
+        for _ in range(5):
+            router.call("q")
+        assert router.ranked() == ["fast", "slow"]
+        assert len(fast_calls) == 6 and len(slow_calls) == 1
+
+    def test_fails_over_and_marks_unhealthy(self, monkeypatch):
+        """A failing provider is skipped within the call and demoted once its error rate is high"""
+        import ai_router
+        monkeypatch.setattr(ai_router, "AI_ROUTER_MIN_SAMPLES", 3)
+        router = ai_router.Router({"broken": self.stub(0, fail=True), "backup": self.stub(0)})
+        assert router.call("q") == "answer after 0"
+        assert router.ranked() == ["backup", "broken"]
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                router._attempt("broken", "q")
+        stats = {s["provider"]: s for s in router.route_stats()}
+        assert stats["broken"]["error_rate"] == 1.0 and not stats["broken"]["healthy"]
+
+        all_broken = ai_router.Router({"a": self.stub(0, fail=True), "b": self.stub(0, fail=True)})
+        with pytest.raises(RuntimeError):
+            all_broken.call("q")
+
+    def test_hedged_request_beats_slow_leader(self, monkeypatch):
+        """With hedging, a stalled leader is raced by the runner-up after the hedge delay"""
+        import time
+        import ai_router
+        monkeypatch.setattr(ai_router, "AI_HEDGE_DEFAULT_DELAY_MS", 50)
+        router = ai_router.Router({"stalled": self.stub(1.0), "quick": self.stub(0.01)}, hedge=True)
+        started = time.monotonic()
+        assert router.call("q") == "answer after 0.01"
+        assert time.monotonic() - started < 0.5
+        assert router.hedges == 1 and router.hedge_wins == 1
+        router.close()
+
+    def test_router_reuses_existing_clients(self, monkeypatch):
+        """Building the router keeps clients (and their HTTP pools) that already exist"""
+        import ai
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(ai, "AI_PROVIDERS", ["openrouter", "gemini"])
+        ai.shutdown_ai_clients()
+        existing = ai.get_ai_client("openrouter")
+        built = []
+        monkeypatch.setattr(ai, "AIClient", lambda provider: built.append(provider) or pytest.fail("unexpected client"))
+        ai._clients["gemini"] = existing
+        assert ai.get_router() is not None
+        assert built == [] and ai.get_ai_client("openrouter") is existing
+        ai._clients.pop("gemini")
+        ai.shutdown_ai_clients()
+
+    def test_single_usable_provider_skips_router(self, monkeypatch):
+        """Unconfigured providers are left out; with one left, calls bypass the router"""
+        import ai
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+        monkeypatch.delenv("gemini_API_KEY", raising=False)
+        monkeypatch.setattr(ai, "AI_PROVIDERS", ["openrouter", "gemini"])
+        ai.shutdown_ai_clients()
+        assert ai.get_router() is None
+        ai.shutdown_ai_clients()
+
+class TestResilience:
+    def test_breaker_opens_then_probes_once(self, monkeypatch):
+        """Consecutive failures open the breaker; after the reset timeout one trial call decides"""
+        import resilience
+        now = [0.0]
+        monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+        breaker = resilience.CircuitBreaker("stub", failure_threshold=2, reset_timeout=30)
+
+        def fail():
+            raise RuntimeError("down")
+
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                breaker.call(fail)
+        assert breaker.state == resilience.OPEN
+        with pytest.raises(resilience.CircuitOpenError):
+            breaker.call(lambda: "never called")
+
+        now[0] = 31.0
+        assert breaker.state == resilience.HALF_OPEN
+        breaker.allow()
+        with pytest.raises(resilience.CircuitOpenError):
+            breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == resilience.OPEN
+
+        now[0] = 62.0
+        assert breaker.call(lambda: "ok") == "ok"
+        assert breaker.state == resilience.CLOSED
+        assert breaker.stats()["rejected"] == 2
+
+    def test_deadline_shares_and_reaches_worker_threads(self):
+        """Stages get a share of the time left; submit() carries the deadline into the pool"""
+        from concurrent.futures import ThreadPoolExecutor
+        import resilience
+        assert resilience.stage_timeout() is None
+        with resilience.deadline(10):
+            with resilience.share(0.25):
+                assert 2 < resilience.stage_timeout() <= 2.5
+            assert resilience.stage_timeout() > 9
+            with ThreadPoolExecutor(1) as pool:
+                assert pool.submit(resilience.remaining).result() is None
+                assert resilience.submit(pool, resilience.remaining).result() > 9
+        with resilience.deadline(0):
+            with pytest.raises(resilience.DeadlineExceeded):
+                resilience.stage_timeout()
+
+    def test_queue_wait_is_cut_short_by_deadline(self):
+        """A full provider queue fails with DeadlineExceeded once the request budget is spent"""
+        import threading
+        import time
+        import resilience
+        from ai_limits import ConcurrencyLimiter
+        limiter = ConcurrencyLimiter("stub", limit=1, timeout=5)
+        holding, release = threading.Event(), threading.Event()
+
+        def hold():
+            with limiter.slot():
+                holding.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        holding.wait(5)
+        started = time.monotonic()
+        with pytest.raises(resilience.DeadlineExceeded):
+            with resilience.deadline(0.05):
+                with limiter.slot():
+                    pass
+        assert time.monotonic() - started < 1
+        release.set()
+        holder.join()
+
+    @staticmethod
+    def timing_out_client():
+        """A provider client that waits out the timeout it is given, then fails like an SDK would"""
+        import time
+        import types
+
+        def chat(messages, timeout=None):
+            time.sleep(timeout if timeout is not None else 1)
+            raise TimeoutError("read timed out")
+        return types.SimpleNamespace(provider="stub", model="stub-model", chat=chat)
+
+    def test_triage_advice_falls_back_to_rules_when_deadline_passes(self, monkeypatch):
+        """A provider timing out at the deadline yields the rule-based result, uncached"""
+        import ai
+        import resilience
+        monkeypatch.setattr(resilience, "AI_REQUEST_DEADLINE", 0.1)
+        monkeypatch.setattr(ai, "build_ai_client", self.timing_out_client)
+        monkeypatch.setitem(resilience._breakers, "stub", resilience.CircuitBreaker("stub"))
+        ai.triage_cache.clear()
+        body = client.post("/ai/triage-advice", json={"symptom": "I have a fever", "language": "English"}).json()
+        assert body["advice"].startswith("URGENT: Seek medical attention within 24 hours.")
+        assert body["advice"].endswith(ai.SAFETY_DISCLAIMER.strip())
+        assert body["confidence"] == 0.5
+        assert ai.triage_cache.stats()["size"] == 0
+
+    def test_provider_errors_before_the_deadline_are_not_converted(self, monkeypatch):
+        """Only errors raised after the deadline become DeadlineExceeded"""
+        import ai
+        import resilience
+        monkeypatch.setattr(ai, "build_ai_client", self.timing_out_client)
+        monkeypatch.setitem(resilience._breakers, "stub", resilience.CircuitBreaker("stub"))
+        with resilience.deadline(0.05):
+            with pytest.raises(resilience.DeadlineExceeded):
+                ai.call_model([{"role": "user", "content": "hi"}])
+        with resilience.deadline(10):
+            with pytest.raises(TimeoutError):
+                ai._guarded("stub", lambda timeout: (_ for _ in ()).throw(TimeoutError("early")))
+
+    def test_responses_fallback_gets_only_the_time_left(self):
+        """After a slow Chat Completions failure the Responses API call is bounded by the remaining timeout"""
+        import time
+        import types
+        import ai
+        timeouts = []
+
+        def failing_create(**kwargs):
+            time.sleep(0.05)
+            raise RuntimeError("chat completions unavailable")
+
+        def responses_create(**kwargs):
+            return types.SimpleNamespace(output=[types.SimpleNamespace(type="output_text", text="fallback")])
+
+        def with_options(timeout, max_retries):
+            timeouts.append(timeout)
+            return sdk
+
+        sdk = types.SimpleNamespace(
+            chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=failing_create)),
+            responses=types.SimpleNamespace(create=responses_create),
+            with_options=with_options,
+        )
+        client_ = ai.AIClient.__new__(ai.AIClient)
+        client_.provider, client_.model, client_.client = "openai", "gpt-test", sdk
+        assert client_.chat([{"role": "user", "content": "hi"}], timeout=0.2) == "fallback"
+        assert timeouts[0] == 0.2 and timeouts[1] <= 0.15
+        with pytest.raises(RuntimeError):
+            client_.chat([{"role": "user", "content": "hi"}], timeout=0.01)
+
+    def test_chat_and_translate_are_bounded_by_the_deadline(self, monkeypatch):
+        """A slow provider cannot hold /ai/chat or /translate past AI_REQUEST_DEADLINE"""
+        import time
+        import types
+        import ai
+        import chat_sessions
+        import resilience
+        from cache import TTLCache
+
+        class SlowModel:
+            def __init__(self, name, system_instruction=None):
+                pass
+
+            def generate_content(self, prompt, request_options=None):
+                time.sleep((request_options or {}).get("timeout", 1))
+                raise TimeoutError("read timed out")
+
+        monkeypatch.setattr(resilience, "AI_REQUEST_DEADLINE", 0.1)
+        monkeypatch.setattr(ai, "build_ai_client", self.timing_out_client)
+        monkeypatch.setattr(ai, "_genai", lambda: types.SimpleNamespace(GenerativeModel=SlowModel))
+        monkeypatch.setattr(ai, "translation_cache", TTLCache("test_translation", 60, 100))
+        monkeypatch.setitem(resilience._breakers, "stub", resilience.CircuitBreaker("stub"))
+        monkeypatch.setitem(resilience._breakers, "gemini", resilience.CircuitBreaker("gemini"))
+        ai.shutdown_ai_clients()
+
+        started = time.monotonic()
+        body = client.post("/ai/chat", json={"message": "Is fever dangerous?"}).json()
+        assert time.monotonic() - started < 1
+        assert body["reply"].startswith("Sorry, I couldn't process that request right now.")
+        assert chat_sessions.load(body["session_id"])["turns"] == []
+
+        started = time.monotonic()
+        response = client.post("/translate", params={"text": "Drink water", "target_language": "Arabic"})
+        assert time.monotonic() - started < 1
+        assert response.json() == {"text": "Drink water"}
+        ai.shutdown_ai_clients()
+
+    def test_open_circuit_skips_provider(self, monkeypatch):
+        """Once a provider's breaker opens, calls fail fast without reaching it"""
+        import httpx
+        import ai
+        import resilience
+        upstream = []
+
+        def handler(request):
+            upstream.append(request)
+            return httpx.Response(503)
+
+        monkeypatch.setenv("AI_PROVIDER", "openrouter")
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setitem(resilience._breakers, "openrouter", resilience.CircuitBreaker("openrouter", 2, 60))
+        ai.shutdown_ai_clients()
+        ai.get_ai_client().http = httpx.Client(transport=httpx.MockTransport(handler))
+        messages = [{"role": "user", "content": "anyone there?"}]
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                ai.call_model(messages)
+        with pytest.raises(resilience.CircuitOpenError):
+            ai.call_model(messages)
+        body = client.post("/ai/triage-advice", json={"symptom": "chest pain", "language": "English"}).json()
+        ai.shutdown_ai_clients()
+        assert len(upstream) == 2
+        assert body["advice"].startswith("EMERGENCY:")
+        breakers = {b["provider"]: b for b in client.get("/ai/metrics").json()["breakers"]}
+        assert breakers["openrouter"]["state"] == "open"
+
+class TestChatSessions:
+    @pytest.fixture
+    def sessions(self, monkeypatch, tmp_path):
+        """A fresh file-backed session store and a stub model recording prompts"""
+        import ai
+        import chat_sessions
+        from cache import TTLCache
+        path = str(tmp_path / "sessions.db")
+        store = TTLCache("test_chat_sessions", 60, 100, path)
+        prompts = []
+
+        def fake_call_model(messages):
+            prompts.append(messages)
+            return f"reply {len(prompts)}"
+
+        monkeypatch.setattr(chat_sessions, "sessions", store)
+        monkeypatch.setattr(ai, "call_model", fake_call_model)
+        yield prompts, path
+        store.close()
+
+    def test_turns_send_only_the_new_message(self, sessions):
+        """The server keeps the history, and it survives a restart via SQLite"""
+        import chat_sessions
+        from cache import TTLCache
+        prompts, path = sessions
+        first = client.post("/ai/chat", json={"message": "I have a headache."}).json()
+        session_id = first["session_id"]
+        assert first["reply"].startswith("reply 1")
+
+        chat_sessions.sessions.close()
+        chat_sessions.sessions = TTLCache("test_chat_sessions", 60, 100, path)
+        second = client.post("/ai/chat", json={"message": "Since yesterday.", "session_id": session_id}).json()
+        assert second["session_id"] == session_id
+        conversation = [(m["role"], m["content"]) for m in prompts[-1] if m["role"] != "system"]
+        assert conversation == [("user", "I have a headache."), ("assistant", "reply 1"), ("user", "Since yesterday.")]
+
+    def test_history_is_windowed_with_rolling_summary(self):
+        """Old turns beyond the token budget become one summary line each; the newest stay verbatim"""
+        import chat_sessions
+        turns = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i} is here. " + "x" * 200} for i in range(10)]
+        kept, summary = chat_sessions.window(turns, budget=120)
+        assert kept == turns[-2:]
+        assert summary.splitlines()[0] == "User: Turn 0 is here."
+        assert len(summary.splitlines()) == 8
+        assert chat_sessions.estimate_tokens(chat_sessions.summarize(summary, turns, budget=20)) <= 20
+        assert chat_sessions.window([{"role": "user", "content": "y" * 10000}], budget=10)[0][0]["content"] == "y" * 10000
+
+    def test_failed_turn_is_not_stored(self, sessions, monkeypatch):
+        """A provider failure leaves the session unchanged so the message can be resent"""
+        import ai
+        import chat_sessions
+        monkeypatch.setattr(ai, "call_model", lambda messages: (_ for _ in ()).throw(RuntimeError("down")))
+        body = client.post("/ai/chat", json={"message": "hello"}).json()
+        assert "try again later" in body["reply"]
+        assert chat_sessions.load(body["session_id"])["turns"] == []
+
+    def test_sessions_beyond_memory_limit_survive_on_disk(self, monkeypatch, tmp_path):
+        """Pruning the SQLite store keeps live sessions that no longer fit in the LRU"""
+        import cache
+        from cache import TTLCache
+        monkeypatch.setattr(cache, "_PRUNE_EVERY", 5)
+        store = TTLCache("test_chat_sessions_disk", 60, 2, str(tmp_path / "sessions.db"), disk_max_entries=0)
+        for i in range(10):
+            store.set(f"s{i}", {"summary": "", "turns": [{"role": "user", "content": str(i)}]})
+        assert store.get("s0")["turns"][0]["content"] == "0"
+        store.close()
+
+        capped = TTLCache("test_capped", 60, 2, str(tmp_path / "capped.db"))
+        for i in range(10):
+            capped.set(f"k{i}", i)
+        assert capped.get("k0") is None
+        capped.close()
+
+    def test_requires_message_or_history(self):
+        """Requests with neither a message nor a history are rejected"""
+        assert client.post("/ai/chat", json={"session_id": "abc"}).status_code == 422
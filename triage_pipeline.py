@@ -0,0 +1,169 @@
+"""
+triage_pipeline.py - Multilingual AI triage advice
+
+Two modes, chosen with AI_TRIAGE_PIPELINE:
+
+- `single` (default): one structured model call detects the language,
+  reasons in English and writes the answer (and the safety disclaimer) in
+  the user's language. End-to-end latency is one model call.
+- `classic`: separate detection, translation, advice and back-translation
+  calls as before, with independent calls run concurrently (detection in
+  parallel with translating the symptom, the disclaimer in parallel with
+  the advice).
+
+Both run within the caller's request deadline (resilience.deadline), which
+worker threads inherit; a spent deadline or open circuit breaker surfaces
+as resilience.FailFast.
+"""
+
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import ai
+import language
+import resilience
+
+logger = logging.getLogger(__name__)
+
+AI_TRIAGE_PIPELINE = os.getenv("AI_TRIAGE_PIPELINE", "single").lower()
+AI_PIPELINE_WORKERS = int(os.getenv("AI_PIPELINE_WORKERS", "16"))
+# Share of the remaining deadline the classic advice call may use; the rest is left for translating it back
+CLASSIC_ADVICE_BUDGET = 0.75
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+STRUCTURED_INSTRUCTIONS = (
+    "\n\nReason about the case in English, then write the answer for the user in {language}. "
+    "Reply with only a JSON object with these keys:\n"
+    '"language": the language of the symptom description, in English (e.g. "Arabic"),\n'
+    '"severity": one of "EMERGENCY", "URGENT", "SELF-CARE",\n'
+    '"advice": the guidance and next steps, written in {language},\n'
+    '"disclaimer": this sentence translated into {language}: "{disclaimer}"'
+)
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=AI_PIPELINE_WORKERS, thread_name_prefix="triage")
+    return _executor
+
+
+def shutdown() -> None:
+    """Stop the worker threads; called on app shutdown."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def _known_language(req) -> Optional[str]:
+    """The request language, or the local detector's answer when it is confident."""
+    if req.language:
+        return req.language
+    detected, confidence = language.detect(req.symptom)
+    if detected is not None and confidence >= ai.LANG_DETECT_MIN_CONFIDENCE:
+        return detected
+    return None
+
+
+def _is_english(lang: Optional[str]) -> bool:
+    return (lang or "").lower() == "english"
+
+
+def parse_structured(reply: str) -> Optional[dict]:
+    """The JSON object of a structured reply, or None if the model did not follow the format."""
+    text = _FENCE.sub("", reply.strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("advice"), str):
+        return None
+    return data
+
+
+def run_single(req) -> Tuple[str, bool]:
+    """One structured call. Returns (advice with disclaimer, from_model)."""
+    known = _known_language(req)
+    target = known or "the same language as the symptom description"
+    messages = ai.get_triage_advice_payload(
+        symptom=req.symptom,
+        age=req.age,
+        sex=req.sex,
+        pregnant=req.pregnant,
+        chronic_conditions=req.chronic_conditions,
+        location=req.location,
+        language=target,
+    )
+    messages[-1] = {
+        "role": "user",
+        "content": messages[-1]["content"] + STRUCTURED_INSTRUCTIONS.format(
+            language=target, disclaimer=ai.SAFETY_DISCLAIMER.strip()
+        ),
+    }
+    reply, from_model = ai.cached_call(messages)
+    if not from_model:
+        return reply + ai.SAFETY_DISCLAIMER, False
+    data = parse_structured(reply)
+    if data is None:
+        # Answered, but not in the requested format: use the text as is
+        logger.warning("Structured triage reply was not valid JSON; using it verbatim")
+        data = {"advice": reply}
+    lang = known or data.get("language") or "English"
+    if _is_english(lang):
+        disclaimer = ai.SAFETY_DISCLAIMER
+    elif isinstance(data.get("disclaimer"), str) and data["disclaimer"].strip():
+        disclaimer = "\n\n" + data["disclaimer"].strip()
+    else:
+        # Only when the model left it out (cached after the first translation)
+        disclaimer = ai.translated_disclaimer(lang)
+    return data["advice"].strip() + disclaimer, True
+
+
+def run_classic(req) -> Tuple[str, bool]:
+    """Detect, translate, advise, translate back; independent calls run concurrently."""
+    pool = _pool()
+    lang = _known_language(req)
+    if lang is None:
+        # Translating to English does not depend on the detected language
+        lang_future = resilience.submit(pool, ai.detect_language, req.symptom)
+        symptom_future = resilience.submit(pool, ai.translate_text, req.symptom, "English")
+        lang = lang_future.result() or "English"
+        symptom_en = req.symptom if _is_english(lang) else symptom_future.result()
+    else:
+        symptom_en = req.symptom if _is_english(lang) else ai.translate_text(req.symptom, "English")
+
+    disclaimer_future = resilience.submit(pool, ai.translated_disclaimer, lang)
+    messages = ai.get_triage_advice_payload(
+        symptom=symptom_en,
+        age=req.age,
+        sex=req.sex,
+        pregnant=req.pregnant,
+        chronic_conditions=req.chronic_conditions,
+        location=req.location,
+        language="English",
+    )
+    if _is_english(lang):
+        advice, from_model = ai.cached_call(messages)
+    else:
+        with resilience.share(CLASSIC_ADVICE_BUDGET):
+            advice_en, from_model = ai.cached_call(messages)
+        advice = ai.translate_text(advice_en, lang, budget=1.0)
+    return advice + disclaimer_future.result(), from_model
+
+
+def run(req) -> Tuple[str, bool]:
+    """Triage advice for an AITriageAdviceRequest in the configured mode. Returns (advice, from_model)."""
+    if AI_TRIAGE_PIPELINE == "classic":
+        return run_classic(req)
+    return run_single(req)
@@ -0,0 +1,105 @@
+"""
+trigram.py - In-memory trigram index for typo-tolerant service search
+
+Each service is indexed as the set of pg_trgm-style word trigrams of its
+name, location and contact. A query is scored by the share of its trigrams
+found in a service (so "cty hospitl" still finds "City Hospital").
+
+Candidates are gathered with prefix filtering: a service sharing at least
+`t` of the query's `n` trigrams must appear in one of the `n - t + 1` rarest
+posting lists, so common trigrams are never scanned in full. Very broad
+queries stop collecting candidates at FUZZY_MAX_CANDIDATES.
+"""
+
+import heapq
+import itertools
+import math
+import os
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+import memindex
+
+FUZZY_MIN_SCORE = float(os.getenv("FUZZY_MIN_SCORE", "0.5"))
+# Stop gathering candidates past this many; keeps very broad queries bounded
+FUZZY_MAX_CANDIDATES = int(os.getenv("FUZZY_MAX_CANDIDATES", "2000"))
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Word trigrams of normalized text, each word padded like pg_trgm."""
+    grams: Set[str] = set()
+    for word in memindex.normalize(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class TrigramIndex:
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = {}
+        self._docs: Dict[int, FrozenSet[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._docs.clear()
+
+    def add(self, service_id: int, fields: Dict[str, str]) -> None:
+        grams = trigrams(" ".join(fields.values()))
+        self._docs[service_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(service_id)
+
+    def remove(self, service_id: int) -> None:
+        grams = self._docs.pop(service_id, None)
+        if not grams:
+            return
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(service_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def load(self, items: Iterable[Tuple[int, Dict[str, str]]]) -> None:
+        for service_id, fields in items:
+            self.add(service_id, fields)
+
+    def remove_many(self, service_ids: Iterable[int]) -> None:
+        for service_id in service_ids:
+            self.remove(service_id)
+
+    def replace(self, other: "TrigramIndex") -> None:
+        """Take over the contents of `other` (a freshly loaded index)."""
+        self._postings, self._docs = other._postings, other._docs
+
+    def search(self, query: str, limit: int = 20, min_score: float = FUZZY_MIN_SCORE) -> List[Tuple[int, float]]:
+        """Return up to `limit` (service_id, score) pairs, best first; score is in (0, 1]."""
+        q = trigrams(query)
+        if not q:
+            return []
+        required = max(1, math.ceil(min_score * len(q)))
+        by_rarity = sorted(q, key=lambda g: len(self._postings.get(g, ())))
+        candidates: Set[int] = set()
+        for gram in by_rarity[:len(q) - required + 1]:
+            room = FUZZY_MAX_CANDIDATES - len(candidates)
+            if room <= 0:
+                break
+            candidates.update(itertools.islice(self._postings.get(gram, ()), room))
+
+        # Rank by query coverage, then prefer tighter matches (Jaccard)
+        docs = self._docs
+        n = len(q)
+        scored = [
+            (shared / n, shared / (n + len(doc) - shared), -service_id)
+            for service_id in candidates
+            for doc in (docs[service_id],)
+            for shared in (len(q & doc),)
+            if shared >= required
+        ]
+        best = heapq.nlargest(limit, scored)
+        return [(-neg_id, round(coverage, 4)) for coverage, _, neg_id in best]
+
+
+index = memindex.register(TrigramIndex())